@@ -1,9 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, make_response, Response
 import uuid
 import time
+import json
+import zlib
+import atexit
+import click
+import queue
+import threading
 import os
 import re
 from datetime import datetime, date
+from concurrent.futures import Future
+
+from storage import open_store, migrate_store, file_signature, SharedRecord, SharedVersions, shared_memory_name
 
 # -------------------------
 # APP CONFIG
@@ -22,6 +31,8 @@ TAX_COLLECTION_FILE = os.path.join(DATA_DIR, "tax_collection.tsv")
 ORDERS_FILE = os.path.join(DATA_DIR, "orders.tsv")
 INTERNAL_MRX_FILE = os.path.join(DATA_DIR, "internal_mrx.tsv")
 DAILY_TRADES_FILE = os.path.join(DATA_DIR, "daily_trades.tsv")
+DAILY_TRADES_CURRENT_FILE = os.path.join(DATA_DIR, "daily_trades_current.tsv")
+ACCOUNT_EVENTS_FILE = os.path.join(DATA_DIR, "account_events.tsv")
 
 # -------------------------
 # FILE HEADERS
@@ -72,6 +83,11 @@ DAILY_TRADES_HEADER = (
     "date\tuser_email\ttotal_amount\ttransaction_count\tlast_updated\n"
 )
 
+ACCOUNT_EVENTS_HEADER = (
+    "event_id\tuser_email\tevent_type\trequest_id\tstatus\t"
+    "inr_balance\ttransaction_id\tcreated_at\n"
+)
+
 # -------------------------
 # CONSTANTS
 # -------------------------
@@ -81,10 +97,193 @@ MAX_SINGLE_ORDER = 1000.00
 DAILY_TRADING_LIMIT = 10000.00
 MIN_INR_POOL = 1000.00
 
+# Admin request/tax listings are served a page at a time
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_MAX = 200
+DEPOSIT_SEARCH_COLS = (0, 1, 3, 4)
+WITHDRAW_SEARCH_COLS = (0, 1, 2, 5, 6, 7)
+TAX_SEARCH_COLS = (0, 1, 2)
+USER_SEARCH_COLS = (0, 1, 2, 3)
+ADMIN_SEARCH_KINDS = ("users", "deposits", "withdrawals", "tax_records")
+
+# Request status and processed_at are padded to these widths in the TSV
+# files, so a status change is written over the old value in place. Other
+# readers of the request files (index.php, deposit.py) must strip the
+# padding; rows written unpadded are re-padded by the next rewrite.
+REQUEST_STATUS_WIDTH = len("processing")
+TIMESTAMP_WIDTH = 10
+
+# Requests still waiting on an admin, kept in a queue index per file
+DEPOSIT_QUEUE_STATUSES = ("pending",)
+WITHDRAW_QUEUE_STATUSES = ("pending", "processing")
+
+# -------------------------
+# DATA STORE
+# -------------------------
+# "tsv" (default): users, internal MRX, daily trades and the market live in
+# memory; changes are appended to data/ledger.wal and folded back into the
+# TSV files at checkpoints, while the other files are appended directly.
+# This app is then the only writer of those four files: index.php and
+# signup.php refuse to write them once data/ledger.wal exists, and only
+# read the checkpointed snapshots.
+# "sqlite": everything lives in data/unitedworld.db. Import the TSV files
+# with `flask --app app migrate-to-sqlite`.
+STORAGE_BACKEND = os.environ.get("UW_STORAGE_BACKEND", "tsv")
+
+def build_store(backend):
+    """Create a store for backend with every data file registered"""
+    s = open_store(backend, DATA_DIR)
+    s.table("users", USERS_FILE, USERS_HEADER, key_col=2, index_cols=(0,),
+            search_cols=USER_SEARCH_COLS)
+    s.table("internal_mrx", INTERNAL_MRX_FILE, INTERNAL_MRX_HEADER, key_col=0, sum_cols=(1,))
+    s.table("daily_trades", DAILY_TRADES_CURRENT_FILE, DAILY_TRADES_HEADER, key_col=(0, 1))
+    s.table("market", MARKET_FILE, MARKET_HEADER, key_col=())
+    s.log("transactions", TXN_FILE, TXN_HEADER, indexes=((1, 6), 6), lookup_cols=(1,))
+    s.log("withdraw_requests", WITHDRAW_REQUEST_FILE, WITHDRAW_REQUEST_HEADER, key_col=0,
+          indexes=((1, 8), (4, 8), 8), lookup_cols=(0,), totals=(4, 3),
+          search_cols=WITHDRAW_SEARCH_COLS,
+          fixed_cols={4: REQUEST_STATUS_WIDTH, 9: TIMESTAMP_WIDTH},
+          queue=(4, WITHDRAW_QUEUE_STATUSES))
+    s.log("deposit_requests", DEPOSIT_REQUEST_FILE, DEPOSIT_REQUEST_HEADER, key_col=0,
+          indexes=((1, 7), (6, 7), 7), lookup_cols=(0,), totals=(6, 2),
+          search_cols=DEPOSIT_SEARCH_COLS, fixed_cols={6: REQUEST_STATUS_WIDTH},
+          queue=(6, DEPOSIT_QUEUE_STATUSES))
+    s.log("admin_log", ADMIN_LOG_FILE, ADMIN_LOG_HEADER, indexes=(6,))
+    s.log("tax_collection", TAX_COLLECTION_FILE, TAX_COLLECTION_HEADER, indexes=((3, 8), 8),
+          totals=(3, 5), search_cols=TAX_SEARCH_COLS)
+    s.log("orders", ORDERS_FILE, ORDERS_HEADER, indexes=(1, 9))
+    s.log("daily_trades_archive", DAILY_TRADES_FILE, DAILY_TRADES_HEADER, indexes=((1, 0), 0))
+    s.log("account_events", ACCOUNT_EVENTS_FILE, ACCOUNT_EVENTS_HEADER, key_col=0, lookup_cols=(1,))
+    return s
+
+store = build_store(STORAGE_BACKEND)
+users_table = store.tables["users"]
+internal_mrx_table = store.tables["internal_mrx"]
+daily_trades_table = store.tables["daily_trades"]
+market_table = store.tables["market"]
+transactions_log = store.logs["transactions"]
+withdraw_requests_log = store.logs["withdraw_requests"]
+deposit_requests_log = store.logs["deposit_requests"]
+admin_log = store.logs["admin_log"]
+tax_collection_log = store.logs["tax_collection"]
+orders_log = store.logs["orders"]
+daily_trades_archive = store.logs["daily_trades_archive"]
+account_events_log = store.logs["account_events"]
+
+atexit.register(store.checkpoint)
+
+@app.cli.command("verify-counters")
+def verify_counters():
+    """Recount the per-status/per-type totals from the data and report drift"""
+    for log in (withdraw_requests_log, deposit_requests_log, tax_collection_log):
+        stored = log.totals()
+        rebuilt = log.rebuild_totals()
+        drift = [
+            (group, stored.get(group, [0, 0]), rebuilt.get(group, [0, 0]))
+            for group in sorted(set(stored) | set(rebuilt))
+            if stored.get(group, [0, 0])[0] != rebuilt.get(group, [0, 0])[0]
+            or abs(stored.get(group, [0, 0])[1] - rebuilt.get(group, [0, 0])[1]) > 0.005
+        ]
+        if not drift:
+            print(f"{log.name}: OK ({sum(count for count, amount in rebuilt.values())} rows)")
+            continue
+        for group, (count, amount), (new_count, new_amount) in drift:
+            print(f"{log.name}[{group}]: {count} / {amount:.2f} -> {new_count} / {new_amount:.2f}")
+        print(f"{log.name}: rebuilt")
+
+@app.cli.command("migrate-to-sqlite")
+def migrate_to_sqlite():
+    """Import the data/*.tsv files into data/unitedworld.db"""
+    ensure_files()
+    source = build_store("tsv")
+    source.checkpoint()
+    counts = migrate_store(source, store if STORAGE_BACKEND == "sqlite" else build_store("sqlite"))
+    for name, count in counts.items():
+        print(f"{name}: {count} rows")
+
+def _stress_worker(email, orders, amount):
+    """Place orders buys as email through the test client (runs in a child process)"""
+    import sys
+    sys.stdout = open(os.devnull, "w")
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user"] = email
+
+    placed, failed, to_pool, balance = 0, 0, 0.0, None
+    for _ in range(orders):
+        r = client.post("/api/accelerate-order", json={"amount": amount})
+        data = r.get_json() or {}
+        if r.status_code == 200 and data.get("success"):
+            placed += 1
+            to_pool += data["amount_to_pool"]
+            balance = data["new_inr_balance"]
+        else:
+            failed += 1
+    return placed, failed, to_pool, balance
+
+@app.cli.command("stress-buys")
+@click.option("--workers", default=8, help="Concurrent worker processes")
+@click.option("--orders", default=50, help="Buys per worker")
+@click.option("--amount", default=10.0, help="INR per buy")
+def stress_buys(workers, orders, amount):
+    """Run concurrent buys from several processes on a copy of data/ and check for lost updates"""
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    work = tempfile.mkdtemp(prefix="uw-stress-")
+    shutil.copytree(DATA_DIR, os.path.join(work, "data"),
+                    ignore=shutil.ignore_patterns("*.lock", "*.db-wal", "*.db-shm"))
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        s = build_store(STORAGE_BACKEND)
+        if STORAGE_BACKEND == "sqlite" and s.tables["market"].get(()) is None:
+            migrate_store(build_store("tsv"), s)
+        emails = [f"stress{i}@stress.test" for i in range(workers)]
+        for i, email in enumerate(emails):
+            s.tables["users"].put([f"STR{i:05d}", f"Stress {i}", email, "0", "x", "",
+                                   "1000000", "0", int(time.time())])
+        s.checkpoint()
+        inr_before, mrx_before = (float(v) for v in s.tables["market"].get(())[:2])
+        internal_before = s.tables["internal_mrx"].total(1)
+
+        started = time.time()
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            results = pool.starmap(_stress_worker, [(email, orders, amount) for email in emails])
+        elapsed = time.time() - started
+
+        s = build_store(STORAGE_BACKEND)
+        inr_after, mrx_after = (float(v) for v in s.tables["market"].get(())[:2])
+        internal_after = s.tables["internal_mrx"].total(1)
+        placed = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        expected_inr = inr_before + sum(r[2] for r in results)
+
+        # Each worker owns its user, so the wallet must end where its last buy left it
+        wallet_errors = 0
+        for email, (_, _, _, balance) in zip(emails, results):
+            stored = float(s.tables["users"].get(email)[6])
+            if balance is not None and abs(stored - balance) > 0.01:
+                wallet_errors += 1
+
+        print(f"backend: {STORAGE_BACKEND}, workers: {workers}, orders: {placed} placed / {failed} failed")
+        print(f"elapsed: {elapsed:.2f}s, throughput: {placed / elapsed:.1f} buys/s")
+        print(f"inr_pool: {inr_after:.2f} (expected {expected_inr:.2f})")
+        print(f"mrx moved: pool -{mrx_before - mrx_after:.6f}, internal +{internal_after - internal_before:.6f}")
+        print(f"wallets off: {wallet_errors}")
+        lost = (abs(inr_after - expected_inr) > 0.01 or wallet_errors
+                or abs((mrx_before - mrx_after) - (internal_after - internal_before)) > 1e-4)
+        print("LOST UPDATES DETECTED" if lost else "no lost updates")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
 # -------------------------
 # FILE INITIALIZATION
 # -------------------------
-def ensure_files():
+def _bootstrap_files():
+    """Create the data directory and any missing data file"""
     os.makedirs(DATA_DIR, exist_ok=True)
 
     if not os.path.exists(USERS_FILE):
@@ -134,82 +333,150 @@ def ensure_files():
         with open(DAILY_TRADES_FILE, "w") as f:
             f.write(DAILY_TRADES_HEADER)
 
+    if not os.path.exists(ACCOUNT_EVENTS_FILE):
+        with open(ACCOUNT_EVENTS_FILE, "w") as f:
+            f.write(ACCOUNT_EVENTS_HEADER)
+
+    if not os.path.exists(DAILY_TRADES_CURRENT_FILE):
+        # Split today's rows out of the archive into the live partition
+        today = date.today().isoformat()
+        with open(DAILY_TRADES_FILE, "r") as f:
+            lines = f.readlines()
+        current = [line for line in lines[1:] if line.split("\t")[0] == today]
+        with open(DAILY_TRADES_CURRENT_FILE, "w") as f:
+            f.write(DAILY_TRADES_HEADER)
+            f.writelines(current)
+        if current:
+            with open(DAILY_TRADES_FILE, "w") as f:
+                f.writelines(line for line in lines if line.split("\t")[0] != today)
+
+# Signature of DATA_DIR when the files were last known to exist. Creating,
+# deleting or renaming a file inside the directory changes its mtime, so one
+# stat is enough to tell whether the bootstrap has to run again.
+_data_dir_signature = None
+
+def ensure_files():
+    """Bootstrap the data files once; re-check only when DATA_DIR changes"""
+    global _data_dir_signature
+    signature = file_signature(DATA_DIR)
+    if signature is not None and signature == _data_dir_signature:
+        return
+    _bootstrap_files()
+    _data_dir_signature = file_signature(DATA_DIR)
+
+ensure_files()
+
+@app.cli.command("bench-stat-calls")
+def bench_stat_calls():
+    """Count filesystem stat calls per read-only route, with and without the ensure_files cache"""
+    routes = [
+        "/api/price", "/api/user-balance", "/api/daily-limit",
+        "/api/user/transactions?limit=10", "/api/deposit-history",
+        "/api/withdrawal-requests", "/api/admin/dashboard-stats",
+        "/api/admin/users", "/api/admin/withdrawal-requests?limit=20",
+    ]
+    admin = next((u for u in get_all_users() if is_admin(u["email"])), None)
+    if not admin:
+        print("No admin user found")
+        return
+
+    counts = {"stat": 0}
+    real_stat = os.stat
+
+    def counting_stat(*args, **kwargs):
+        counts["stat"] += 1
+        return real_stat(*args, **kwargs)
+
+    def run():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user"] = admin["email"]
+        results = {}
+        for route in routes:
+            client.get(route)  # warm up
+            counts["stat"] = 0
+            client.get(route)
+            results[route] = counts["stat"]
+        return results
+
+    global ensure_files
+    cached = ensure_files
+    os.stat = counting_stat
+    try:
+        ensure_files = _bootstrap_files
+        before = run()
+        ensure_files = cached
+        after = run()
+    finally:
+        os.stat = real_stat
+        ensure_files = cached
+
+    print(f"{'route':45} {'uncached':>9} {'cached':>7}")
+    for route in routes:
+        print(f"{route:45} {before[route]:>9} {after[route]:>7}")
+    print(f"{'total':45} {sum(before.values()):>9} {sum(after.values()):>7}")
+
 # -------------------------
 # DAILY TRADING LIMIT HELPERS
 # -------------------------
+# The daily_trades table only holds the current date: finished days are
+# moved to daily_trades.tsv the first time a process touches the limit data
+# after midnight, so limit checks never look at past days.
+_daily_trades_date = None
+
+def roll_daily_trades():
+    """Archive finished days out of the live daily trades partition. Returns today"""
+    global _daily_trades_date
+    today = date.today().isoformat()
+    if _daily_trades_date == today:
+        return today
+
+    with store.transaction("daily_trades") as txn:
+        finished = [cols for cols in daily_trades_table.rows() if cols[0] != today]
+        for cols in finished:
+            daily_trades_archive.append(cols, txn)
+        daily_trades_table.delete_many([(cols[0], cols[1]) for cols in finished], txn)
+
+    if finished:
+        print(f"DAILY TRADES ROLLOVER: Archived {len(finished)} rows before {today}")
+    _daily_trades_date = today
+    return today
+
 def get_user_daily_trades(user_email):
     """Get user's total trades for today"""
     ensure_files()
 
-    today = date.today().isoformat()
+    today = roll_daily_trades()
     daily_total = 0.0
 
-    if not os.path.exists(DAILY_TRADES_FILE):
-        return 0.0
-
     try:
-        with open(DAILY_TRADES_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 3 and cols[0] == today and cols[1] == user_email:
-                daily_total = float(cols[2]) if cols[2] else 0.0
-                break
+        cols = daily_trades_table.get((today, user_email))
+        if cols:
+            daily_total = float(cols[2]) if cols[2] else 0.0
     except:
         pass
 
     return daily_total
 
-def update_user_daily_trades(user_email, amount):
+def update_user_daily_trades(user_email, amount, txn=None):
     """Update user's daily trade total"""
     ensure_files()
 
-    today = date.today().isoformat()
-    rows = []
-    updated = False
-
-    if os.path.exists(DAILY_TRADES_FILE):
-        with open(DAILY_TRADES_FILE, "r") as f:
-            rows = f.readlines()
-
-    with open(DAILY_TRADES_FILE, "w") as f:
-        if rows and rows[0].startswith("date"):
-            f.write(rows[0])
-        else:
-            f.write(DAILY_TRADES_HEADER)
-
-        for line in rows[1:]:
-            if not line.strip():
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 3 and cols[0] == today and cols[1] == user_email:
-                # Update existing record
-                current_total = float(cols[2]) if cols[2] else 0.0
-                current_count = int(cols[3]) if len(cols) > 3 and cols[3] else 0
-                new_total = current_total + amount
-                new_count = current_count + 1
-
-                cols[2] = str(round(new_total, 2))
-                cols[3] = str(new_count) if len(cols) > 3 else str(new_count)
-                if len(cols) > 4:
-                    cols[4] = str(int(time.time()))
-                else:
-                    cols.append(str(int(time.time())))
+    today = roll_daily_trades()
+    new_total = amount
+    new_count = 1
 
-                f.write("\t".join(cols) + "\n")
-                updated = True
-            else:
-                f.write(line)
+    cols = daily_trades_table.get((today, user_email))
+    if cols:
+        current_total = float(cols[2]) if cols[2] else 0.0
+        current_count = int(cols[3]) if len(cols) > 3 and cols[3] else 0
+        new_total = current_total + amount
+        new_count = current_count + 1
 
-        if not updated:
-            # Create new record for today
-            new_total = amount
-            f.write(f"{today}\t{user_email}\t{round(new_total, 2)}\t1\t{int(time.time())}\n")
+    daily_trades_table.put([today, user_email, round(new_total, 2), new_count, int(time.time())], txn)
+    touch_account(user_email, txn)
 
-    return new_total if updated else amount
+    return new_total
 
 def check_daily_trading_limit(user_email, amount):
     """Check if user has exceeded daily trading limit"""
@@ -229,88 +496,37 @@ def get_internal_mrx_balance(user_email):
     """Get user's internal MRX balance (hidden from user)"""
     ensure_files()
 
-    if not os.path.exists(INTERNAL_MRX_FILE):
-        return 0.0
-
     try:
-        with open(INTERNAL_MRX_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 2 and cols[0] == user_email:
-                return float(cols[1]) if cols[1] else 0.0
+        cols = internal_mrx_table.get(user_email)
+        if cols and len(cols) >= 2:
+            return float(cols[1]) if cols[1] else 0.0
     except:
         pass
 
     return 0.0
 
-def update_internal_mrx_balance(user_email, new_mrx_balance):
+def update_internal_mrx_balance(user_email, new_mrx_balance, txn=None):
     """Update user's internal MRX balance"""
     ensure_files()
 
-    rows = []
-    updated = False
-
-    if os.path.exists(INTERNAL_MRX_FILE):
-        with open(INTERNAL_MRX_FILE, "r") as f:
-            rows = f.readlines()
-
-    with open(INTERNAL_MRX_FILE, "w") as f:
-        if rows and rows[0].startswith("user_email"):
-            f.write(rows[0])
-        else:
-            f.write(INTERNAL_MRX_HEADER)
-
-        for line in rows[1:]:
-            if not line.strip():
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 2 and cols[0] == user_email:
-                cols[1] = str(round(new_mrx_balance, 6))
-                cols[2] = str(int(time.time())) if len(cols) > 2 else str(int(time.time()))
-                f.write("\t".join(cols) + "\n")
-                updated = True
-            else:
-                f.write(line)
-
-        if not updated:
-            f.write(f"{user_email}\t{round(new_mrx_balance, 6)}\t{int(time.time())}\n")
+    internal_mrx_table.put([user_email, round(new_mrx_balance, 6), int(time.time())], txn)
+    touch_account(user_email, txn)
 
     return new_mrx_balance
 
 def get_total_internal_mrx():
-    """Get total internal MRX across all users"""
+    """Get total internal MRX across all users (kept as a running total)"""
     ensure_files()
 
-    if not os.path.exists(INTERNAL_MRX_FILE):
-        return 0.0
-
-    total = 0.0
     try:
-        with open(INTERNAL_MRX_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 2 and cols[1]:
-                try:
-                    total += float(cols[1])
-                except:
-                    continue
+        return internal_mrx_table.total(1)
     except:
-        pass
-
-    return total
+        return 0.0
 
 # -------------------------
 # TAX COLLECTION HELPERS
 # -------------------------
-def log_tax_collection(user_email, user_name, order_type, order_amount, tax_amount, order_worth, remarks=""):
+def log_tax_collection(user_email, user_name, order_type, order_amount, tax_amount, order_worth, remarks="", txn=None):
     """Log tax collection to separate file"""
     ensure_files()
 
@@ -318,73 +534,33 @@ def log_tax_collection(user_email, user_name, order_type, order_amount, tax_amou
     timestamp = int(time.time())
     order_date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
-    with open(TAX_COLLECTION_FILE, "a") as f:
-        f.write(
-            f"{tax_id}\t{user_email}\t{user_name}\t{order_type}\t"
-            f"{order_amount}\t{tax_amount}\t{order_worth}\t"
-            f"{order_date}\t{timestamp}\t{remarks}\n"
-        )
+    tax_collection_log.append([
+        tax_id, user_email, user_name, order_type,
+        order_amount, tax_amount, order_worth,
+        order_date, timestamp, remarks
+    ], txn)
 
     return tax_id
 
 def get_tax_collection_stats():
-    """Get tax collection statistics"""
+    """Get tax collection statistics from the running per-type totals"""
     ensure_files()
 
-    if not os.path.exists(TAX_COLLECTION_FILE):
-        return {
-            'total_tax': 0,
-            'total_transactions': 0,
-            'buy_tax': 0,
-            'withdrawal_tax': 0,
-            'sell_tax': 0,
-            'deposit_tax': 0
-        }
-
-    total_tax = 0
-    total_transactions = 0
-    buy_tax = 0
-    withdrawal_tax = 0
-    sell_tax = 0
-    deposit_tax = 0
-
     try:
-        with open(TAX_COLLECTION_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-
-            line = line.strip()
-            if not line:
-                continue
-
-            cols = line.split("\t")
-            if len(cols) >= 9:
-                total_transactions += 1
-                tax_amount = float(cols[5]) if cols[5] else 0
-                total_tax += tax_amount
-
-                order_type = cols[3] if len(cols) > 3 else ""
-                if order_type == "buy":
-                    buy_tax += tax_amount
-                elif order_type == "withdrawal":
-                    withdrawal_tax += tax_amount
-                elif order_type == "sell":
-                    sell_tax += tax_amount
-                elif order_type == "deposit":
-                    deposit_tax += tax_amount
+        totals = tax_collection_log.totals()
     except:
-        pass
+        totals = {}
+
+    def tax_for(order_type):
+        return totals.get(order_type, [0, 0])[1]
 
     return {
-        'total_tax': round(total_tax, 2),
-        'total_transactions': total_transactions,
-        'buy_tax': round(buy_tax, 2),
-        'withdrawal_tax': round(withdrawal_tax, 2),
-        'sell_tax': round(sell_tax, 2),
-        'deposit_tax': round(deposit_tax, 2)
+        'total_tax': round(sum(amount for count, amount in totals.values()), 2),
+        'total_transactions': sum(count for count, amount in totals.values()),
+        'buy_tax': round(tax_for("buy"), 2),
+        'withdrawal_tax': round(tax_for("withdrawal"), 2),
+        'sell_tax': round(tax_for("sell"), 2),
+        'deposit_tax': round(tax_for("deposit"), 2)
     }
 
 def get_tax_collection_records(limit=100):
@@ -393,87 +569,176 @@ def get_tax_collection_records(limit=100):
 
     records = []
 
-    if not os.path.exists(TAX_COLLECTION_FILE):
-        return records
-
     try:
-        with open(TAX_COLLECTION_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
+        rows = tax_collection_log.select(order_by=8, desc=True, limit=limit)
+    except:
+        return records
 
-            line = line.strip()
-            if not line:
-                continue
+    for cols in rows:
+        record = _tax_record_from_cols(cols)
+        if record:
+            records.append(record)
+
+    return records
+
+def _tax_record_from_cols(cols):
+    if len(cols) >= 9:
+        try:
+            return {
+                'tax_id': cols[0],
+                'user_email': cols[1],
+                'user_name': cols[2],
+                'order_type': cols[3],
+                'order_amount': float(cols[4]) if cols[4] else 0,
+                'tax_amount': float(cols[5]) if cols[5] else 0,
+                'order_worth': float(cols[6]) if cols[6] else 0,
+                'order_date': cols[7],
+                'timestamp': int(cols[8]) if cols[8] else 0,
+                'remarks': cols[9] if len(cols) > 9 else ""
+            }
+        except:
+            pass
+    return None
 
-            cols = line.split("\t")
-            if len(cols) >= 9:
-                records.append({
-                    'tax_id': cols[0],
-                    'user_email': cols[1],
-                    'user_name': cols[2],
-                    'order_type': cols[3],
-                    'order_amount': float(cols[4]) if cols[4] else 0,
-                    'tax_amount': float(cols[5]) if cols[5] else 0,
-                    'order_worth': float(cols[6]) if cols[6] else 0,
-                    'order_date': cols[7],
-                    'timestamp': int(cols[8]) if cols[8] else 0,
-                    'remarks': cols[9] if len(cols) > 9 else ""
-                })
-    except:
-        pass
+def get_tax_record_page(order_type="", user="", since=None, until=None, search="",
+                        cursor=None, limit=ADMIN_PAGE_SIZE):
+    """One page of tax records, newest first, filtered in the reader.
 
-    records.sort(key=lambda x: x['timestamp'], reverse=True)
-    return records[:limit]
+    Returns (records, next_cursor). Raises ValueError for a bad cursor.
+    """
+    ensure_files()
+    where = {}
+    if order_type:
+        where[3] = order_type
+    if user:
+        where[1] = user
+    rows, next_cursor = tax_collection_log.page(
+        order_by=8, where=where, after=cursor, limit=limit, since=since, until=until,
+        search=(TAX_SEARCH_COLS, search), tie_col=0
+    )
+    records = []
+    for cols in rows:
+        record = _tax_record_from_cols(cols)
+        if record:
+            records.append(record)
+    return records, next_cursor
+
+def get_tax_record_totals(order_type="", user="", since=None, until=None, search=""):
+    """(record count, tax total) over every tax record matching the filters
+    get_tax_record_page applies.
+
+    Filtering on the order type alone reads the running per-type totals;
+    a user, date range or search pages through the matching records.
+    """
+    ensure_files()
+    if not user and since is None and until is None and not search:
+        totals = tax_collection_log.totals()
+        if order_type:
+            totals = {order_type: totals.get(order_type, [0, 0])}
+        return (sum(count for count, amount in totals.values()),
+                sum(amount for count, amount in totals.values()))
+
+    count, total, cursor = 0, 0.0, None
+    while True:
+        records, cursor = get_tax_record_page(order_type, user, since, until, search,
+                                              cursor=cursor, limit=ADMIN_PAGE_MAX)
+        count += len(records)
+        total += sum(r['tax_amount'] for r in records)
+        if cursor is None:
+            return count, total
 
 # -------------------------
 # ORDER TRACKING HELPERS
 # -------------------------
 def save_order_record(user_email, user_name, order_type, order_amount_inr,
-                     order_amount_mrx, price_at_order, tax_amount, remarks=""):
+                     order_amount_mrx, price_at_order, tax_amount, remarks="", txn=None):
     """Save order details"""
     ensure_files()
 
     order_id = f"ORD{int(time.time())}{uuid.uuid4().hex[:6].upper()}"
     created_at = int(time.time())
 
-    with open(ORDERS_FILE, "a") as f:
-        f.write(
-            f"{order_id}\t{user_email}\t{user_name}\t{order_type}\t"
-            f"{order_amount_inr}\t{order_amount_mrx}\t{price_at_order}\t"
-            f"{tax_amount}\tcompleted\t{created_at}\t{remarks}\n"
-        )
+    orders_log.append([
+        order_id, user_email, user_name, order_type,
+        order_amount_inr, order_amount_mrx, price_at_order,
+        tax_amount, "completed", created_at, remarks
+    ], txn)
 
     return order_id
 
 # -------------------------
 # MARKET HELPERS WITH PRICE FLOOR VALIDATION
 # -------------------------
-def read_market():
-    try:
-        with open(MARKET_FILE, "r") as f:
-            lines = f.readlines()
+# The pool state is mirrored into a shared-memory record (inr_pool,
+# mrx_pool, last_updated) so every worker reads the price without opening
+# market.tsv. Writers publish to it from inside the market write lock after
+# the commit; market.tsv stays the durable copy and is reloaded into the
+# record once per process, by the first thread that needs it.
+market_state = None
+_market_state_pid = None
+_market_state_lock = threading.Lock()
+
+def _load_market_state():
+    global market_state, _market_state_pid
+    # The read lock keeps market writers, which also publish to the record,
+    # out between the read and the copy; seeding processes may overlap, but
+    # copy the same committed values. It is taken before the thread lock:
+    # a writer that gets here already holds it.
+    with store.read_lock("market"), _market_state_lock:
+        if _market_state_pid == os.getpid():
+            return
+        record = SharedRecord(shared_memory_name("uw_market", DATA_DIR), "ddq")
+        if record.open():
+            record.write(*_read_market_table())
+            market_state = record
+        else:
+            market_state = None
+        _market_state_pid = os.getpid()
 
-        if len(lines) < 2:
-            return 2000.0, 1000.0
+def _read_market_table():
+    try:
+        cols = market_table.get(())
+        if not cols:
+            return 2000.0, 1000.0, 0
 
-        cols = lines[1].strip().split("\t")
-        return float(cols[0]), float(cols[1])
+        return float(cols[0]), float(cols[1]), int(cols[2]) if len(cols) > 2 and cols[2] else 0
     except:
-        return 2000.0, 1000.0
+        return 2000.0, 1000.0, 0
+
+def read_market_state():
+    """(inr_pool, mrx_pool, last_updated), from shared memory when available"""
+    if _market_state_pid != os.getpid():
+        _load_market_state()
+
+    values = market_state.read() if market_state else None
+    if values:
+        return values
 
-def write_market(inr_pool, mrx_pool):
+    return _read_market_table()
+
+def read_market():
+    inr_pool, mrx_pool, _ = read_market_state()
+    return inr_pool, mrx_pool
+
+def write_market(inr_pool, mrx_pool, txn=None):
     """Write market state with price floor validation"""
     if mrx_pool > 0:
         new_price = inr_pool / mrx_pool
         if new_price < PRICE_FLOOR:
             raise ValueError(f"Cannot set market: Price would be ₹{new_price:.4f} which is below ₹{PRICE_FLOOR:.2f} floor")
 
-    with open(MARKET_FILE, "w") as f:
-        f.write(MARKET_HEADER)
-        f.write(f"{round(inr_pool,2)}\t{round(mrx_pool,6)}\t{int(time.time())}\n")
+    if txn is None:
+        with store.transaction("market") as txn:
+            return write_market(inr_pool, mrx_pool, txn)
+
+    if _market_state_pid != os.getpid():
+        _load_market_state()
+
+    cols = [round(inr_pool, 2), round(mrx_pool, 6), int(time.time())]
+    market_table.put(cols, txn)
+    if market_state:
+        txn.on_commit(lambda: market_state.write(*cols))
+    txn.on_commit(price_broadcaster.notify)
 
 def validate_price_floor(new_inr_pool, new_mrx_pool):
     """Validate that new pool state maintains minimum price"""
@@ -486,80 +751,192 @@ def validate_price_floor(new_inr_pool, new_mrx_pool):
 
     return True, f"Price: ₹{new_price:.4f}"
 
+# -------------------------
+# ACCOUNT VERSIONS (CONDITIONAL GET)
+# -------------------------
+# Every write to a user's wallet, internal MRX or daily trades touches that
+# account's version token in shared memory, so /api/user-balance can answer
+# If-None-Match without reading any table.
+ACCOUNT_VERSION_SLOTS = 16384
+account_versions = None
+
+def _account_versions():
+    global account_versions
+    if account_versions is None:
+        versions = SharedVersions(shared_memory_name("uw_accounts", DATA_DIR), ACCOUNT_VERSION_SLOTS)
+        versions.open()
+        account_versions = versions
+    return account_versions
+
+def touch_account(email, txn=None):
+    """Mark email's balance data changed, once txn (if any) has committed"""
+    versions = _account_versions()
+    if txn is not None:
+        txn.on_commit(lambda: versions.touch(email))
+    else:
+        versions.touch(email)
+
+def market_etag(market=None):
+    inr_pool, mrx_pool, updated = market or read_market_state()
+    return f"m{updated}-{zlib.crc32(f'{inr_pool!r}/{mrx_pool!r}'.encode()):08x}"
+
+def account_etag(email):
+    """ETag for email's balance view, or None if versions are unavailable"""
+    version = _account_versions().get(email)
+    if version is None:
+        return None
+    return f"u{zlib.crc32(email.encode()):08x}-{version:x}-{market_etag()}-{date.today().isoformat()}"
+
+def conditional_json(etag, build):
+    """304 if the client's If-None-Match matches etag, else jsonify(build())"""
+    if etag and request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# -------------------------
+# ACCOUNT EVENTS
+# -------------------------
+def publish_account_event(user_email, event_type, request_id, status, inr_balance, transaction_id="", txn=None):
+    """Record a deposit/withdrawal status change for the user's account stream"""
+    event_id = f"EVT{int(time.time())}{uuid.uuid4().hex[:6].upper()}"
+    account_events_log.append([
+        event_id, user_email, event_type, request_id, status,
+        round(inr_balance, 2), transaction_id, int(time.time())
+    ], txn)
+    touch_account(user_email, txn)
+    if txn is not None:
+        txn.on_commit(account_broadcaster.notify)
+    else:
+        account_broadcaster.notify()
+    return event_id
+
+def get_account_events(user_email):
+    """All of the user's account events, oldest first"""
+    try:
+        return account_events_log.select(where={1: user_email})
+    except:
+        return []
+
 # -------------------------
 # USER HELPERS
 # -------------------------
 def get_user(email):
     try:
-        with open(USERS_FILE, "r") as f:
-            for line in f:
-                if line.startswith("user_id"):
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and cols[2] == email:
-                    return cols
+        return users_table.get(email)
     except:
-        pass
+        return None
+
+def get_user_by_id(user_id):
+    try:
+        return users_table.get_by(0, user_id)
+    except:
+        return None
+
+def _user_from_cols(cols):
+    if len(cols) >= 8:
+        try:
+            return {
+                'user_id': cols[0],
+                'full_name': cols[1],
+                'email': cols[2],
+                'mobile': cols[3],
+                'inr_balance': float(cols[6]),
+                'mrx_balance': 0.0,
+                'created_at': int(cols[8])
+            }
+        except:
+            return None
     return None
 
 def get_all_users():
     users = []
     try:
-        with open(USERS_FILE, "r") as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                if i == 0:
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 8:
-                    users.append({
-                        'user_id': cols[0],
-                        'full_name': cols[1],
-                        'email': cols[2],
-                        'mobile': cols[3],
-                        'inr_balance': float(cols[6]),
-                        'mrx_balance': 0.0,
-                        'created_at': int(cols[8])
-                    })
+        rows = users_table.rows()
     except:
-        pass
+        return users
+
+    for cols in rows:
+        user = _user_from_cols(cols)
+        if user:
+            users.append(user)
     return users
 
-def update_user_balances(email, new_inr, new_mrx):
-    """Update user balances - MRX always 0"""
-    try:
-        rows = []
-        with open(USERS_FILE, "r") as f:
-            rows = f.readlines()
+def build_user_report():
+    """Every user with holdings and today's trading, for the admin Users page.
 
-        with open(USERS_FILE, "w") as f:
-            for line in rows:
-                if line.startswith("user_id"):
-                    f.write(line)
-                    continue
+    Reads users, internal MRX and today's daily trades once each, joins them
+    by email and values holdings at a single market snapshot.
+    Returns (users, price).
+    """
+    inr_pool, mrx_pool = read_market()
+    price = inr_pool / mrx_pool if mrx_pool > 0 else 0
 
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and cols[2] == email:
-                    cols[6] = str(round(new_inr, 2))
-                    cols[7] = "0"
-                    f.write("\t".join(cols) + "\n")
-                else:
-                    f.write(line)
-        return True
+    internal = {}
+    for cols in internal_mrx_table.rows():
+        if len(cols) >= 2:
+            try:
+                internal[cols[0]] = float(cols[1]) if cols[1] else 0.0
+            except:
+                continue
+
+    today = roll_daily_trades()
+    daily = {}
+    for cols in daily_trades_table.rows():
+        if len(cols) >= 3 and cols[0] == today:
+            try:
+                daily[cols[1]] = float(cols[2]) if cols[2] else 0.0
+            except:
+                continue
+
+    users = []
+    for cols in users_table.rows():
+        user = _user_from_cols(cols)
+        if not user:
+            continue
+        internal_mrx = internal.get(user['email'], 0.0)
+        daily_total = daily.get(user['email'], 0.0)
+
+        # Calculate total value including internal MRX
+        user['total_value'] = round(user['inr_balance'] + (internal_mrx * price), 2)
+        user['is_admin'] = _is_admin_row(cols)
+        user['internal_mrx_balance'] = internal_mrx
+
+        # Add daily trading info
+        user['daily_trades_today'] = round(daily_total, 2)
+        user['daily_remaining'] = round(DAILY_TRADING_LIMIT - user['daily_trades_today'], 2)
+        user['daily_limit_reached'] = user['daily_trades_today'] >= DAILY_TRADING_LIMIT
+        users.append(user)
+
+    return users, price
+
+def update_user_balances(email, new_inr, new_mrx, txn=None):
+    """Update user balances - MRX always 0"""
+    try:
+        updated = users_table.update(email, {6: round(new_inr, 2), 7: "0"}, txn) is not None
     except:
         return False
+    touch_account(email, txn)
+    return updated
 
 def is_admin(email):
     """Check if user is admin"""
     user = get_user(email)
     if not user:
         return False
-    return 'admin' in email.lower() or (len(user) > 0 and user[0].startswith('ADM'))
+    return _is_admin_row(user)
+
+def _is_admin_row(cols):
+    return 'admin' in cols[2].lower() or (len(cols) > 0 and cols[0].startswith('ADM'))
 
 # -------------------------
 # ADMIN LOGGING
 # -------------------------
-def log_admin_action(admin_email, action, target_id, target_type, details=""):
+def log_admin_action(admin_email, action, target_id, target_type, details="", txn=None):
     """Log admin actions for audit trail"""
     ensure_files()
 
@@ -568,11 +945,10 @@ def log_admin_action(admin_email, action, target_id, target_type, details=""):
     ip_address = request.remote_addr if request else "0.0.0.0"
 
     try:
-        with open(ADMIN_LOG_FILE, "a") as f:
-            f.write(
-                f"{log_id}\t{admin_email}\t{action}\t{target_id}\t{target_type}\t"
-                f"{details}\t{timestamp}\t{ip_address}\n"
-            )
+        admin_log.append([
+            log_id, admin_email, action, target_id, target_type,
+            details, timestamp, ip_address
+        ], txn)
     except:
         pass
 
@@ -583,18 +959,14 @@ def get_recent_admin_logs(limit=50):
     ensure_files()
     logs = []
 
-    if not os.path.exists(ADMIN_LOG_FILE):
-        return logs
-
     try:
-        with open(ADMIN_LOG_FILE, "r") as f:
-            lines = f.readlines()
+        rows = admin_log.select(order_by=6, desc=True, limit=limit)
+    except:
+        return logs
 
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 8:
+    for cols in rows:
+        if len(cols) >= 8:
+            try:
                 logs.append({
                     'log_id': cols[0],
                     'admin_email': cols[1],
@@ -605,11 +977,10 @@ def get_recent_admin_logs(limit=50):
                     'timestamp': int(cols[6]),
                     'ip_address': cols[7]
                 })
-    except:
-        pass
+            except:
+                continue
 
-    logs.sort(key=lambda x: x['timestamp'], reverse=True)
-    return logs[:limit]
+    return logs
 
 # -------------------------
 # DEPOSIT REQUEST HELPERS
@@ -620,11 +991,10 @@ def save_deposit_request(user_email, amount, txn_id, phone, method):
     request_id = f"DPR{int(time.time())}{uuid.uuid4().hex[:6].upper()}"
     created_at = int(time.time())
 
-    with open(DEPOSIT_REQUEST_FILE, "a") as f:
-        f.write(
-            f"{request_id}\t{user_email}\t{amount}\t{txn_id}\t"
-            f"{phone}\t{method}\tpending\t{created_at}\n"
-        )
+    deposit_requests_log.append([
+        request_id, user_email, amount, txn_id,
+        phone, method, "pending", created_at
+    ])
 
     return request_id
 
@@ -632,193 +1002,291 @@ def get_user_deposit_requests(user_email, limit=10):
     ensure_files()
     deposits = []
 
-    if not os.path.exists(DEPOSIT_REQUEST_FILE):
-        return deposits
-
     try:
-        with open(DEPOSIT_REQUEST_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 8 and cols[1] == user_email:
-                deposits.append({
-                    "request_id": cols[0],
-                    "amount": float(cols[2]),
-                    "transaction_id": cols[3],
-                    "phone": cols[4],
-                    "payment_method": cols[5],
-                    "status": cols[6],
-                    "created_at": int(cols[7])
-                })
+        rows = deposit_requests_log.select(where={1: user_email}, order_by=7, desc=True, limit=limit)
     except:
-        pass
+        return deposits
 
-    deposits.sort(key=lambda x: x["created_at"], reverse=True)
-    return deposits[:limit]
+    for cols in rows:
+        deposit = _user_deposit_from_cols(cols)
+        if deposit:
+            deposits.append(deposit)
+
+    return deposits
+
+def _user_deposit_from_cols(cols):
+    if len(cols) >= 8:
+        try:
+            return {
+                "request_id": cols[0],
+                "amount": float(cols[2]),
+                "transaction_id": cols[3],
+                "phone": cols[4],
+                "payment_method": cols[5],
+                "status": cols[6],
+                "created_at": int(cols[7])
+            }
+        except:
+            pass
+    return None
 
 def get_all_deposit_requests(limit=50):
     ensure_files()
     deposits = []
 
-    if not os.path.exists(DEPOSIT_REQUEST_FILE):
+    try:
+        rows = deposit_requests_log.select(order_by=7, desc=True, limit=limit)
+    except:
         return deposits
 
-    try:
-        with open(DEPOSIT_REQUEST_FILE, "r") as f:
-            lines = f.readlines()
+    for cols in rows:
+        deposit = _deposit_from_cols(cols)
+        if deposit:
+            deposits.append(deposit)
+
+    return deposits
+
+def _deposit_from_cols(cols):
+    if len(cols) >= 8:
+        try:
+            return {
+                "request_id": cols[0],
+                "user_email": cols[1],
+                "amount": float(cols[2]),
+                "transaction_id": cols[3],
+                "phone": cols[4],
+                "payment_method": cols[5],
+                "status": cols[6],
+                "created_at": int(cols[7])
+            }
+        except:
+            pass
+    return None
 
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
-            cols = line.strip().split("\t")
-            if len(cols) >= 8:
-                deposits.append({
-                    "request_id": cols[0],
-                    "user_email": cols[1],
-                    "amount": float(cols[2]),
-                    "transaction_id": cols[3],
-                    "phone": cols[4],
-                    "payment_method": cols[5],
-                    "status": cols[6],
-                    "created_at": int(cols[7])
-                })
-    except:
-        pass
+def get_deposit_request_page(status="", user="", since=None, until=None, search="",
+                             cursor=None, limit=ADMIN_PAGE_SIZE):
+    """One page of deposit requests, newest first, filtered in the reader.
 
-    deposits.sort(key=lambda x: x["created_at"], reverse=True)
-    return deposits[:limit]
+    Returns (deposits, next_cursor). Raises ValueError for a bad cursor.
+    """
+    ensure_files()
+    where = {}
+    if status:
+        where[6] = status
+    if user:
+        where[1] = user
+    rows, next_cursor = deposit_requests_log.page(
+        order_by=7, where=where, after=cursor, limit=limit, since=since, until=until,
+        search=(DEPOSIT_SEARCH_COLS, search)
+    )
+    deposits = []
+    for cols in rows:
+        deposit = _deposit_from_cols(cols)
+        if deposit:
+            deposits.append(deposit)
+    return deposits, next_cursor
 
 def update_deposit_request_status(request_id, status, admin_email=""):
     ensure_files()
 
-    if not os.path.exists(DEPOSIT_REQUEST_FILE):
-        return False
-
-    rows = []
     updated = False
-    deposit_info = None
 
     try:
-        with open(DEPOSIT_REQUEST_FILE, "r") as f:
-            rows = f.readlines()
-
-        with open(DEPOSIT_REQUEST_FILE, "w") as f:
-            for line in rows:
-                if line.startswith("request_id"):
-                    f.write(line)
-                    continue
+        # The status change, balance credit, transaction and audit entry
+        # are committed together.
+        with store.transaction("deposit_requests", "users") as txn:
+            cols = deposit_requests_log.get(request_id)
+            if not cols or len(cols) < 7:
+                return False
+
+            deposit_info = None
+            if status == "approved" and cols[6] != "approved":
+                deposit_info = {
+                    "user_email": cols[1],
+                    "amount": float(cols[2])
+                }
 
-                cols = line.strip().split("\t")
-                if cols[0] == request_id:
-                    if status == "approved" and cols[6] != "approved":
-                        deposit_info = {
-                            "user_email": cols[1],
-                            "amount": float(cols[2])
-                        }
-
-                    cols[6] = status
-                    updated = True
-                    f.write("\t".join(cols) + "\n")
-                else:
-                    f.write(line)
+            deposit_requests_log.update(request_id, {6: status}, txn)
+            updated = True
 
-        if updated and status == "approved" and deposit_info:
-            user = get_user(deposit_info["user_email"])
-            if user:
-                current_inr = float(user[6])
-                new_inr = current_inr + deposit_info["amount"]
-                update_user_balances(deposit_info["user_email"], new_inr, 0)
-
-                save_transaction(
-                    deposit_info["user_email"],
-                    'deposit_approved',
-                    deposit_info["amount"],
-                    0,
-                    0
-                )
+            user = get_user(cols[1])
+            inr_balance = float(user[6]) if user else 0
+            transaction_id = ""
 
-                if admin_email:
-                    log_admin_action(
-                        admin_email,
-                        "deposit_approved",
-                        request_id,
-                        "deposit_request",
-                        f"Approved deposit of ₹{deposit_info['amount']} for {deposit_info['user_email']}"
+            if deposit_info:
+                if user:
+                    current_inr = float(user[6])
+                    new_inr = current_inr + deposit_info["amount"]
+                    update_user_balances(deposit_info["user_email"], new_inr, 0, txn)
+                    inr_balance = new_inr
+
+                    transaction_id = save_transaction(
+                        deposit_info["user_email"],
+                        'deposit_approved',
+                        deposit_info["amount"],
+                        0,
+                        0,
+                        txn
                     )
+
+                    if admin_email:
+                        log_admin_action(
+                            admin_email,
+                            "deposit_approved",
+                            request_id,
+                            "deposit_request",
+                            f"Approved deposit of ₹{deposit_info['amount']} for {deposit_info['user_email']}",
+                            txn
+                        )
+
+            publish_account_event(cols[1], "deposit", request_id, status, inr_balance, transaction_id, txn)
     except:
-        pass
+        return False
 
     return updated
 
+# -------------------------
+# BULK DEPOSIT APPROVAL
+# -------------------------
+BULK_APPROVE_MAX_IDS = 500
+
+def approve_deposit_requests(request_ids, admin_email=""):
+    """Approve many pending deposit requests in one store transaction.
+
+    Every id is checked before anything is written. The valid ones are
+    then committed together, so each file takes one batch: the status
+    patches, one balance update per user, and the transactions, audit
+    entries and account events. Returns one result per distinct id, in
+    the order given.
+    """
+    ensure_files()
+
+    results = {}
+    approvals = []
+    balances = {}
+
+    with store.transaction("deposit_requests", "users") as txn:
+        for request_id in request_ids:
+            if request_id in results:
+                continue
+            result = results[request_id] = {"request_id": request_id, "success": False}
+
+            cols = deposit_requests_log.get(request_id)
+            if not cols or len(cols) < 7:
+                result["error"] = "Deposit request not found"
+                continue
+            if cols[6] != "pending":
+                result["error"] = f"Deposit request is already {cols[6]}"
+                continue
+            try:
+                amount = float(cols[2])
+            except ValueError:
+                result["error"] = "Invalid deposit amount"
+                continue
+            if cols[1] not in balances:
+                user = get_user(cols[1])
+                if not user:
+                    result["error"] = "User not found"
+                    continue
+                balances[cols[1]] = float(user[6])
+
+            balances[cols[1]] += amount
+            approvals.append((result, cols[1], amount, balances[cols[1]]))
+
+        for email, new_inr in balances.items():
+            update_user_balances(email, new_inr, 0, txn)
+
+        for result, email, amount, inr_balance in approvals:
+            request_id = result["request_id"]
+            deposit_requests_log.update(request_id, {6: "approved"}, txn)
+            transaction_id = save_transaction(email, 'deposit_approved', amount, 0, 0, txn)
+
+            if admin_email:
+                log_admin_action(
+                    admin_email,
+                    "deposit_approved",
+                    request_id,
+                    "deposit_request",
+                    f"Approved deposit of ₹{amount} for {email} (bulk)",
+                    txn
+                )
+
+            publish_account_event(email, "deposit", request_id, "approved", inr_balance,
+                                  transaction_id, txn)
+            result.update(success=True, status="approved", user_email=email, amount=amount,
+                          transaction_id=transaction_id)
+
+    return list(results.values())
+
 # -------------------------
 # TRANSACTION HELPERS
 # -------------------------
-def save_transaction(user_email, txn_type, amount_inr, amount_mrx, price):
+def save_transaction(user_email, txn_type, amount_inr, amount_mrx, price, txn=None):
     txn_id = f"TXN{int(time.time())}{uuid.uuid4().hex[:6].upper()}"
     timestamp = int(time.time())
 
-    with open(TXN_FILE, "a") as f:
-        f.write(
-            f"{txn_id}\t{user_email}\t{txn_type}\t"
-            f"{amount_inr}\t{round(amount_mrx,6)}\t"
-            f"{round(price,4)}\t{timestamp}\tcompleted\n"
-        )
+    transactions_log.append([
+        txn_id, user_email, txn_type,
+        amount_inr, round(amount_mrx, 6),
+        round(price, 4), timestamp, "completed"
+    ], txn)
     return txn_id
 
 def get_user_transactions(user_email, limit=50):
     transactions = []
     try:
-        with open(TXN_FILE, "r") as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                if i == 0:
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 8 and cols[1] == user_email:
-                    transactions.append({
-                        'txn_id': cols[0],
-                        'type': cols[2],
-                        'amount_inr': float(cols[3]),
-                        'amount_mrx': float(cols[4]),
-                        'price': float(cols[5]),
-                        'timestamp': int(cols[6]),
-                        'status': cols[7]
-                    })
+        rows = transactions_log.select(where={1: user_email}, order_by=6, desc=True, limit=limit)
     except:
-        pass
-
-    transactions.sort(key=lambda x: x['timestamp'], reverse=True)
-    return transactions[:limit]
+        return transactions
+
+    for cols in rows:
+        transaction = _user_transaction_from_cols(cols)
+        if transaction:
+            transactions.append(transaction)
+
+    return transactions
+
+def _user_transaction_from_cols(cols):
+    if len(cols) >= 8:
+        try:
+            return {
+                'txn_id': cols[0],
+                'type': cols[2],
+                'amount_inr': float(cols[3]),
+                'amount_mrx': float(cols[4]),
+                'price': float(cols[5]),
+                'timestamp': int(cols[6]),
+                'status': cols[7]
+            }
+        except:
+            pass
+    return None
 
 def get_recent_transactions(limit=50):
     """Get recent transactions across all users"""
     transactions = []
     try:
-        with open(TXN_FILE, "r") as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                if i == 0:
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 8:
-                    transactions.append({
-                        'txn_id': cols[0],
-                        'user_email': cols[1],
-                        'type': cols[2],
-                        'amount_inr': float(cols[3]),
-                        'amount_mrx': float(cols[4]),
-                        'price': float(cols[5]),
-                        'timestamp': int(cols[6]),
-                        'status': cols[7]
-                    })
+        rows = transactions_log.select(order_by=6, desc=True, limit=limit)
     except:
-        pass
+        return transactions
+
+    for cols in rows:
+        if len(cols) >= 8:
+            try:
+                transactions.append({
+                    'txn_id': cols[0],
+                    'user_email': cols[1],
+                    'type': cols[2],
+                    'amount_inr': float(cols[3]),
+                    'amount_mrx': float(cols[4]),
+                    'price': float(cols[5]),
+                    'timestamp': int(cols[6]),
+                    'status': cols[7]
+                })
+            except:
+                continue
 
-    transactions.sort(key=lambda x: x['timestamp'], reverse=True)
-    return transactions[:limit]
+    return transactions
 
 # -------------------------
 # WITHDRAWAL REQUEST HELPERS
@@ -837,18 +1305,24 @@ def save_withdraw_request(user_email, user_name, amount, bank_name, account_numb
     request_id = f"WDR{int(time.time())}{uuid.uuid4().hex[:6].upper()}"
     created_at = int(time.time())
 
-    line = f"{request_id}\t{user_email}\t{user_name}\t{amount}\tpending\t{bank_name}\t{account_number}\t{ifsc_code}\t{created_at}\t0\t\n"
-
-    with open(WITHDRAW_REQUEST_FILE, "a") as f:
-        f.write(line)
-
-    # Deduct amount from user wallet immediately
-    user = get_user(user_email)
-    if user:
-        current_inr = float(user[6])
-        if current_inr >= amount:
+    # The request row, wallet deduction and transaction are committed together
+    with store.transaction("users") as txn:
+        user = get_user(user_email)
+        if user:
+            current_inr = float(user[6])
+            if current_inr < amount:
+                print(f"ERROR: Insufficient balance for withdrawal request. User: {user_email}, Amount: {amount}, Balance: {current_inr}")
+                return None
+
+        withdraw_requests_log.append([
+            request_id, user_email, user_name, amount, "pending",
+            bank_name, account_number, ifsc_code, created_at, 0, ""
+        ], txn)
+
+        # Deduct amount from user wallet immediately
+        if user:
             new_inr = current_inr - amount
-            update_user_balances(user_email, new_inr, 0)
+            update_user_balances(user_email, new_inr, 0, txn)
 
             # Log the deduction transaction
             save_transaction(
@@ -856,309 +1330,285 @@ def save_withdraw_request(user_email, user_name, amount, bank_name, account_numb
                 'withdrawal_requested',
                 -amount,
                 0,
-                0
+                0,
+                txn
             )
 
             print(f"WITHDRAWAL REQUESTED: Deducted ₹{amount} from {user_email}. Balance: ₹{new_inr:.2f}")
-        else:
-            print(f"ERROR: Insufficient balance for withdrawal request. User: {user_email}, Amount: {amount}, Balance: {current_inr}")
-            return None
 
     return request_id
 
 def get_user_withdrawal_requests(user_email):
     """Get withdrawal requests for a specific user"""
     requests = []
-    if not os.path.exists(WITHDRAW_REQUEST_FILE):
-        return requests
 
     try:
-        with open(WITHDRAW_REQUEST_FILE, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
+        rows = withdraw_requests_log.select(where={1: user_email})
+    except:
+        return requests
 
-            line = line.strip()
-            if not line:
-                continue
+    for cols in rows:
+        if len(cols) >= 8:
+            requests.append(_user_withdrawal_from_cols(cols))
 
-            cols = line.split("\t")
+    requests.sort(key=lambda x: x['created_at'], reverse=True)
+    return requests
 
-            if len(cols) >= 8 and cols[1] == user_email:
-                while len(cols) < 11:
-                    cols.append("")
+def _user_withdrawal_from_cols(cols):
+    while len(cols) < 11:
+        cols.append("")
 
-                try:
-                    amount = float(cols[3]) if cols[3] else 0
-                except:
-                    amount = 0
+    try:
+        amount = float(cols[3]) if cols[3] else 0
+    except:
+        amount = 0
 
-                created_at_str = re.sub(r'[^0-9]', '', str(cols[8])) if len(cols) > 8 else ""
-                try:
-                    created_at = int(created_at_str) if created_at_str else int(time.time())
-                except:
-                    created_at = int(time.time())
-
-                account_num = cols[6] if len(cols) > 6 else ""
-                last_four = account_num[-4:] if account_num and len(account_num) >= 4 else ""
-
-                requests.append({
-                    'request_id': cols[0],
-                    'amount': amount,
-                    'status': cols[4] if len(cols) > 4 else 'pending',
-                    'bank_name': cols[5] if len(cols) > 5 else '',
-                    'account_number': last_four,
-                    'ifsc_code': cols[7] if len(cols) > 7 else '',
-                    'created_at': created_at,
-                    'processed_at': int(cols[9]) if len(cols) > 9 and cols[9].isdigit() else None,
-                    'remarks': cols[10] if len(cols) > 10 else ""
-                })
+    created_at_str = re.sub(r'[^0-9]', '', str(cols[8])) if len(cols) > 8 else ""
+    try:
+        created_at = int(created_at_str) if created_at_str else int(time.time())
     except:
-        pass
+        created_at = int(time.time())
 
-    requests.sort(key=lambda x: x['created_at'], reverse=True)
-    return requests
+    account_num = cols[6] if len(cols) > 6 else ""
+    last_four = account_num[-4:] if account_num and len(account_num) >= 4 else ""
+
+    return {
+        'request_id': cols[0],
+        'amount': amount,
+        'status': cols[4] if len(cols) > 4 else 'pending',
+        'bank_name': cols[5] if len(cols) > 5 else '',
+        'account_number': last_four,
+        'ifsc_code': cols[7] if len(cols) > 7 else '',
+        'created_at': created_at,
+        'processed_at': int(cols[9]) if len(cols) > 9 and cols[9].isdigit() else None,
+        'remarks': cols[10] if len(cols) > 10 else ""
+    }
 
 def get_all_withdrawal_requests(limit=1000):
     """Get all withdrawal requests (for admin use)"""
     ensure_files()
     requests = []
 
-    if not os.path.exists(WITHDRAW_REQUEST_FILE):
-        return requests
-
     try:
-        with open(WITHDRAW_REQUEST_FILE, "r") as f:
-            lines = f.readlines()
+        rows = withdraw_requests_log.select(order_by=8, desc=True, limit=limit)
+    except:
+        return requests
 
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
+    for cols in rows:
+        if len(cols) >= 8:
+            requests.append(_withdrawal_from_cols(cols))
 
-            line = line.strip()
-            if not line:
-                continue
+    requests.sort(key=lambda x: x['created_at'], reverse=True)
+    return requests
 
-            cols = line.split("\t")
+def _withdrawal_from_cols(cols):
+    while len(cols) < 11:
+        cols.append("")
 
-            if len(cols) >= 8:
-                while len(cols) < 11:
-                    cols.append("")
+    try:
+        amount = float(cols[3]) if cols[3] else 0
+    except:
+        amount = 0
 
-                try:
-                    amount = float(cols[3]) if cols[3] else 0
-                except:
-                    amount = 0
+    created_at_str = re.sub(r'[^0-9]', '', str(cols[8])) if len(cols) > 8 else ""
+    try:
+        created_at = int(created_at_str) if created_at_str else int(time.time())
+    except:
+        created_at = int(time.time())
 
-                created_at_str = re.sub(r'[^0-9]', '', str(cols[8])) if len(cols) > 8 else ""
-                try:
-                    created_at = int(created_at_str) if created_at_str else int(time.time())
-                except:
-                    created_at = int(time.time())
+    processed_at_str = re.sub(r'[^0-9]', '', str(cols[9])) if len(cols) > 9 else "0"
+    try:
+        processed_at = int(processed_at_str) if processed_at_str and processed_at_str.isdigit() else 0
+    except:
+        processed_at = 0
 
-                processed_at_str = re.sub(r'[^0-9]', '', str(cols[9])) if len(cols) > 9 else "0"
-                try:
-                    processed_at = int(processed_at_str) if processed_at_str and processed_at_str.isdigit() else 0
-                except:
-                    processed_at = 0
+    return {
+        'request_id': cols[0],
+        'user_email': cols[1],
+        'user_name': cols[2],
+        'amount': amount,
+        'status': cols[4] if len(cols) > 4 else 'pending',
+        'bank_name': cols[5] if len(cols) > 5 else '',
+        'account_number': cols[6] if len(cols) > 6 else '',
+        'ifsc_code': cols[7] if len(cols) > 7 else '',
+        'created_at': created_at,
+        'processed_at': processed_at if processed_at > 0 else None,
+        'remarks': cols[10] if len(cols) > 10 else ""
+    }
 
-                requests.append({
-                    'request_id': cols[0],
-                    'user_email': cols[1],
-                    'user_name': cols[2],
-                    'amount': amount,
-                    'status': cols[4] if len(cols) > 4 else 'pending',
-                    'bank_name': cols[5] if len(cols) > 5 else '',
-                    'account_number': cols[6] if len(cols) > 6 else '',
-                    'ifsc_code': cols[7] if len(cols) > 7 else '',
-                    'created_at': created_at,
-                    'processed_at': processed_at if processed_at > 0 else None,
-                    'remarks': cols[10] if len(cols) > 10 else ""
-                })
-    except:
-        pass
+def get_withdrawal_request_page(status="", user="", since=None, until=None, search="",
+                                cursor=None, limit=ADMIN_PAGE_SIZE):
+    """One page of withdrawal requests, newest first, filtered in the reader.
 
-    requests.sort(key=lambda x: x['created_at'], reverse=True)
-    return requests[:limit]
+    Returns (requests, next_cursor). Raises ValueError for a bad cursor.
+    """
+    ensure_files()
+    where = {}
+    if status:
+        where[4] = status
+    if user:
+        where[1] = user
+    rows, next_cursor = withdraw_requests_log.page(
+        order_by=8, where=where, after=cursor, limit=limit, since=since, until=until,
+        search=(WITHDRAW_SEARCH_COLS, search)
+    )
+    return [_withdrawal_from_cols(cols) for cols in rows if len(cols) >= 8], next_cursor
 
 def update_withdrawal_request_status(request_id, status, admin_email="", remarks=""):
     """Update withdrawal request status - MARKET UPDATE ONLY ON ADMIN APPROVAL"""
     ensure_files()
 
-    if not os.path.exists(WITHDRAW_REQUEST_FILE):
-        return False
-
-    rows = []
     updated = False
-    withdrawal_info = None
-    previous_status = None
 
     try:
-        with open(WITHDRAW_REQUEST_FILE, "r") as f:
-            rows = f.readlines()
-
-        with open(WITHDRAW_REQUEST_FILE, "w") as f:
-            for line in rows:
-                if line.startswith("request_id"):
-                    f.write(line)
-                    continue
-
-                cols = line.strip().split("\t")
-                if cols[0] == request_id:
-                    previous_status = cols[4]
-
-                    try:
-                        withdrawal_info = {
-                            "user_email": cols[1],
-                            "user_name": cols[2],
-                            "amount": float(cols[3]) if cols[3] else 0
-                        }
-                    except:
-                        withdrawal_info = {
-                            "user_email": cols[1],
-                            "user_name": cols[2],
-                            "amount": 0
-                        }
-
-                    cols[4] = status
-                    if status in ["processed", "rejected", "approved"]:
-                        cols[9] = str(int(time.time()))
-                    if remarks:
-                        while len(cols) < 11:
-                            cols.append("")
-                        cols[10] = remarks
-                    updated = True
-                    f.write("\t".join(cols) + "\n")
-                else:
-                    f.write(line)
+        # The status change, refund or pool sale, transaction, account event
+        # and audit entry are committed together, and the status is read
+        # under the same locks so two admins cannot both act on a request.
+        with store.transaction("withdraw_requests", "users", "internal_mrx", "market") as txn:
+            cols = withdraw_requests_log.get(request_id)
+            if not cols or len(cols) < 5:
+                return False
+
+            previous_status = cols[4]
+            transaction_id = ""
+            rejection_txn_type = None
+
+            try:
+                withdrawal_info = {
+                    "user_email": cols[1],
+                    "user_name": cols[2],
+                    "amount": float(cols[3]) if cols[3] else 0
+                }
+            except:
+                withdrawal_info = {
+                    "user_email": cols[1],
+                    "user_name": cols[2],
+                    "amount": 0
+                }
 
-        # Handle withdrawal
-        if updated and withdrawal_info:
             user = get_user(withdrawal_info["user_email"])
-            if user:
+            inr_balance = float(user[6]) if user else 0
+            approving = user and status == "approved" and previous_status == "pending"
+            if approving:
                 current_internal_mrx = get_internal_mrx_balance(withdrawal_info["user_email"])
 
+                # The market lock is held, so no tick can commit between
+                # this read and the write_market below
                 inr_pool, mrx_pool = read_market()
                 current_price = inr_pool / mrx_pool if mrx_pool > 0 else 0
+                mrx_to_sell = withdrawal_info["amount"] / current_price if current_price > 0 else 0
 
-                if status == "approved" and previous_status == "pending":
-                    # Check: Ensure INR pool won't go below MIN_INR_POOL (1000)
-                    new_inr_pool = inr_pool - withdrawal_info["amount"]
-                    if new_inr_pool < MIN_INR_POOL:
-                        # If would go below MIN_INR_POOL, refund the amount and reject
-                        current_inr = float(user[6])
-                        new_inr = current_inr + withdrawal_info["amount"]
-                        update_user_balances(withdrawal_info["user_email"], new_inr, 0)
-
-                        # Update status to rejected
-                        update_withdrawal_request_status(request_id, "rejected", admin_email,
-                                                       f"Withdrawal would bring INR pool below ₹{MIN_INR_POOL:.2f}. Current: ₹{inr_pool:.2f}, Requested: ₹{withdrawal_info['amount']:.2f}")
+                # Update market pool (auto-sell MRX back to pool) - ONLY ON APPROVAL
+                new_inr_pool = inr_pool - withdrawal_info["amount"]
+                new_mrx_pool = mrx_pool + mrx_to_sell
+                new_price = new_inr_pool / new_mrx_pool if new_mrx_pool > 0 else current_price
 
-                        print(f"WITHDRAWAL REJECTED: INR pool protection. Would go to ₹{new_inr_pool:.2f} which is below ₹{MIN_INR_POOL:.2f}")
-                        return True
-
-                    # Calculate how much MRX needs to be sold internally
+                # An approval that fails a check below is written as a
+                # rejection instead, so the request is only updated once
+                if new_inr_pool < MIN_INR_POOL:
+                    # Check: Ensure INR pool won't go below MIN_INR_POOL (1000)
+                    status = "rejected"
+                    remarks = (f"Withdrawal would bring INR pool below ₹{MIN_INR_POOL:.2f}. "
+                               f"Current: ₹{inr_pool:.2f}, Requested: ₹{withdrawal_info['amount']:.2f}")
+                    print(f"WITHDRAWAL REJECTED: INR pool protection. Would go to ₹{new_inr_pool:.2f} which is below ₹{MIN_INR_POOL:.2f}")
+                elif current_price > 0 and current_internal_mrx < mrx_to_sell:
+                    status = "rejected"
+                    remarks = "Insufficient internal MRX for withdrawal"
+                    rejection_txn_type = 'withdrawal_rejected_insufficient_mrx'
+                    print(f"ERROR: Insufficient internal MRX for withdrawal. User: {withdrawal_info['user_email']}, MRX needed: {mrx_to_sell}, MRX available: {current_internal_mrx}")
+                elif current_price > 0 and new_price < PRICE_FLOOR:
+                    status = "rejected"
+                    remarks = f"Withdrawal violates price floor ₹{PRICE_FLOOR:.2f}"
+                    print(f"ERROR: Withdrawal would violate price floor. New price: {new_price:.4f}, Floor: {PRICE_FLOOR:.2f}")
+
+            changes = {4: status}
+            if status in ["processed", "rejected", "approved"]:
+                changes[9] = str(int(time.time()))
+            if remarks:
+                changes[10] = remarks
+            withdraw_requests_log.update(request_id, changes, txn)
+            updated = True
+
+            # Handle withdrawal
+            if user:
+                if approving and status == "rejected":
+                    # Refund the amount the request had taken from the wallet
+                    inr_balance = inr_balance + withdrawal_info["amount"]
+                    update_user_balances(withdrawal_info["user_email"], inr_balance, 0, txn)
+
+                    if rejection_txn_type:
+                        transaction_id = save_transaction(
+                            withdrawal_info["user_email"],
+                            rejection_txn_type,
+                            withdrawal_info["amount"],  # Refunded amount
+                            0,
+                            current_price,
+                            txn
+                        )
+
+                elif approving:
                     if current_price > 0:
-                        mrx_to_sell = withdrawal_info["amount"] / current_price
-
-                        # Check if user has enough internal MRX
-                        if current_internal_mrx < mrx_to_sell:
-                            print(f"ERROR: Insufficient internal MRX for withdrawal. User: {withdrawal_info['user_email']}, MRX needed: {mrx_to_sell}, MRX available: {current_internal_mrx}")
-
-                            # If insufficient MRX, refund the amount and mark as rejected
-                            current_inr = float(user[6])
-                            new_inr = current_inr + withdrawal_info["amount"]
-                            update_user_balances(withdrawal_info["user_email"], new_inr, 0)
-
-                            # Update status to rejected
-                            update_withdrawal_request_status(request_id, "rejected", admin_email, "Insufficient internal MRX for withdrawal")
-
-                            save_transaction(
-                                withdrawal_info["user_email"],
-                                'withdrawal_rejected_insufficient_mrx',
-                                withdrawal_info["amount"],  # Refunded amount
-                                0,
-                                current_price
-                            )
-
-                            return True
-
-                        # Update market pool (auto-sell MRX back to pool) - ONLY ON APPROVAL
-                        new_inr_pool = inr_pool - withdrawal_info["amount"]
-                        new_mrx_pool = mrx_pool + mrx_to_sell
-
-                        # Validate price floor
-                        new_price = new_inr_pool / new_mrx_pool if new_mrx_pool > 0 else current_price
-                        if new_price < PRICE_FLOOR:
-                            print(f"ERROR: Withdrawal would violate price floor. New price: {new_price:.4f}, Floor: {PRICE_FLOOR:.2f}")
-
-                            # If violates price floor, refund the amount and mark as rejected
-                            current_inr = float(user[6])
-                            new_inr = current_inr + withdrawal_info["amount"]
-                            update_user_balances(withdrawal_info["user_email"], new_inr, 0)
-
-                            # Update status to rejected
-                            update_withdrawal_request_status(request_id, "rejected", admin_email, f"Withdrawal violates price floor ₹{PRICE_FLOOR:.2f}")
-
-                            return True
-
                         # Update market - ONLY HAPPENS ON ADMIN APPROVAL
-                        write_market(new_inr_pool, new_mrx_pool)
+                        write_market(new_inr_pool, new_mrx_pool, txn)
 
                         # Update user's internal MRX balance
                         new_internal_mrx = current_internal_mrx - mrx_to_sell
-                        update_internal_mrx_balance(withdrawal_info["user_email"], new_internal_mrx)
+                        update_internal_mrx_balance(withdrawal_info["user_email"], new_internal_mrx, txn)
 
                     # Save transaction
-                    save_transaction(
+                    transaction_id = save_transaction(
                         withdrawal_info["user_email"],
                         'withdrawal_approved',
                         0,  # No change to INR balance (already deducted on request)
-                        -mrx_to_sell if current_price > 0 else 0,
-                        current_price
+                        -mrx_to_sell,
+                        current_price,
+                        txn
                     )
 
                     print(f"WITHDRAWAL APPROVED: Sold {mrx_to_sell:.6f} MRX from internal balance. Market updated.")
 
                 elif status == "rejected" and previous_status == "pending":
                     # REFUND the amount back to user's wallet
-                    current_inr = float(user[6])
-                    new_inr = current_inr + withdrawal_info["amount"]
-                    update_user_balances(withdrawal_info["user_email"], new_inr, 0)
+                    inr_balance = inr_balance + withdrawal_info["amount"]
+                    update_user_balances(withdrawal_info["user_email"], inr_balance, 0, txn)
 
-                    save_transaction(
+                    transaction_id = save_transaction(
                         withdrawal_info["user_email"],
                         'withdrawal_rejected_refund',
                         withdrawal_info["amount"],  # Refunded amount
                         0,
-                        0
+                        0,
+                        txn
                     )
 
                     print(f"WITHDRAWAL REJECTED: Refunded ₹{withdrawal_info['amount']} to {withdrawal_info['user_email']}.")
 
                 elif status == "processed" and previous_status == "approved":
-                    save_transaction(
+                    transaction_id = save_transaction(
                         withdrawal_info["user_email"],
                         'withdrawal_processed',
                         0,
                         0,
-                        0
+                        0,
+                        txn
                     )
                     print(f"WITHDRAWAL PROCESSED: Request {request_id} marked as processed.")
-    except:
-        pass
 
-    if updated and admin_email:
-        log_admin_action(
-            admin_email,
-            f"withdrawal_{status}",
-            request_id,
-            "withdrawal_request",
-            f"Updated withdrawal from '{previous_status}' to '{status}'" +
-            (f" - Amount: ₹{withdrawal_info['amount'] if withdrawal_info else 0}" if withdrawal_info else "")
-        )
+            publish_account_event(withdrawal_info["user_email"], "withdrawal", request_id, status,
+                                  inr_balance, transaction_id, txn)
+
+            if admin_email:
+                log_admin_action(
+                    admin_email,
+                    f"withdrawal_{status}",
+                    request_id,
+                    "withdrawal_request",
+                    f"Updated withdrawal from '{previous_status}' to '{status}'" +
+                    f" - Amount: ₹{withdrawal_info['amount']}",
+                    txn
+                )
+    except:
+        return False
 
     return updated
 
@@ -1166,90 +1616,251 @@ def get_withdrawal_stats():
     """Get withdrawal statistics for the admin dashboard"""
     ensure_files()
 
-    if not os.path.exists(WITHDRAW_REQUEST_FILE):
-        return {
-            'total': 0,
-            'pending': 0,
-            'approved': 0,
-            'processing': 0,
-            'processed': 0,
-            'rejected': 0,
-            'total_amount': 0
-        }
+    try:
+        totals = withdraw_requests_log.totals()
+    except:
+        totals = {}
+
+    def count_for(status):
+        return totals.get(status, [0, 0])[0]
+
+    return {
+        'total': sum(count for count, amount in totals.values()),
+        'pending': count_for('pending'),
+        'approved': count_for('approved'),
+        'processing': count_for('processing'),
+        'processed': count_for('processed'),
+        'rejected': count_for('rejected'),
+        'total_amount': round(sum(amount for count, amount in totals.values()), 2)
+    }
 
-    total = 0
-    pending = 0
-    approved = 0
-    processing = 0
-    processed = 0
-    rejected = 0
-    total_amount = 0
+def get_deposit_stats():
+    """Get deposit request counts per status"""
+    ensure_files()
 
     try:
-        with open(WITHDRAW_REQUEST_FILE, "r") as f:
-            lines = f.readlines()
+        totals = deposit_requests_log.totals()
+    except:
+        totals = {}
 
-        for i, line in enumerate(lines):
-            if i == 0:
-                continue
+    def count_for(status):
+        return totals.get(status, [0, 0])[0]
 
-            line = line.strip()
-            if not line:
-                continue
+    return {
+        'total': sum(count for count, amount in totals.values()),
+        'pending': count_for('pending'),
+        'approved': count_for('approved'),
+        'rejected': count_for('rejected'),
+        'total_amount': round(sum(amount for count, amount in totals.values()), 2)
+    }
 
-            cols = line.split("\t")
+# -------------------------
+# ADMIN USER SUMMARIES
+# -------------------------
+USER_SUMMARY_MAX_EMAILS = 500
 
-            if len(cols) >= 5:
-                total += 1
+def _user_summary(user_data, internal_mrx_balance, daily_trades):
+    daily_remaining = DAILY_TRADING_LIMIT - daily_trades
+    return {
+        'user_id': user_data[0],
+        'full_name': user_data[1],
+        'email': user_data[2],
+        'mobile': user_data[3],
+        'inr_balance': float(user_data[6]),
+        'mrx_balance': 0,
+        'internal_mrx_balance': internal_mrx_balance,
+        'created_at': int(user_data[8]),
+        'referral': user_data[5] if len(user_data) > 5 else "",
+        'daily_trades_today': round(daily_trades, 2),
+        'daily_remaining': round(daily_remaining, 2),
+        'daily_limit_reached': daily_trades >= DAILY_TRADING_LIMIT
+    }
 
-                try:
-                    amount = float(cols[3]) if cols[3] else 0
-                except:
-                    amount = 0
-                total_amount += amount
-
-                status = cols[4] if len(cols) > 4 else 'pending'
-
-                if status == 'pending':
-                    pending += 1
-                elif status == 'approved':
-                    approved += 1
-                elif status == 'processing':
-                    processing += 1
-                elif status == 'processed':
-                    processed += 1
-                elif status == 'rejected':
-                    rejected += 1
+def get_user_summaries(emails):
+    """What /api/admin/user/<email> returns, for several users at once.
+
+    Users, internal MRX and daily trades are keyed lookups and transactions
+    come from the per-email index. The deposit and withdrawal logs are read
+    once each and bucketed by email instead of once per user.
+    Returns ({email: summary}, not_found).
+    """
+    summaries = {}
+    not_found = []
+    for email in emails:
+        if email in summaries or email in not_found:
+            continue
+        user_data = get_user(email)
+        if not user_data:
+            not_found.append(email)
+            continue
+        transactions = get_user_transactions(email, limit=20)
+        summaries[email] = {
+            "user": _user_summary(user_data, get_internal_mrx_balance(email),
+                                  get_user_daily_trades(email)),
+            "transactions": transactions,
+            "deposit_requests": [],
+            "withdrawal_requests": [],
+            "transaction_count": len(transactions)
+        }
+
+    if not summaries:
+        return summaries, not_found
+
+    try:
+        rows = deposit_requests_log.select()
     except:
-        pass
+        rows = []
+    for cols in rows:
+        if len(cols) >= 8 and cols[1] in summaries:
+            deposit = _user_deposit_from_cols(cols)
+            if deposit:
+                summaries[cols[1]]["deposit_requests"].append(deposit)
 
-    return {
-        'total': total,
-        'pending': pending,
-        'approved': approved,
-        'processing': processing,
-        'processed': processed,
-        'rejected': rejected,
-        'total_amount': round(total_amount, 2)
+    try:
+        rows = withdraw_requests_log.select()
+    except:
+        rows = []
+    for cols in rows:
+        if len(cols) >= 8 and cols[1] in summaries:
+            summaries[cols[1]]["withdrawal_requests"].append(_user_withdrawal_from_cols(cols))
+
+    for summary in summaries.values():
+        summary["deposit_requests"].sort(key=lambda x: x['created_at'], reverse=True)
+        del summary["deposit_requests"][10:]
+        summary["withdrawal_requests"].sort(key=lambda x: x['created_at'], reverse=True)
+
+    return summaries, not_found
+
+# -------------------------
+# ADMIN SEARCH
+# -------------------------
+def search_admin_records(query, limit=ADMIN_PAGE_SIZE, kinds=ADMIN_SEARCH_KINDS):
+    """Newest users, deposits, withdrawals and tax records containing query.
+
+    Each store keeps a trigram index over the searched columns, so only
+    candidate rows are read. Returns {kind: [record, ...]}.
+    """
+    ensure_files()
+    sources = {
+        "users": (users_table, _user_from_cols),
+        "deposits": (deposit_requests_log, _deposit_from_cols),
+        "withdrawals": (withdraw_requests_log,
+                        lambda cols: _withdrawal_from_cols(cols) if len(cols) >= 8 else None),
+        "tax_records": (tax_collection_log, _tax_record_from_cols),
     }
+    results = {}
+    for kind in kinds:
+        relation, build = sources[kind]
+        records = []
+        for cols in relation.search(query, limit):
+            record = build(cols)
+            if record:
+                records.append(record)
+        results[kind] = records
+    return results
 
 # -------------------------
 # DASHBOARD STATS HELPERS
 # -------------------------
+# -------------------------
+# DASHBOARD VIEW
+# -------------------------
+class DashboardView:
+    """User totals for the admin dashboard, kept current from table changes.
+
+    Fed by users_table/internal_mrx_table watch() callbacks, so reading it
+    costs the same whatever the number of users.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.inr = {}
+        self.mrx = {}
+        self.active = set()
+        self.total_inr = 0.0
+
+    @staticmethod
+    def _user(cols):
+        # Same rows get_all_users() accepts
+        if cols is None or len(cols) < 9:
+            return None
+        try:
+            int(cols[8])
+            return cols[2], float(cols[6])
+        except:
+            return None
+
+    def _update_active(self, email):
+        if email in self.inr and (self.inr[email] > 1000 or self.mrx.get(email, 0) > 0):
+            self.active.add(email)
+        else:
+            self.active.discard(email)
+
+    def on_user(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self.inr = {}
+                self.active = set()
+                self.total_inr = 0.0
+                return
+            for cols, sign in ((old, -1), (new, 1)):
+                user = self._user(cols)
+                if user is None:
+                    continue
+                email, inr = user
+                self.total_inr += sign * inr
+                if sign > 0:
+                    self.inr[email] = inr
+                else:
+                    self.inr.pop(email, None)
+                self._update_active(email)
+
+    def on_internal_mrx(self, old, new):
+        with self._lock:
+            if old is None and new is None:
+                self.mrx = {}
+                self.active = {email for email, inr in self.inr.items() if inr > 1000}
+                return
+            for cols, sign in ((old, -1), (new, 1)):
+                if cols is None or len(cols) < 2:
+                    continue
+                if sign > 0:
+                    try:
+                        self.mrx[cols[0]] = float(cols[1]) if cols[1] else 0.0
+                    except:
+                        self.mrx.pop(cols[0], None)
+                else:
+                    self.mrx.pop(cols[0], None)
+                self._update_active(cols[0])
+
+    def totals(self):
+        """(total_users, total_inr, active_users)"""
+        store.refresh()
+        with self._lock:
+            return len(self.inr), self.total_inr, len(self.active)
+
+dashboard_view = None
+
+def get_dashboard_view():
+    global dashboard_view
+    if dashboard_view is None:
+        view = DashboardView()
+        users_table.watch(view.on_user)
+        internal_mrx_table.watch(view.on_internal_mrx)
+        dashboard_view = view
+    return dashboard_view
+
 def get_dashboard_stats():
     """Get comprehensive dashboard statistics"""
-    users = get_all_users()
-    total_users = len(users)
-
-    total_inr = sum(user['inr_balance'] for user in users)
+    total_users, total_inr, active_users = get_dashboard_view().totals()
 
     inr_pool, mrx_pool = read_market()
     price = inr_pool / mrx_pool if mrx_pool > 0 else 0
 
-    deposit_requests = get_all_deposit_requests()
+    deposit_stats = get_deposit_stats()
     withdrawal_stats = get_withdrawal_stats()
 
-    pending_deposits = sum(1 for d in deposit_requests if d['status'] == 'pending')
+    pending_deposits = deposit_stats['pending']
     pending_withdrawals = withdrawal_stats['pending']
     processing_withdrawals = withdrawal_stats['processing']
     total_withdrawal_amount = withdrawal_stats['total_amount']
@@ -1285,7 +1896,7 @@ def get_dashboard_stats():
         'processing_withdrawals': processing_withdrawals,
         'total_withdrawal_amount': total_withdrawal_amount,
         'liquidity_health': liquidity_health,
-        'active_users': len([u for u in users if u['inr_balance'] > 1000 or get_internal_mrx_balance(u['email']) > 0]),
+        'active_users': active_users,
         'recent_transactions': recent_transactions,
         'recent_logs': recent_logs,
         'withdrawal_stats': withdrawal_stats,
@@ -1296,197 +1907,320 @@ def get_dashboard_stats():
     }
 
 # ========================
-# ACCELERATE-ORDER ENDPOINT
-# ========================
-@app.route("/api/accelerate-order", methods=["POST"])
-def accelerate_order():
-    if "user" not in session:
-        return jsonify({"success": False, "error": "Not logged in"}), 401
-
-    data = request.get_json()
-    if not data:
-        return jsonify({"success": False, "error": "Invalid request"}), 400
-
-    amount = float(data.get("amount", 0))
-    sentiment = data.get("sentiment", "bullish")
-
-    if amount > MAX_SINGLE_ORDER:
-        return jsonify({
-            "success": False,
-            "error": f"Single order cannot exceed ₹{MAX_SINGLE_ORDER:.2f}. Your order: ₹{amount:.2f}"
-        }), 400
-
-    if amount <= 0:
-        return jsonify({"success": False, "error": "Invalid amount"}), 400
+# MARKET ENGINE
+# ========================
+# Buy orders are executed by one engine thread per process. Each tick
+# collects the orders that arrive within MARKET_TICK_SECONDS, runs them in
+# arrival order against a single view of the pool, wallets and daily totals,
+# and commits the whole tick as one store transaction (one log write).
+MARKET_TICK_SECONDS = 0.005
+MARKET_TICK_MAX_ORDERS = 256
+
+class MarketTick:
+    """Pool, wallet and daily-limit state for the orders of one tick"""
+
+    def __init__(self, txn):
+        self.txn = txn
+        self.today = date.today().isoformat()
+        self.inr_pool, self.mrx_pool = read_market()
+        self.pool_changed = False
+        self.users = {}
+        self.internal_mrx = {}
+        self.daily = {}
+        # Only accounts with a buy executed this tick are written back
+        self.executed = set()
+
+    def _user(self, email):
+        if email not in self.users:
+            self.users[email] = get_user(email)
+        return self.users[email]
+
+    def _internal_mrx(self, email):
+        if email not in self.internal_mrx:
+            self.internal_mrx[email] = get_internal_mrx_balance(email)
+        return self.internal_mrx[email]
+
+    def _daily(self, email):
+        if email not in self.daily:
+            cols = daily_trades_table.get((self.today, email))
+            if cols:
+                total = float(cols[2]) if cols[2] else 0.0
+                count = int(cols[3]) if len(cols) > 3 and cols[3] else 0
+            else:
+                total, count = 0.0, 0
+            self.daily[email] = [total, count]
+        return self.daily[email]
+
+    def buy(self, user_email, amount, sentiment):
+        """Execute one buy against the tick state. Returns (status_code, response)"""
+        # Check daily trading limit
+        daily_before = self._daily(user_email)[0]
+        if daily_before + amount > DAILY_TRADING_LIMIT:
+            remaining = DAILY_TRADING_LIMIT - daily_before
+            return 400, {
+                "success": False,
+                "error": f"Daily trading limit exceeded. Limit: ₹{DAILY_TRADING_LIMIT:.2f}, Used: ₹{daily_before:.2f}, Remaining: ₹{remaining:.2f}"
+            }
 
-    # Check daily trading limit
-    limit_check, limit_msg = check_daily_trading_limit(session["user"], amount)
-    if not limit_check:
-        return jsonify({
-            "success": False,
-            "error": limit_msg
-        }), 400
+        # DISABLE SELL ORDERS FOR USERS
+        if sentiment == "bearish":
+            return 400, {
+                "success": False,
+                "error": "Sell is disabled. Withdraw to exit your position."
+            }
 
-    # DISABLE SELL ORDERS FOR USERS
-    if sentiment == "bearish":
-        return jsonify({
-            "success": False,
-            "error": "Sell is disabled. Withdraw to exit your position."
-        }), 400
+        if sentiment != "bullish":
+            return 400, {"success": False, "error": "Invalid operation"}
 
-    if sentiment != "bullish":
-        return jsonify({"success": False, "error": "Invalid operation"}), 400
+        user = self._user(user_email)
+        if not user:
+            return 404, {"success": False, "error": "User not found"}
 
-    user = get_user(session["user"])
-    if not user:
-        return jsonify({"success": False, "error": "User not found"}), 404
+        inr_balance = float(user[6])
+        user_name = user[1]
 
-    inr_balance = float(user[6])
-    user_name = user[1]
+        inr_pool, mrx_pool = self.inr_pool, self.mrx_pool
+        if mrx_pool <= 0:
+            return 500, {"success": False, "error": "Market unavailable"}
 
-    inr_pool, mrx_pool = read_market()
-    if mrx_pool <= 0:
-        return jsonify({"success": False, "error": "Market unavailable"}), 500
+        price_before = inr_pool / mrx_pool
 
-    price_before = inr_pool / mrx_pool
+        # ==== CORRECTED CALCULATION ====
+        tax_amount = amount * TAX_RATE
+        amount_after_tax = amount - tax_amount
 
-    # ==== CORRECTED CALCULATION ====
-    tax_amount = amount * TAX_RATE
-    amount_after_tax = amount - tax_amount
+        if inr_balance < amount:
+            return 400, {
+                "success": False,
+                "error": f"Insufficient INR balance. Required: ₹{amount:.2f}. Available: ₹{inr_balance:.2f}"
+            }
 
-    if inr_balance < amount:
-        return jsonify({
-            "success": False,
-            "error": f"Insufficient INR balance. Required: ₹{amount:.2f}. Available: ₹{inr_balance:.2f}"
-        }), 400
+        # MRX allocation
+        mrx_received = amount_after_tax / price_before
 
-    # MRX allocation
-    mrx_received = amount_after_tax / price_before
+        # New pool state
+        new_inr_pool = inr_pool + amount_after_tax
+        new_mrx_pool = mrx_pool - mrx_received
 
-    # New pool state
-    new_inr_pool = inr_pool + amount_after_tax
-    new_mrx_pool = mrx_pool - mrx_received
+        # New price
+        new_price = new_inr_pool / new_mrx_pool if new_mrx_pool > 0 else price_before
 
-    # New price
-    new_price = new_inr_pool / new_mrx_pool if new_mrx_pool > 0 else price_before
+        # Validate price floor
+        if new_price < PRICE_FLOOR:
+            return 400, {
+                "success": False,
+                "error": f"Cannot execute trade. Price would drop below ₹{PRICE_FLOOR:.2f} floor.",
+                "current_price": round(price_before, 4),
+                "projected_price": round(new_price, 4),
+                "price_floor": PRICE_FLOOR
+            }
 
-    # Validate price floor
-    if new_price < PRICE_FLOOR:
-        return jsonify({
-            "success": False,
-            "error": f"Cannot execute trade. Price would drop below ₹{PRICE_FLOOR:.2f} floor.",
-            "current_price": round(price_before, 4),
-            "projected_price": round(new_price, 4),
-            "price_floor": PRICE_FLOOR
-        }), 400
+        # Check liquidity protection
+        if mrx_received > mrx_pool * 0.95:
+            return 400, {"success": False, "error": "Market liquidity too low"}
+
+        # ===== CORRECT WALLET BALANCE CALCULATION =====
+        # MRX value at NEW price (current market value)
+        mrx_value_at_new_price = mrx_received * new_price
+
+        # User's new INR balance should be:
+        # Old balance - amount invested + current value of MRX
+        new_inr = inr_balance - amount + mrx_value_at_new_price
+
+        # Profit calculation (for reporting only)
+        actual_profit = mrx_value_at_new_price - amount
+
+        # Execute the trade against the tick state; flush() writes it out.
+        # Values are rounded the way the table writes store them.
+        self.inr_pool, self.mrx_pool = round(new_inr_pool, 2), round(new_mrx_pool, 6)
+        self.pool_changed = True
+        self.internal_mrx[user_email] = round(self._internal_mrx(user_email) + mrx_received, 6)
+        user[6] = str(round(new_inr, 2))
+        daily = self._daily(user_email)
+        daily_total = daily[0] + amount
+        daily[0], daily[1] = round(daily_total, 2), daily[1] + 1
+        self.executed.add(user_email)
+
+        # Save transaction
+        txn_id = save_transaction(
+            user_email,
+            'accelerate_bullish',
+            -amount + mrx_value_at_new_price,  # Net change in wallet
+            mrx_received,
+            price_before,
+            self.txn
+        )
 
-    # Check liquidity protection
-    if mrx_received > mrx_pool * 0.95:
-        return jsonify({"success": False, "error": "Market liquidity too low"}), 400
+        # Log tax collection for buy order
+        tax_log_id = log_tax_collection(
+            user_email=user_email,
+            user_name=user_name,
+            order_type="buy",
+            order_amount=amount,
+            tax_amount=tax_amount,
+            order_worth=mrx_value_at_new_price,
+            remarks=f"Buy order tax: {TAX_RATE*100}%, MRX allocated: {mrx_received:.6f}, MRX value: ₹{mrx_value_at_new_price:.2f}",
+            txn=self.txn
+        )
 
-    # ===== CORRECT WALLET BALANCE CALCULATION =====
-    # MRX value at NEW price (current market value)
-    mrx_value_at_new_price = mrx_received * new_price
+        # Save order record
+        order_id = save_order_record(
+            user_email=user_email,
+            user_name=user_name,
+            order_type="buy",
+            order_amount_inr=amount,
+            order_amount_mrx=mrx_received,
+            price_at_order=price_before,
+            tax_amount=tax_amount,
+            remarks=f"BUY: Invested ₹{amount:.2f}, got {mrx_received:.6f} MRX worth ₹{mrx_value_at_new_price:.2f} at new price",
+            txn=self.txn
+        )
 
-    # User's new INR balance should be:
-    # Old balance - amount invested + current value of MRX
-    new_inr = inr_balance - amount + mrx_value_at_new_price
+        percentage_return = (actual_profit / amount) * 100 if amount > 0 else 0
 
-    # Profit calculation (for reporting only)
-    actual_profit = mrx_value_at_new_price - amount
+        daily_remaining = DAILY_TRADING_LIMIT - daily_total
 
-    # Execute the trade
-    write_market(new_inr_pool, new_mrx_pool)
+        return 200, {
+            "success": True,
+            "transaction_id": txn_id,
+            "tax_log_id": tax_log_id,
+            "order_id": order_id,
+            "new_inr_balance": round(new_inr, 2),
+            "new_mrx_balance": 0,
+            "price_before": round(price_before, 4),
+            "price_after": round(new_price, 4),
+            "sentiment": sentiment,
+            "inr_invested": round(amount, 2),
+            "tax_amount": round(tax_amount, 2),
+            "amount_to_pool": round(amount_after_tax, 2),
+            "tax_rate": f"{TAX_RATE*100}%",
+            "mrx_allocated_internally": round(mrx_received, 6),
+            "price_floor": PRICE_FLOOR,
+            "price_floor_violation": False,
+            "single_order_limit": MAX_SINGLE_ORDER,
+            "within_limit": amount <= MAX_SINGLE_ORDER,
+
+            # Daily trading limit info
+            "daily_trading_limit": DAILY_TRADING_LIMIT,
+            "daily_total_used": round(daily_total, 2),
+            "daily_remaining": round(daily_remaining, 2),
+            "daily_limit_reached": daily_total >= DAILY_TRADING_LIMIT,
+
+            # ===== CORRECT VALUES =====
+            "mrx_current_value": round(mrx_value_at_new_price, 2),
+            "profit": round(actual_profit, 2),
+            "profit_calculation": f"({mrx_received:.6f} MRX × ₹{new_price:.4f}) - ₹{amount:.2f}",
+            "wallet_calculation": f"₹{inr_balance:.2f} - ₹{amount:.2f} + ₹{mrx_value_at_new_price:.2f} = ₹{new_inr:.2f}",
+            "new_price": round(new_price, 4),
+            "percentage_return": round(percentage_return, 2),
 
-    # Update internal MRX balance
-    current_internal_mrx = get_internal_mrx_balance(session["user"])
-    new_internal_mrx = current_internal_mrx + mrx_received
-    update_internal_mrx_balance(session["user"], new_internal_mrx)
+            # ===== USER MESSAGES =====
+            "user_message": f"Invested ₹{amount:.2f} (₹{tax_amount:.2f} tax). Your MRX is now worth ₹{mrx_value_at_new_price:.2f}. Wallet: ₹{new_inr:.2f}",
+            "summary": f"Investment: ₹{amount:.2f}, Tax: ₹{tax_amount:.2f}, MRX Value: ₹{mrx_value_at_new_price:.2f}, Profit: ₹{actual_profit:.2f} ({percentage_return:.1f}%)",
+        }
 
-    # Update user's INR balance (show MRX value in wallet)
-    update_user_balances(session["user"], new_inr, 0)
+    def flush(self):
+        """Stage the tick's final pool, wallets, internal MRX and daily totals"""
+        if self.pool_changed:
+            write_market(self.inr_pool, self.mrx_pool, self.txn)
+        for email in self.executed:
+            total, count = self.daily[email]
+            update_internal_mrx_balance(email, self.internal_mrx[email], self.txn)
+            update_user_balances(email, float(self.users[email][6]), 0, self.txn)
+            daily_trades_table.put([self.today, email, total, count, int(time.time())], self.txn)
+            touch_account(email, self.txn)
+
+
+class MarketEngine:
+    """Batches buy orders into ticks: requests queue orders and wait.
+
+    A tick reads and writes the pool inside a transaction holding the
+    market lock. Withdrawal approval, the other read-modify-write of the
+    pool, runs under that same lock, so neither can lose the other's update.
+    The admin pool overrides set absolute values and need no read.
+    """
 
-    # Update daily trading total
-    update_user_daily_trades(session["user"], amount)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders = None
+        self._pid = None
+
+    def submit(self, user_email, amount, sentiment):
+        """Queue a buy and wait for its (status_code, response)"""
+        future = Future()
+        self._ensure_running().put((user_email, amount, sentiment, future))
+        return future.result()
+
+    def _ensure_running(self):
+        # One engine thread per process, started lazily so forked workers get their own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._orders = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._orders,),
+                                 name="market-engine", daemon=True).start()
+            return self._orders
+
+    def _run(self, orders):
+        while True:
+            batch = [orders.get()]
+            deadline = time.monotonic() + MARKET_TICK_SECONDS
+            while len(batch) < MARKET_TICK_MAX_ORDERS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(orders.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self._tick(batch)
+            except Exception as e:
+                print(f"MARKET ENGINE ERROR: {str(e)}")
+                for order in batch:
+                    order[3].set_exception(e)
+                continue
+            for order, result in zip(batch, results):
+                order[3].set_result(result)
 
-    # Save transaction
-    txn_id = save_transaction(
-        session['user'],
-        'accelerate_bullish',
-        -amount + mrx_value_at_new_price,  # Net change in wallet
-        mrx_received,
-        price_before
-    )
+    def _tick(self, batch):
+        roll_daily_trades()
+        with store.transaction("users", "internal_mrx", "daily_trades", "market") as txn:
+            tick = MarketTick(txn)
+            results = [tick.buy(email, amount, sentiment) for email, amount, sentiment, _ in batch]
+            tick.flush()
+        return results
 
-    # Log tax collection for buy order
-    tax_log_id = log_tax_collection(
-        user_email=session['user'],
-        user_name=user_name,
-        order_type="buy",
-        order_amount=amount,
-        tax_amount=tax_amount,
-        order_worth=mrx_value_at_new_price,
-        remarks=f"Buy order tax: {TAX_RATE*100}%, MRX allocated: {mrx_received:.6f}, MRX value: ₹{mrx_value_at_new_price:.2f}"
-    )
+market_engine = MarketEngine()
 
-    # Save order record
-    order_id = save_order_record(
-        user_email=session['user'],
-        user_name=user_name,
-        order_type="buy",
-        order_amount_inr=amount,
-        order_amount_mrx=mrx_received,
-        price_at_order=price_before,
-        tax_amount=tax_amount,
-        remarks=f"BUY: Invested ₹{amount:.2f}, got {mrx_received:.6f} MRX worth ₹{mrx_value_at_new_price:.2f} at new price"
-    )
+# ========================
+# ACCELERATE-ORDER ENDPOINT
+# ========================
+@app.route("/api/accelerate-order", methods=["POST"])
+def accelerate_order():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
 
-    percentage_return = (actual_profit / amount) * 100 if amount > 0 else 0
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "error": "Invalid request"}), 400
 
-    # Get updated daily total
-    daily_total = get_user_daily_trades(session["user"])
-    daily_remaining = DAILY_TRADING_LIMIT - daily_total
+    amount = float(data.get("amount", 0))
+    sentiment = data.get("sentiment", "bullish")
 
-    response_data = {
-        "success": True,
-        "transaction_id": txn_id,
-        "tax_log_id": tax_log_id,
-        "order_id": order_id,
-        "new_inr_balance": round(new_inr, 2),
-        "new_mrx_balance": 0,
-        "price_before": round(price_before, 4),
-        "price_after": round(new_price, 4),
-        "sentiment": sentiment,
-        "inr_invested": round(amount, 2),
-        "tax_amount": round(tax_amount, 2),
-        "amount_to_pool": round(amount_after_tax, 2),
-        "tax_rate": f"{TAX_RATE*100}%",
-        "mrx_allocated_internally": round(mrx_received, 6),
-        "price_floor": PRICE_FLOOR,
-        "price_floor_violation": False,
-        "single_order_limit": MAX_SINGLE_ORDER,
-        "within_limit": amount <= MAX_SINGLE_ORDER,
+    if amount > MAX_SINGLE_ORDER:
+        return jsonify({
+            "success": False,
+            "error": f"Single order cannot exceed ₹{MAX_SINGLE_ORDER:.2f}. Your order: ₹{amount:.2f}"
+        }), 400
 
-        # Daily trading limit info
-        "daily_trading_limit": DAILY_TRADING_LIMIT,
-        "daily_total_used": round(daily_total, 2),
-        "daily_remaining": round(daily_remaining, 2),
-        "daily_limit_reached": daily_total >= DAILY_TRADING_LIMIT,
-
-        # ===== CORRECT VALUES =====
-        "mrx_current_value": round(mrx_value_at_new_price, 2),
-        "profit": round(actual_profit, 2),
-        "profit_calculation": f"({mrx_received:.6f} MRX × ₹{new_price:.4f}) - ₹{amount:.2f}",
-        "wallet_calculation": f"₹{inr_balance:.2f} - ₹{amount:.2f} + ₹{mrx_value_at_new_price:.2f} = ₹{new_inr:.2f}",
-        "new_price": round(new_price, 4),
-        "percentage_return": round(percentage_return, 2),
-
-        # ===== USER MESSAGES =====
-        "user_message": f"Invested ₹{amount:.2f} (₹{tax_amount:.2f} tax). Your MRX is now worth ₹{mrx_value_at_new_price:.2f}. Wallet: ₹{new_inr:.2f}",
-        "summary": f"Investment: ₹{amount:.2f}, Tax: ₹{tax_amount:.2f}, MRX Value: ₹{mrx_value_at_new_price:.2f}, Profit: ₹{actual_profit:.2f} ({percentage_return:.1f}%)",
-    }
+    if amount <= 0:
+        return jsonify({"success": False, "error": "Invalid amount"}), 400
 
-    return jsonify(response_data)
+    # Pool, wallet and daily-limit checks run in the market engine's tick
+    status, response_data = market_engine.submit(session["user"], amount, sentiment)
+    return jsonify(response_data), status
 
 # -------------------------
 # USER BALANCE API
@@ -1496,6 +2230,11 @@ def api_user_balance():
     if "user" not in session:
         return jsonify({"error": "Not logged in"}), 401
 
+    # The version is read before the data, so a tag never covers stale data
+    etag = account_etag(session["user"])
+    if etag and request.if_none_match.contains(etag):
+        return conditional_json(etag, None)
+
     user = get_user(session["user"])
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -1514,7 +2253,7 @@ def api_user_balance():
     daily_total = get_user_daily_trades(session["user"])
     daily_remaining = DAILY_TRADING_LIMIT - daily_total
 
-    return jsonify({
+    return conditional_json(etag, lambda: {
         "success": True,
         "inr_balance": float(user[6]),
         "mrx_balance": 0,
@@ -1532,7 +2271,8 @@ def api_user_balance():
 # -------------------------
 @app.route("/api/price")
 def api_price():
-    inr_pool, mrx_pool = read_market()
+    market = read_market_state()
+    inr_pool, mrx_pool = market[0], market[1]
 
     if mrx_pool <= 0:
         return jsonify({
@@ -1543,15 +2283,288 @@ def api_price():
             "error": "Invalid market state"
         }), 500
 
-    price = round(inr_pool / mrx_pool, 4)
-    return jsonify({
+    return conditional_json(market_etag(market), lambda: price_payload(inr_pool, mrx_pool))
+
+def price_payload(inr_pool, mrx_pool):
+    return {
         "success": True,
-        "price": price,
+        "price": round(inr_pool / mrx_pool, 4),
         "inr_pool": round(inr_pool, 2),
         "mrx_pool": round(mrx_pool, 6),
         "min_inr_pool": MIN_INR_POOL,
         "inr_pool_above_min": inr_pool >= MIN_INR_POOL
-    })
+    }
+
+# -------------------------
+# STREAM LIMIT
+# -------------------------
+# Every open /api/stream/* response holds one of the worker's threads
+# (gunicorn.conf.py runs gthread workers with UW_THREADS each). Streams may
+# take at most half of them; past that a stream request gets a 503, which
+# ends the EventSource, and the page falls back to polling its ETag'd API.
+STREAM_MAX_PER_WORKER = max(1, int(os.environ.get("UW_THREADS", 32)) // 2)
+
+class StreamSlots:
+    """Count of the SSE responses open in this process"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._open >= self.limit:
+                return False
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+
+stream_slots = StreamSlots(STREAM_MAX_PER_WORKER)
+
+def stream_response(stream):
+    """text/event-stream Response that gives its slot back when closed"""
+    response = Response(stream, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(stream_slots.release)
+    return response
+
+def stream_refused():
+    response = jsonify({"success": False, "error": "Too many open streams, poll instead"})
+    response.headers["Retry-After"] = "30"
+    return response, 503
+
+# -------------------------
+# PRICE STREAM (SERVER-SENT EVENTS)
+# -------------------------
+# One broadcaster thread per process watches the shared market record and
+# pushes a frame to every connected client when it changes. Writes made in
+# this process wake it at once; writes from other workers are picked up on
+# its next check.
+PRICE_STREAM_CHECK_SECONDS = 0.25
+PRICE_STREAM_HEARTBEAT_SECONDS = 15
+PRICE_STREAM_BACKLOG = 8
+
+class PriceBroadcaster:
+    """Fan market changes out to per-client queues"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = set()
+        self._frame = None
+        self._pid = None
+
+    def subscribe(self):
+        """New client queue; its first frame is the current market"""
+        client = queue.Queue(maxsize=PRICE_STREAM_BACKLOG)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._subscribers = set()
+                self._frame = None
+                self._pid = os.getpid()
+                self._wake.set()
+                threading.Thread(target=self._run, name="price-stream", daemon=True).start()
+            self._subscribers.add(client)
+            if self._frame is not None:
+                client.put(self._frame)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def notify(self):
+        """Check the market now instead of at the next interval"""
+        self._wake.set()
+
+    def _build_frame(self, market):
+        inr_pool, mrx_pool, _ = market
+        if mrx_pool <= 0:
+            data = {"success": False, "price": 0, "inr_pool": inr_pool,
+                    "mrx_pool": mrx_pool, "error": "Invalid market state"}
+        else:
+            data = price_payload(inr_pool, mrx_pool)
+        return f"event: price\nid: {market_etag(market)}\ndata: {json.dumps(data)}\n\n"
+
+    def _run(self):
+        last = None
+        while True:
+            self._wake.wait(PRICE_STREAM_CHECK_SECONDS)
+            self._wake.clear()
+            try:
+                market = read_market_state()
+                if market == last:
+                    continue
+                last = market
+                frame = self._build_frame(market)
+            except Exception as e:
+                print(f"PRICE STREAM ERROR: {str(e)}")
+                continue
+
+            with self._lock:
+                self._frame = frame
+                subscribers = list(self._subscribers)
+            for client in subscribers:
+                # Only the newest price matters: drop the oldest frame for slow clients
+                while True:
+                    try:
+                        client.put_nowait(frame)
+                        break
+                    except queue.Full:
+                        try:
+                            client.get_nowait()
+                        except queue.Empty:
+                            pass
+
+price_broadcaster = PriceBroadcaster()
+
+@app.route("/api/stream/price")
+def api_stream_price():
+    if not stream_slots.acquire():
+        return stream_refused()
+    try:
+        client = price_broadcaster.subscribe()
+    except:
+        stream_slots.release()
+        raise
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield client.get(timeout=PRICE_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+        finally:
+            price_broadcaster.unsubscribe(client)
+
+    return stream_response(stream())
+
+# -------------------------
+# ACCOUNT STREAM (SERVER-SENT EVENTS)
+# -------------------------
+# Deposit and withdrawal status changes are pushed to the owner's open
+# pages. The broadcaster thread watches the account version of every
+# subscribed user (a shared-memory read) and only reads account_events
+# when one of them changes; publishes from this process wake it at once.
+ACCOUNT_STREAM_CHECK_SECONDS = 0.5
+
+class AccountBroadcaster:
+    """Fan a user's new account events out to that user's open streams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._accounts = {}
+        self._pid = None
+
+    def subscribe(self, user_email):
+        client = queue.Queue()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._accounts = {}
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="account-stream", daemon=True).start()
+            account = self._accounts.get(user_email)
+            if account is not None:
+                account["clients"].add(client)
+                return client
+
+        # First stream for this account: count its events without holding
+        # the lock, then re-check, since another stream may have won the race
+        seen = len(get_account_events(user_email))
+        with self._lock:
+            account = self._accounts.get(user_email)
+            if account is None:
+                # No version yet: the next pass re-reads, so nothing published
+                # after this count is missed
+                account = {"version": None, "seen": seen, "clients": set()}
+                self._accounts[user_email] = account
+            account["clients"].add(client)
+        return client
+
+    def unsubscribe(self, user_email, client):
+        with self._lock:
+            account = self._accounts.get(user_email)
+            if account:
+                account["clients"].discard(client)
+                if not account["clients"]:
+                    del self._accounts[user_email]
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(ACCOUNT_STREAM_CHECK_SECONDS)
+            self._wake.clear()
+            with self._lock:
+                accounts = list(self._accounts.items())
+
+            for user_email, account in accounts:
+                try:
+                    version = _account_versions().get(user_email)
+                    if version is not None and version == account["version"]:
+                        continue
+                    events = get_account_events(user_email)
+                except Exception as e:
+                    print(f"ACCOUNT STREAM ERROR: {str(e)}")
+                    continue
+
+                with self._lock:
+                    account["version"] = version
+                    fresh = events[account["seen"]:]
+                    account["seen"] = len(events)
+                    clients = list(account["clients"])
+                for cols in fresh:
+                    frame = self._build_frame(cols)
+                    for client in clients:
+                        client.put(frame)
+
+    def _build_frame(self, cols):
+        data = {
+            "type": cols[2],
+            "request_id": cols[3],
+            "status": cols[4],
+            "inr_balance": float(cols[5]) if cols[5] else 0,
+            "transaction_id": cols[6],
+            "created_at": int(cols[7]) if cols[7] else 0,
+        }
+        return f"event: {cols[2]}\nid: {cols[0]}\ndata: {json.dumps(data)}\n\n"
+
+account_broadcaster = AccountBroadcaster()
+
+@app.route("/api/stream/account")
+def api_stream_account():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
+
+    if not stream_slots.acquire():
+        return stream_refused()
+    user_email = session["user"]
+    try:
+        client = account_broadcaster.subscribe(user_email)
+    except:
+        stream_slots.release()
+        raise
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield client.get(timeout=PRICE_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+        finally:
+            account_broadcaster.unsubscribe(user_email, client)
+
+    return stream_response(stream())
 
 # -------------------------
 # USER TRANSACTIONS API
@@ -1742,6 +2755,103 @@ def api_admin_dashboard_stats():
         "timestamp": int(time.time())
     })
 
+# Open admin dashboards get the full stats once, then only the fields that
+# changed. One thread per process computes the stats for all watchers.
+DASHBOARD_STREAM_CHECK_SECONDS = 1.0
+
+class DashboardBroadcaster:
+    """Push dashboard stat deltas to every open admin dashboard"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stats = None
+        self._pid = None
+
+    def subscribe(self):
+        """New client queue, primed with a full snapshot"""
+        client = queue.Queue()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._subscribers = set()
+                self._stats = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="dashboard-stream", daemon=True).start()
+            stats = self._stats
+        if stats is None:
+            stats = get_dashboard_stats()
+        with self._lock:
+            # Deltas are computed against self._stats, so start from it
+            if self._stats is None:
+                self._stats = stats
+            client.put(self._frame("snapshot", self._stats))
+            self._subscribers.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def _frame(self, event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def _run(self):
+        while True:
+            time.sleep(DASHBOARD_STREAM_CHECK_SECONDS)
+            with self._lock:
+                if not self._subscribers:
+                    self._stats = None
+                    continue
+            try:
+                stats = get_dashboard_stats()
+            except Exception as e:
+                print(f"DASHBOARD STREAM ERROR: {str(e)}")
+                continue
+
+            with self._lock:
+                previous = self._stats
+                self._stats = stats
+                subscribers = list(self._subscribers)
+            if previous is None:
+                continue
+            delta = {key: value for key, value in stats.items() if previous.get(key) != value}
+            if not delta:
+                continue
+            frame = self._frame("delta", delta)
+            for client in subscribers:
+                client.put(frame)
+
+dashboard_broadcaster = DashboardBroadcaster()
+
+@app.route("/api/admin/stream/dashboard")
+def api_admin_stream_dashboard():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "Not logged in"}), 401
+
+    if not is_admin(session["user"]):
+        return jsonify({"success": False, "error": "Access denied"}), 403
+
+    if not stream_slots.acquire():
+        return stream_refused()
+    try:
+        client = dashboard_broadcaster.subscribe()
+    except:
+        stream_slots.release()
+        raise
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield client.get(timeout=PRICE_STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+        finally:
+            dashboard_broadcaster.unsubscribe(client)
+
+    return stream_response(stream())
+
 @app.route("/api/admin/update-deposit-status", methods=["POST"])
 def api_admin_update_deposit_status():
     if "user" not in session:
@@ -1772,6 +2882,44 @@ def api_admin_update_deposit_status():
         "status": status
     })
 
+@app.route("/api/admin/deposits/bulk-approve", methods=["POST"])
+def api_admin_bulk_approve_deposits():
+    """{"request_ids": [...]} in, one result per request out"""
+    try:
+        if "user" not in session:
+            return jsonify({"success": False, "error": "Not logged in"}), 401
+
+        if not is_admin(session["user"]):
+            return jsonify({"success": False, "error": "Access denied"}), 403
+
+        data = request.get_json(silent=True) or {}
+        request_ids = data.get("request_ids")
+        if (not isinstance(request_ids, list) or not request_ids
+                or not all(isinstance(request_id, str) for request_id in request_ids)):
+            return jsonify({"success": False, "error": "request_ids must be a non-empty list of strings"}), 400
+        if len(request_ids) > BULK_APPROVE_MAX_IDS:
+            return jsonify({
+                "success": False,
+                "error": f"At most {BULK_APPROVE_MAX_IDS} requests per call"
+            }), 400
+
+        results = approve_deposit_requests([request_id.strip() for request_id in request_ids],
+                                           session["user"])
+        approved = sum(1 for result in results if result["success"])
+
+        return jsonify({
+            "success": True,
+            "results": results,
+            "approved": approved,
+            "failed": len(results) - approved
+        })
+    except Exception as e:
+        print(f"Error in api_admin_bulk_approve_deposits: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
 @app.route("/api/admin/update-withdrawal-status", methods=["POST"])
 def api_admin_update_withdrawal_status():
     if "user" not in session:
@@ -1803,6 +2951,22 @@ def api_admin_update_withdrawal_status():
         "status": status
     })
 
+def admin_page_args():
+    """Paging and filter query arguments shared by the admin listings.
+
+    limit is clamped to ADMIN_PAGE_MAX; cursor is the next_cursor of the
+    previous page; since/until are unix timestamps.
+    """
+    limit = request.args.get("limit", ADMIN_PAGE_SIZE, type=int)
+    return {
+        "user": request.args.get("user", "").strip(),
+        "since": request.args.get("since", None, type=int),
+        "until": request.args.get("until", None, type=int),
+        "search": request.args.get("search", "").strip().lower(),
+        "cursor": request.args.get("cursor") or None,
+        "limit": max(1, min(limit, ADMIN_PAGE_MAX))
+    }
+
 @app.route("/api/admin/deposit-requests")
 def api_admin_deposit_requests():
     if "user" not in session:
@@ -1811,18 +2975,23 @@ def api_admin_deposit_requests():
     if not is_admin(session["user"]):
         return jsonify({"success": False, "error": "Access denied"}), 403
 
-    limit = request.args.get("limit", 50, type=int)
     status_filter = request.args.get("status", "")
+    args = admin_page_args()
 
-    deposit_requests = get_all_deposit_requests(limit)
-
-    if status_filter:
-        deposit_requests = [req for req in deposit_requests if req["status"] == status_filter]
+    try:
+        deposit_requests, next_cursor = get_deposit_request_page(
+            status="" if status_filter == "all" else status_filter, **args
+        )
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
 
     return jsonify({
         "success": True,
         "deposit_requests": deposit_requests,
         "count": len(deposit_requests),
+        "stats": get_deposit_stats(),
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
         "filter_status": status_filter
     })
 
@@ -1834,29 +3003,15 @@ def api_admin_withdrawal_requests():
     if not is_admin(session["user"]):
         return jsonify({"success": False, "error": "Access denied"}), 403
 
-    limit = request.args.get("limit", 1000, type=int)
     status_filter = request.args.get("status", "")
-    search = request.args.get("search", "").strip().lower()
-
-    all_requests = get_all_withdrawal_requests(limit=limit)
-
-    if search:
-        filtered_requests = []
-        for req in all_requests:
-            search_match = (
-                (req.get('user_email', '').lower().find(search) >= 0) or
-                (req.get('user_name', '').lower().find(search) >= 0) or
-                (req.get('request_id', '').lower().find(search) >= 0) or
-                (req.get('bank_name', '').lower().find(search) >= 0) or
-                (str(req.get('account_number', '')).find(search) >= 0) or
-                (req.get('ifsc_code', '').lower().find(search) >= 0)
-            )
-            if search_match:
-                filtered_requests.append(req)
-        all_requests = filtered_requests
+    args = admin_page_args()
 
-    if status_filter and status_filter != 'all':
-        all_requests = [req for req in all_requests if req.get("status", "") == status_filter]
+    try:
+        all_requests, next_cursor = get_withdrawal_request_page(
+            status="" if status_filter == "all" else status_filter, **args
+        )
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
 
     stats = get_withdrawal_stats()
 
@@ -1886,8 +3041,10 @@ def api_admin_withdrawal_requests():
         "withdrawal_requests": formatted_requests,
         "stats": stats,
         "count": len(formatted_requests),
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
         "filter_status": status_filter,
-        "search_query": search
+        "search_query": args["search"]
     })
 
 # ========================
@@ -1902,22 +3059,7 @@ def api_admin_users():
         if not is_admin(session["user"]):
             return jsonify({"success": False, "error": "Access denied"}), 403
 
-        users = get_all_users()
-
-        inr_pool, mrx_pool = read_market()
-        price = inr_pool / mrx_pool if mrx_pool > 0 else 0
-
-        for user in users:
-            # Calculate total value including internal MRX
-            internal_mrx = get_internal_mrx_balance(user['email'])
-            user['total_value'] = round(user['inr_balance'] + (internal_mrx * price), 2)
-            user['is_admin'] = is_admin(user['email'])
-            user['internal_mrx_balance'] = internal_mrx
-
-            # Add daily trading info
-            user['daily_trades_today'] = round(get_user_daily_trades(user['email']), 2)
-            user['daily_remaining'] = round(DAILY_TRADING_LIMIT - user['daily_trades_today'], 2)
-            user['daily_limit_reached'] = user['daily_trades_today'] >= DAILY_TRADING_LIMIT
+        users, price = build_user_report()
 
         return jsonify({
             "success": True,
@@ -1956,28 +3098,14 @@ def api_admin_user_detail(user_email):
 
         # Get daily trading stats
         daily_trades = get_user_daily_trades(user_email)
-        daily_remaining = DAILY_TRADING_LIMIT - daily_trades
-        
+
         # FIX: Get market data for price calculation
         inr_pool, mrx_pool = read_market()
         market_price = inr_pool / mrx_pool if mrx_pool > 0 else 0
 
         return jsonify({
             "success": True,
-            "user": {
-                'user_id': user_data[0],
-                'full_name': user_data[1],
-                'email': user_data[2],
-                'mobile': user_data[3],
-                'inr_balance': float(user_data[6]),
-                'mrx_balance': 0,
-                'internal_mrx_balance': internal_mrx_balance,
-                'created_at': int(user_data[8]),
-                'referral': user_data[5] if len(user_data) > 5 else "",
-                'daily_trades_today': round(daily_trades, 2),
-                'daily_remaining': round(daily_remaining, 2),
-                'daily_limit_reached': daily_trades >= DAILY_TRADING_LIMIT
-            },
+            "user": _user_summary(user_data, internal_mrx_balance, daily_trades),
             "transactions": transactions,
             "deposit_requests": deposit_requests,
             "withdrawal_requests": withdrawal_requests,
@@ -1991,6 +3119,80 @@ def api_admin_user_detail(user_email):
             "error": f"Internal server error: {str(e)}"
         }), 500
 
+@app.route("/api/admin/users/summary", methods=["POST"])
+def api_admin_users_summary():
+    """Batch form of /api/admin/user/<email>: {"emails": [...]} in, one summary per email out"""
+    try:
+        if "user" not in session:
+            return jsonify({"success": False, "error": "Not logged in"}), 401
+
+        if not is_admin(session["user"]):
+            return jsonify({"success": False, "error": "Access denied"}), 403
+
+        data = request.get_json(silent=True) or {}
+        emails = data.get("emails")
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            return jsonify({"success": False, "error": "emails must be a list of strings"}), 400
+        if len(emails) > USER_SUMMARY_MAX_EMAILS:
+            return jsonify({
+                "success": False,
+                "error": f"At most {USER_SUMMARY_MAX_EMAILS} emails per request"
+            }), 400
+
+        summaries, not_found = get_user_summaries(emails)
+
+        inr_pool, mrx_pool = read_market()
+        market_price = inr_pool / mrx_pool if mrx_pool > 0 else 0
+
+        return jsonify({
+            "success": True,
+            "summaries": summaries,
+            "not_found": not_found,
+            "count": len(summaries),
+            "market_price": round(market_price, 4)
+        })
+    except Exception as e:
+        print(f"Error in api_admin_users_summary: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
+@app.route("/api/admin/search")
+def api_admin_search():
+    try:
+        if "user" not in session:
+            return jsonify({"success": False, "error": "Not logged in"}), 401
+
+        if not is_admin(session["user"]):
+            return jsonify({"success": False, "error": "Access denied"}), 403
+
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"success": False, "error": "Search query is required"}), 400
+
+        limit = request.args.get("limit", 20, type=int)
+        limit = max(1, min(limit, ADMIN_PAGE_MAX))
+        kinds = [kind for kind in request.args.get("kinds", "").split(",") if kind]
+        unknown = [kind for kind in kinds if kind not in ADMIN_SEARCH_KINDS]
+        if unknown:
+            return jsonify({"success": False, "error": f"Unknown kinds: {', '.join(unknown)}"}), 400
+
+        results = search_admin_records(query, limit, kinds or ADMIN_SEARCH_KINDS)
+
+        return jsonify({
+            "success": True,
+            "query": query,
+            "results": results,
+            "count": sum(len(records) for records in results.values())
+        })
+    except Exception as e:
+        print(f"Error in api_admin_search: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
 @app.route("/api/admin/logs")
 def api_admin_logs():
     if "user" not in session:
@@ -2032,37 +3234,38 @@ def api_admin_tax_records():
     if not is_admin(session["user"]):
         return jsonify({"success": False, "error": "Access denied"}), 403
 
-    limit = request.args.get("limit", 100, type=int)
-    order_type = request.args.get("order_type", "")
-    search = request.args.get("search", "").strip().lower()
+    order_type = request.args.get("order_type", "") or request.args.get("type", "")
+    args = admin_page_args()
 
-    records = get_tax_collection_records(limit)
-
-    if order_type and order_type != "all":
-        records = [r for r in records if r['order_type'] == order_type]
+    try:
+        records, next_cursor = get_tax_record_page(
+            order_type="" if order_type == "all" else order_type, **args
+        )
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
 
-    if search:
-        filtered_records = []
-        for record in records:
-            search_match = (
-                (record.get('user_email', '').lower().find(search) >= 0) or
-                (record.get('user_name', '').lower().find(search) >= 0) or
-                (record.get('tax_id', '').lower().find(search) >= 0)
-            )
-            if search_match:
-                filtered_records.append(record)
-        records = filtered_records
+    # Totals over every record matching the same filters as the page
+    filters = {key: args[key] for key in ("user", "since", "until", "search")}
+    try:
+        total_records, total_tax = get_tax_record_totals(
+            order_type="" if order_type == "all" else order_type, **filters
+        )
+    except:
+        total_records, total_tax = 0, 0.0
 
-    total_tax = sum(r['tax_amount'] for r in records)
-    total_orders = len(records)
+    page_tax = sum(r['tax_amount'] for r in records)
 
     return jsonify({
         "success": True,
         "tax_records": records,
-        "count": total_orders,
+        "count": len(records),
+        "page_tax": round(page_tax, 2),
         "total_tax": round(total_tax, 2),
+        "total_records": total_records,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
         "filter_order_type": order_type,
-        "search_query": search
+        "search_query": args["search"]
     })
 
 @app.route("/api/admin/system-health")
@@ -2085,7 +3288,8 @@ def api_admin_system_health():
             (TAX_COLLECTION_FILE, "tax_collection.tsv"),
             (ORDERS_FILE, "orders.tsv"),
             (INTERNAL_MRX_FILE, "internal_mrx.tsv"),
-            (DAILY_TRADES_FILE, "daily_trades.tsv")
+            (DAILY_TRADES_FILE, "daily_trades.tsv"),
+            (DAILY_TRADES_CURRENT_FILE, "daily_trades_current.tsv")
         ]:
             if os.path.exists(file_path):
                 size = os.path.getsize(file_path)
@@ -2110,25 +3314,20 @@ def api_admin_system_health():
         initial_mrx = 1000.0
 
         # Daily limit stats
-        today = date.today().isoformat()
+        today = roll_daily_trades()
         daily_trades = []
-        if os.path.exists(DAILY_TRADES_FILE):
-            with open(DAILY_TRADES_FILE, "r") as f:
-                lines = f.readlines()
-            for i, line in enumerate(lines):
-                if i == 0:
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and cols[0] == today:
-                    daily_trades.append({
-                        'user_email': cols[1],
-                        'amount': float(cols[2]) if cols[2] else 0
-                    })
+        for cols in daily_trades_table.rows():
+            if len(cols) >= 3 and cols[0] == today:
+                daily_trades.append({
+                    'user_email': cols[1],
+                    'amount': float(cols[2]) if cols[2] else 0
+                })
 
         return jsonify({
             "success": True,
             "timestamp": int(time.time()),
             "files": file_stats,
+            "storage_backend": STORAGE_BACKEND,
             "market": {
                 "inr_pool": round(inr_pool, 2),
                 "mrx_pool": round(mrx_pool, 6),
@@ -2255,31 +3454,17 @@ def api_admin_toggle_admin():
             return jsonify({"success": False, "error": "User not found"}), 404
 
         # Update user_id to indicate admin status
-        rows = []
-        with open(USERS_FILE, "r") as f:
-            rows = f.readlines()
-
-        updated = False
-        with open(USERS_FILE, "w") as f:
-            for line in rows:
-                if line.startswith("user_id"):
-                    f.write(line)
-                    continue
+        user_id = user[0]
+        if make_admin:
+            # Make admin - prefix user_id with ADMIN if not already
+            if not user_id.startswith('ADM'):
+                user_id = f"ADMIN{user_id}"
+        else:
+            # Remove admin - remove ADMIN prefix if exists
+            if user_id.startswith('ADMIN'):
+                user_id = user_id.replace('ADMIN', '')
 
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and cols[2] == email:
-                    if make_admin:
-                        # Make admin - prefix user_id with ADMIN if not already
-                        if not cols[0].startswith('ADM'):
-                            cols[0] = f"ADMIN{cols[0]}"
-                    else:
-                        # Remove admin - remove ADMIN prefix if exists
-                        if cols[0].startswith('ADMIN'):
-                            cols[0] = cols[0].replace('ADMIN', '')
-                    f.write("\t".join(cols) + "\n")
-                    updated = True
-                else:
-                    f.write(line)
+        updated = users_table.update(email, {0: user_id}) is not None
 
         if updated:
             # Log admin action
@@ -2320,33 +3505,24 @@ def api_admin_reset_daily_limit():
 
         # Reset daily trades for specific user
         ensure_files()
-        today = date.today().isoformat()
+        today = roll_daily_trades()
 
         if not os.path.exists(DAILY_TRADES_FILE):
             return jsonify({"success": True, "message": "Daily trades file doesn't exist"})
 
-        rows = []
         old_amount = 0
-        
-        with open(DAILY_TRADES_FILE, "r") as f:
-            rows = f.readlines()
 
-        with open(DAILY_TRADES_FILE, "w") as f:
-            f.write(rows[0])  # Header
-            for line in rows[1:]:
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and cols[0] == today and cols[1] == user_email:
-                    old_amount = float(cols[2]) if cols[2] else 0
-                    # Skip this line (reset)
-                    log_admin_action(
-                        session["user"],
-                        "reset_daily_limit",
-                        user_email,
-                        "user",
-                        f"Reset daily trading limit for {user_email}. Was: ₹{old_amount}"
-                    )
-                else:
-                    f.write(line)
+        cols = daily_trades_table.delete((today, user_email))
+        if cols:
+            touch_account(user_email)
+            old_amount = float(cols[2]) if cols[2] else 0
+            log_admin_action(
+                session["user"],
+                "reset_daily_limit",
+                user_email,
+                "user",
+                f"Reset daily trading limit for {user_email}. Was: ₹{old_amount}"
+            )
 
         return jsonify({
             "success": True,
@@ -2546,12 +3722,11 @@ def signup():
         created_at = int(time.time())
         referral = request.form.get("referralCode", "")
 
-        with open(USERS_FILE, "a") as f:
-            f.write(
-                f"{user_id}\t{full_name}\t{email}\t"
-                f"{mobile}\t{password}\t{referral}\t"
-                f"0\t0\t{created_at}\n"
-            )
+        users_table.put([
+            user_id, full_name, email,
+            mobile, password, referral,
+            0, 0, created_at
+        ])
 
         session["user"] = email
         response = make_response(redirect(url_for("trade")))
@@ -2587,12 +3762,11 @@ def admin_login():
         user_id = "ADMIN001"
         created_at = int(time.time())
 
-        with open(USERS_FILE, "a") as f:
-            f.write(
-                f"{user_id}\tAdmin Wilson\tadmin@unitedworld.com\t"
-                f"9876543210\tadmin123\tADMIN001\t"
-                f"1000000\t0\t{created_at}\n"
-            )
+        users_table.put([
+            user_id, "Admin Wilson", "admin@unitedworld.com",
+            "9876543210", "admin123", "ADMIN001",
+            1000000, 0, created_at
+        ])
 
     session["user"] = "admin@unitedworld.com"
     return redirect(url_for("admin_dashboard"))
@@ -2941,21 +4115,17 @@ def debug():
     }
 
     if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r") as f:
-            lines = f.readlines()
-            status["user_count"] = len(lines) - 1
-
-            for i, line in enumerate(lines):
-                if i == 0:
-                    continue
-                cols = line.strip().split("\t")
-                if len(cols) >= 3 and ('admin' in cols[2].lower() or cols[0].startswith('ADM')):
-                    status["admin_users"].append({
-                        "email": cols[2],
-                        "user_id": cols[0],
-                        "is_admin_by_email": 'admin' in cols[2].lower(),
-                        "is_admin_by_id": cols[0].startswith('ADM')
-                    })
+        rows = users_table.rows()
+        status["user_count"] = len(rows)
+
+        for cols in rows:
+            if len(cols) >= 3 and ('admin' in cols[2].lower() or cols[0].startswith('ADM')):
+                status["admin_users"].append({
+                    "email": cols[2],
+                    "user_id": cols[0],
+                    "is_admin_by_email": 'admin' in cols[2].lower(),
+                    "is_admin_by_id": cols[0].startswith('ADM')
+                })
 
     return jsonify(status)
 
@@ -3069,6 +4239,4 @@ if __name__ == "__main__":
     print("   • Maximum single order: ₹1,000")
     print("=" * 80)
     
-    if __name__ == "__main__":
-    ensure_files()
     app.run(debug=True)
\ No newline at end of file
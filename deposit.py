@@ -67,7 +67,7 @@ def get_user_deposits(user_email, limit=10):
                 "transaction_id": cols[3],
                 "phone": cols[4],
                 "payment_method": cols[5],
-                "status": cols[6],
+                "status": cols[6].rstrip(" "),  # app.py pads the status field
                 "created_at": int(cols[7])
             })
 
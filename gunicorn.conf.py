@@ -0,0 +1,17 @@
+# Gunicorn settings, picked up from the working directory by
+# `gunicorn app:app`.
+#
+# The /api/stream/* routes keep a request open for as long as a page is,
+# which would pin a default sync worker to a single client. Threaded
+# workers serve streams and ordinary requests side by side, and app.py
+# caps the streams per worker at half of its threads (UW_THREADS) so the
+# rest always stay free; past the cap, pages fall back to polling.
+import multiprocessing
+import os
+
+worker_class = "gthread"
+workers = int(os.environ.get("UW_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get("UW_THREADS", 32))
+# With gthread the timeout covers a stuck worker, not a long request
+timeout = 60
+keepalive = 5
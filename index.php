@@ -80,6 +80,50 @@ function ensureFiles() {
     }
 }
 
+// app.py pads the request status and processed_at fields with trailing
+// spaces so it can rewrite them in place; strip them when reading a row
+// and pad them again when writing one
+define('REQUEST_STATUS_WIDTH', 10);
+define('TIMESTAMP_WIDTH', 10);
+define('DEPOSIT_PADDED_COLS', [6]);
+define('WITHDRAW_PADDED_COLS', [4, 9]);
+
+// app.py keeps indexes over the request files and writes them under
+// data/<name>.lock, so PHP takes the same lock and replaces a rewritten
+// file by rename, which app.py notices and re-indexes
+function lockRequestLog($name) {
+    $lock = fopen(DATA_DIR . $name . '.lock', 'c');
+    flock($lock, LOCK_EX);
+    return $lock;
+}
+
+function unlockRequestLog($lock) {
+    flock($lock, LOCK_UN);
+    fclose($lock);
+}
+
+function splitRequestRow($line, $paddedCols) {
+    $cols = explode("\t", trim($line));
+    foreach ($paddedCols as $i) {
+        if (isset($cols[$i])) $cols[$i] = rtrim($cols[$i], ' ');
+    }
+    return $cols;
+}
+
+// Once app.py has opened data/ it is the only writer of users.tsv,
+// internal_mrx.tsv, daily_trades.tsv and market.tsv: it keeps them in
+// memory, logs changes to ledger.wal and replays that log over any edit
+// made here. Its TSV snapshots trail the log by a few seconds while
+// trades come in (longer after a quiet spell), so read them as reports.
+function pythonStoreActive() {
+    return file_exists(DATA_DIR . 'ledger.wal') || file_exists(DATA_DIR . 'unitedworld.db');
+}
+
+function refusePythonOwnedWrite($what) {
+    error_log("UNITED WORLD: {$what} refused, app.py owns this file");
+    return false;
+}
+
 function generateId($length = 8) {
     return substr(str_replace('.', '', uniqid('', true)), 0, $length);
 }
@@ -135,6 +179,7 @@ function getAllUsers() {
 
 function updateUserBalances($email, $newInr, $newMrx) {
     if (!file_exists(USERS_FILE)) return false;
+    if (pythonStoreActive()) return refusePythonOwnedWrite('updateUserBalances');
     
     $rows = file(USERS_FILE);
     $updated = false;
@@ -190,6 +235,7 @@ function readMarket() {
 }
 
 function writeMarket($inrPool, $mrxPool) {
+    if (pythonStoreActive()) return refusePythonOwnedWrite('writeMarket');
     if ($mrxPool > 0) {
         $newPrice = $inrPool / $mrxPool;
         if ($newPrice < PRICE_FLOOR) {
@@ -232,6 +278,7 @@ function getUserDailyTrades($userEmail) {
 }
 
 function updateUserDailyTrades($userEmail, $amount) {
+    if (pythonStoreActive()) return refusePythonOwnedWrite('updateUserDailyTrades');
     ensureFiles();
     $today = date('Y-m-d');
     $rows = file_exists(DAILY_TRADES_FILE) ? file(DAILY_TRADES_FILE) : [];
@@ -311,6 +358,7 @@ function getInternalMrxBalance($userEmail) {
 }
 
 function updateInternalMrxBalance($userEmail, $newMrxBalance) {
+    if (pythonStoreActive()) return refusePythonOwnedWrite('updateInternalMrxBalance');
     ensureFiles();
     $rows = file_exists(INTERNAL_MRX_FILE) ? file(INTERNAL_MRX_FILE) : [];
     $updated = false;
@@ -505,11 +553,15 @@ function saveDepositRequest($userEmail, $amount, $txnId, $phone, $method) {
     $requestId = "DPR" . time() . generateId(6);
     $createdAt = time();
     
+    $status = str_pad('pending', REQUEST_STATUS_WIDTH);
+    
+    $lock = lockRequestLog('deposit_requests');
     $handle = fopen(DEPOSIT_REQUEST_FILE, 'a');
     flock($handle, LOCK_EX);
-    fwrite($handle, "{$requestId}\t{$userEmail}\t{$amount}\t{$txnId}\t{$phone}\t{$method}\tpending\t{$createdAt}\n");
+    fwrite($handle, "{$requestId}\t{$userEmail}\t{$amount}\t{$txnId}\t{$phone}\t{$method}\t{$status}\t{$createdAt}\n");
     flock($handle, LOCK_UN);
     fclose($handle);
+    unlockRequestLog($lock);
     
     return $requestId;
 }
@@ -524,7 +576,7 @@ function getUserDepositRequests($userEmail, $limit = 10) {
     $first = true;
     while (($line = fgets($handle)) !== false) {
         if ($first) { $first = false; continue; }
-        $cols = explode("\t", trim($line));
+        $cols = splitRequestRow($line, DEPOSIT_PADDED_COLS);
         if (count($cols) >= 8 && $cols[1] == $userEmail) {
             $deposits[] = [
                 'request_id' => $cols[0],
@@ -558,7 +610,7 @@ function getAllDepositRequests($limit = 50) {
     $first = true;
     while (($line = fgets($handle)) !== false) {
         if ($first) { $first = false; continue; }
-        $cols = explode("\t", trim($line));
+        $cols = splitRequestRow($line, DEPOSIT_PADDED_COLS);
         if (count($cols) >= 8) {
             $deposits[] = [
                 'request_id' => $cols[0],
@@ -586,12 +638,12 @@ function getAllDepositRequests($limit = 50) {
 function updateDepositRequestStatus($requestId, $status, $adminEmail = "") {
     if (!file_exists(DEPOSIT_REQUEST_FILE)) return false;
     
+    $lock = lockRequestLog('deposit_requests');
     $rows = file(DEPOSIT_REQUEST_FILE);
     $updated = false;
     $depositInfo = null;
     
-    $handle = fopen(DEPOSIT_REQUEST_FILE, 'w');
-    flock($handle, LOCK_EX);
+    $handle = fopen(DEPOSIT_REQUEST_FILE . '.tmp', 'w');
     
     foreach ($rows as $line) {
         if (strpos($line, 'request_id') === 0) {
@@ -599,7 +651,7 @@ function updateDepositRequestStatus($requestId, $status, $adminEmail = "") {
             continue;
         }
         
-        $cols = explode("\t", trim($line));
+        $cols = splitRequestRow($line, DEPOSIT_PADDED_COLS);
         if ($cols[0] == $requestId) {
             if ($status == 'approved' && $cols[6] != 'approved') {
                 $depositInfo = [
@@ -607,7 +659,7 @@ function updateDepositRequestStatus($requestId, $status, $adminEmail = "") {
                     'amount' => floatval($cols[2])
                 ];
             }
-            $cols[6] = $status;
+            $cols[6] = str_pad($status, REQUEST_STATUS_WIDTH);
             $updated = true;
             fwrite($handle, implode("\t", $cols) . "\n");
         } else {
@@ -615,8 +667,9 @@ function updateDepositRequestStatus($requestId, $status, $adminEmail = "") {
         }
     }
     
-    flock($handle, LOCK_UN);
     fclose($handle);
+    rename(DEPOSIT_REQUEST_FILE . '.tmp', DEPOSIT_REQUEST_FILE);
+    unlockRequestLog($lock);
     
     if ($updated && $status == 'approved' && $depositInfo) {
         $user = getUser($depositInfo['user_email']);
@@ -647,11 +700,16 @@ function saveWithdrawRequest($userEmail, $userName, $amount, $bankName, $account
     $requestId = "WDR" . time() . generateId(6);
     $createdAt = time();
     
+    $status = str_pad('pending', REQUEST_STATUS_WIDTH);
+    $processedAt = str_pad('0', TIMESTAMP_WIDTH);
+    
+    $lock = lockRequestLog('withdraw_requests');
     $handle = fopen(WITHDRAW_REQUEST_FILE, 'a');
     flock($handle, LOCK_EX);
-    fwrite($handle, "{$requestId}\t{$userEmail}\t{$userName}\t{$amount}\tpending\t{$bankName}\t{$accountNumber}\t{$ifscCode}\t{$createdAt}\t0\t\n");
+    fwrite($handle, "{$requestId}\t{$userEmail}\t{$userName}\t{$amount}\t{$status}\t{$bankName}\t{$accountNumber}\t{$ifscCode}\t{$createdAt}\t{$processedAt}\t\n");
     flock($handle, LOCK_UN);
     fclose($handle);
+    unlockRequestLog($lock);
     
     $user = getUser($userEmail);
     if ($user) {
@@ -681,7 +739,7 @@ function getUserWithdrawalRequests($userEmail) {
         $line = trim($line);
         if (empty($line)) continue;
         
-        $cols = explode("\t", $line);
+        $cols = splitRequestRow($line, WITHDRAW_PADDED_COLS);
         if (count($cols) >= 8 && $cols[1] == $userEmail) {
             while (count($cols) < 11) $cols[] = '';
             
@@ -730,7 +788,7 @@ function getAllWithdrawalRequests($limit = 1000) {
         $line = trim($line);
         if (empty($line)) continue;
         
-        $cols = explode("\t", $line);
+        $cols = splitRequestRow($line, WITHDRAW_PADDED_COLS);
         if (count($cols) >= 8) {
             while (count($cols) < 11) $cols[] = '';
             
@@ -768,13 +826,13 @@ function getAllWithdrawalRequests($limit = 1000) {
 function updateWithdrawalRequestStatus($requestId, $status, $adminEmail = "", $remarks = "") {
     if (!file_exists(WITHDRAW_REQUEST_FILE)) return false;
     
+    $lock = lockRequestLog('withdraw_requests');
     $rows = file(WITHDRAW_REQUEST_FILE);
     $updated = false;
     $withdrawalInfo = null;
     $previousStatus = null;
     
-    $handle = fopen(WITHDRAW_REQUEST_FILE, 'w');
-    flock($handle, LOCK_EX);
+    $handle = fopen(WITHDRAW_REQUEST_FILE . '.tmp', 'w');
     
     foreach ($rows as $line) {
         if (strpos($line, 'request_id') === 0) {
@@ -782,7 +840,7 @@ function updateWithdrawalRequestStatus($requestId, $status, $adminEmail = "", $r
             continue;
         }
         
-        $cols = explode("\t", trim($line));
+        $cols = splitRequestRow($line, WITHDRAW_PADDED_COLS);
         if ($cols[0] == $requestId) {
             $previousStatus = $cols[4];
             $withdrawalInfo = [
@@ -791,9 +849,9 @@ function updateWithdrawalRequestStatus($requestId, $status, $adminEmail = "", $r
                 'amount' => floatval($cols[3] ?? 0)
             ];
             
-            $cols[4] = $status;
+            $cols[4] = str_pad($status, REQUEST_STATUS_WIDTH);
             if (in_array($status, ['processed', 'rejected', 'approved'])) {
-                $cols[9] = time();
+                $cols[9] = str_pad(time(), TIMESTAMP_WIDTH);
             }
             if ($remarks) {
                 while (count($cols) < 11) $cols[] = '';
@@ -806,8 +864,9 @@ function updateWithdrawalRequestStatus($requestId, $status, $adminEmail = "", $r
         }
     }
     
-    flock($handle, LOCK_UN);
     fclose($handle);
+    rename(WITHDRAW_REQUEST_FILE . '.tmp', WITHDRAW_REQUEST_FILE);
+    unlockRequestLog($lock);
     
     if ($updated && $withdrawalInfo) {
         $user = getUser($withdrawalInfo['user_email']);
@@ -896,7 +955,7 @@ function getWithdrawalStats() {
         $line = trim($line);
         if (empty($line)) continue;
         
-        $cols = explode("\t", $line);
+        $cols = splitRequestRow($line, WITHDRAW_PADDED_COLS);
         if (count($cols) >= 5) {
             $stats['total']++;
             $amount = floatval($cols[3] ?? 0);
@@ -1160,6 +1219,19 @@ $path = ltrim($path, '/');
 
 ensureFiles();
 
+// Requests that write balances, the pool or the users file are served by
+// app.py once it owns data/ (see pythonStoreActive)
+$pythonOwnedWrites = [
+    'api/accelerate-order', 'api/withdraw', 'api/admin/update-deposit-status',
+    'api/admin/update-withdrawal-status', 'api/admin/update-pool', 'signup.php'
+];
+if ($method == 'POST' && in_array($path, $pythonOwnedWrites) && pythonStoreActive()) {
+    header('Content-Type: application/json');
+    http_response_code(503);
+    echo json_encode(['success' => false, 'error' => 'This action is handled by the Python app']);
+    exit;
+}
+
 // ============================================================================
 // API ROUTES
 // ============================================================================
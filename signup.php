@@ -65,6 +65,12 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
         }
     }
 
+    // app.py owns data/users.tsv once its ledger exists and replays its
+    // log over the file, so this page must not append to it
+    if (empty($errors) && (file_exists('data/ledger.wal') || file_exists('data/unitedworld.db'))) {
+        $errors[] = 'Sign up is handled by the main site. Please register there.';
+    }
+
     // If no errors, save data
     if (empty($errors)) {
         // Hash the password
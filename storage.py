@@ -0,0 +1,2613 @@
+import base64
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: fall back to in-process locking only
+    fcntl = None
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # no shared memory support: SharedRecord readers fall back to the store
+    shared_memory = None
+
+# -------------------------
+# CONFIG
+# -------------------------
+WAL_FILE_NAME = "ledger.wal"
+SQLITE_FILE_NAME = "unitedworld.db"
+CHECKPOINT_EVERY = 1000
+CHECKPOINT_SECONDS = 5.0
+TAIL_BLOCK_SIZE = 64 * 1024
+COMMIT_LOCK = "ledger"
+SEQLOCK_READ_RETRIES = 1000
+WATCH_REFRESH_SECONDS = 1.0
+WATCH_CHANGES_KEPT = 10000
+SEARCH_BATCH_SIZE = 64
+SEARCH_BATCH_MAX = 4096
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+# -------------------------
+# CROSS-PROCESS LOCKS
+# -------------------------
+class LockManager:
+    """Reader/writer locks shared by every process using one data directory.
+
+    Each name (a table, a log, or COMMIT_LOCK) maps to data/<name>.lock and
+    is locked with flock(), so separate file descriptors - other worker
+    processes or other threads here - exclude each other. Locks are
+    re-entrant per thread and several names are always taken in sorted
+    order.
+
+    A thread that holds an exclusive lock takes no shared locks: its reads
+    happen inside its own transaction and must never wait on another
+    process's transaction, which could be waiting on it.
+    """
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        self._local = threading.local()
+
+    def _held(self):
+        held = getattr(self._local, "held", None)
+        if held is None:
+            held = self._local.held = {}
+        return held
+
+    def _acquire(self, name, mode):
+        held = self._held()
+        entry = held.get(name)
+        if entry is not None:
+            if mode == fcntl.LOCK_EX and entry[1] == fcntl.LOCK_SH:
+                fcntl.flock(entry[0], fcntl.LOCK_EX)
+                entry[1] = fcntl.LOCK_EX
+            entry[2] += 1
+            return
+        fd = os.open(os.path.join(self.lock_dir, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+        except BaseException:
+            os.close(fd)
+            raise
+        held[name] = [fd, mode, 1]
+
+    def _release(self, name):
+        held = self._held()
+        entry = held[name]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del held[name]
+            fcntl.flock(entry[0], fcntl.LOCK_UN)
+            os.close(entry[0])
+
+    @contextmanager
+    def _locked(self, names, mode):
+        names = sorted(set(names))
+        taken = []
+        try:
+            for name in names:
+                self._acquire(name, mode)
+                taken.append(name)
+            yield
+        finally:
+            for name in reversed(taken):
+                self._release(name)
+
+    def shared(self, *names):
+        """Lock names for reading; skipped inside a write lock"""
+        if fcntl is None or any(entry[1] == fcntl.LOCK_EX for entry in self._held().values()):
+            return _no_lock()
+        return self._locked(names, fcntl.LOCK_SH)
+
+    def exclusive(self, *names):
+        """Lock names for writing"""
+        if fcntl is None:
+            return _no_lock()
+        return self._locked(names, fcntl.LOCK_EX)
+
+
+@contextmanager
+def _no_lock():
+    yield
+
+# -------------------------
+# SEARCH INDEX
+# -------------------------
+class TrigramIndex:
+    """In-memory trigram postings for case-insensitive substring search.
+
+    Documents are numbered in the order they are added, and each trigram
+    maps to an ascending array of document numbers. A document holding
+    every trigram of the query is only a candidate: the caller still
+    checks the text itself.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.size = 0
+
+    def add(self, text):
+        doc = self.size
+        self.size += 1
+        for gram in _trigrams(text):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(doc)
+        return doc
+
+    def candidates(self, text, start=0, stop=None, reverse=True):
+        """Documents in [start, stop) that may contain text, newest first unless
+        reverse is False. None if text is too short to have a trigram."""
+        grams = _trigrams(text)
+        if not grams:
+            return None
+        lists = sorted((self.postings.get(gram, array("I")) for gram in grams), key=len)
+        first, rest = lists[0], lists[1:]
+        stop = self.size if stop is None else stop
+        lo, hi = bisect.bisect_left(first, start), bisect.bisect_left(first, stop)
+        docs = (first[i] for i in (range(hi - 1, lo - 1, -1) if reverse else range(lo, hi)))
+        return (doc for doc in docs if all(_has_doc(postings, doc) for postings in rest))
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _has_doc(postings, doc):
+    i = bisect.bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+
+def _search_text(cols, search_cols):
+    return "\t".join(cols[col] if len(cols) > col else "" for col in search_cols).lower()
+
+
+def _contains_text(cols, search_cols, text):
+    return any(text in (cols[col] if len(cols) > col else "").lower() for col in search_cols)
+
+# -------------------------
+# INDEXED TSV TABLES
+# -------------------------
+class TsvTable:
+    """A TSV data file held in memory with hash indexes on chosen columns.
+
+    Changes are not written to the TSV straight away: they go to the
+    store's write-ahead log and are applied in memory, and the file is
+    rewritten as a snapshot when the store checkpoints. The file is only
+    re-read if something outside the store changes it on disk.
+
+    Columns in sum_cols keep a running total over all rows, read with
+    total(col). search(text) finds rows where a search_cols column contains
+    text through a trigram index built on first use. Callbacks registered
+    with watch(fn) see every row change
+    as fn(old_cols, new_cols), including ones replayed from other
+    processes' log records; fn(None, None) means "start over", and is
+    followed by every row.
+    """
+
+    def __init__(self, store, name, path, header, key_col, index_cols=(), sum_cols=(),
+                 search_cols=()):
+        self.store = store
+        self.name = name
+        self.path = path
+        self.header = header
+        self.key_col = key_col
+        self.index_cols = tuple(index_cols)
+        self.sum_cols = tuple(sum_cols)
+        self.search_cols = tuple(search_cols)
+
+        self._signature = None
+        self._header_line = header
+        self._rows = []
+        self._by_key = {}
+        self._by_index = {col: {} for col in self.index_cols}
+        self._sums = {col: 0.0 for col in self.sum_cols}
+        self._search = None
+        self._search_docs = []
+        self._watchers = []
+        self._dirty = False
+
+    # ---- loading ----
+    def _load(self):
+        self._header_line = self.header
+        self._rows = []
+        signature = file_signature(self.path)
+
+        if signature is not None:
+            with open(self.path, "r") as f:
+                for i, line in enumerate(f):
+                    if i == 0:
+                        self._header_line = line if line.endswith("\n") else line + "\n"
+                        continue
+                    line = line.rstrip("\r\n")
+                    if not line.strip():
+                        continue
+                    self._rows.append(line.split("\t"))
+
+        self._reindex()
+        self._signature = signature
+        self._dirty = False
+        for watcher in self._watchers:
+            self._replay_to(watcher)
+
+    def _replay_to(self, watcher):
+        watcher(None, None)
+        for cols in self._rows:
+            watcher(None, list(cols))
+
+    def _notify(self, old, new):
+        for watcher in self._watchers:
+            watcher(old, new)
+
+    def _key_of(self, cols):
+        if isinstance(self.key_col, tuple):
+            if len(cols) <= max(self.key_col, default=-1):
+                return None
+            return tuple(cols[col] for col in self.key_col)
+        if len(cols) <= self.key_col:
+            return None
+        return cols[self.key_col]
+
+    def _reindex(self):
+        self._by_key = {}
+        self._by_index = {col: {} for col in self.index_cols}
+        self._sums = {col: 0.0 for col in self.sum_cols}
+        self._search = None
+        for cols in self._rows:
+            self._index_row(cols)
+
+    def _index_row(self, cols):
+        key = self._key_of(cols)
+        if key is not None:
+            self._by_key.setdefault(key, cols)
+        for col in self.index_cols:
+            if len(cols) > col:
+                self._by_index[col].setdefault(cols[col], cols)
+        self._add_sums(cols, 1)
+        self._index_search(cols)
+
+    def _index_search(self, cols):
+        # A changed row is added again; its old document still points at
+        # the same list, and search() skips the duplicate
+        if self._search is not None:
+            self._search.add(_search_text(cols, self.search_cols))
+            self._search_docs.append(cols)
+
+    def _add_sums(self, cols, sign):
+        for col in self.sum_cols:
+            self._sums[col] += sign * _number(cols[col] if len(cols) > col else "")
+
+    def _touches_index(self, cols):
+        key_cols = self.key_col if isinstance(self.key_col, tuple) else (self.key_col,)
+        return any(col in key_cols or col in self.index_cols for col in cols)
+
+    # ---- applying logged changes (store lock held) ----
+    def _apply_set(self, key, changes):
+        cols = self._by_key.get(key)
+        if cols is None:
+            return
+        old = list(cols) if self._watchers else None
+        self._add_sums(cols, -1)
+        for col, value in changes.items():
+            while len(cols) <= col:
+                cols.append("")
+            cols[col] = value
+        self._add_sums(cols, 1)
+        if self._touches_index(changes):
+            self._reindex()
+        elif self._search is not None and any(col in self.search_cols for col in changes):
+            self._index_search(cols)
+        self._dirty = True
+        if self._watchers:
+            self._notify(old, list(cols))
+
+    def _apply_put(self, new_cols):
+        key = self._key_of(new_cols)
+        cols = self._by_key.get(key) if key is not None else None
+        old = list(cols) if cols is not None and self._watchers else None
+        if cols is None:
+            cols = list(new_cols)
+            self._rows.append(cols)
+            self._index_row(cols)
+        else:
+            searched = _search_text(cols, self.search_cols) if self._search is not None else None
+            self._add_sums(cols, -1)
+            cols[:] = new_cols
+            self._add_sums(cols, 1)
+            if searched is not None and _search_text(cols, self.search_cols) != searched:
+                self._index_search(cols)
+        self._dirty = True
+        if self._watchers:
+            self._notify(old, list(cols))
+
+    def _apply_delete(self, key):
+        cols = self._by_key.get(key)
+        if cols is None:
+            return
+        self._rows = [row for row in self._rows if self._key_of(row) != key]
+        self._reindex()
+        self._dirty = True
+        if self._watchers:
+            self._notify(list(cols), None)
+
+    def _apply_delete_many(self, keys):
+        keys = {key for key in keys if key in self._by_key}
+        if not keys:
+            return
+        removed = [row for row in self._rows if self._key_of(row) in keys]
+        self._rows = [row for row in self._rows if self._key_of(row) not in keys]
+        self._reindex()
+        self._dirty = True
+        for cols in removed if self._watchers else ():
+            self._notify(list(cols), None)
+
+    def _write_snapshot(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self._header_line)
+            for cols in self._rows:
+                f.write("\t".join(cols) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._signature = file_signature(self.path)
+        self._dirty = False
+
+    # ---- reads ----
+    def get(self, key):
+        """Return a copy of the row whose key column equals key, or None"""
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            cols = self._by_key.get(key)
+            return list(cols) if cols is not None else None
+
+    def get_by(self, col, value):
+        """Return a copy of the first row with cols[col] == value, or None"""
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            cols = self._by_index[col].get(value)
+            return list(cols) if cols is not None else None
+
+    def rows(self):
+        """Return copies of all rows in file order"""
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            return [list(cols) for cols in self._rows]
+
+    def total(self, col):
+        """Running sum of a sum_cols column over all rows"""
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            return self._sums[col]
+
+    def search(self, text, limit=50):
+        """Copies of up to limit rows, newest first, where a search_cols
+        column contains text (case-insensitive)"""
+        text = text.lower()
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            if self._search is None:
+                self._search = TrigramIndex()
+                self._search_docs = []
+                for cols in self._rows:
+                    self._index_search(cols)
+            docs = self._search.candidates(text)
+            if docs is None:
+                candidates = reversed(self._rows)
+            else:
+                candidates = (self._search_docs[doc] for doc in docs)
+            rows, seen = [], set()
+            for cols in candidates:
+                if id(cols) in seen or not _contains_text(cols, self.search_cols, text):
+                    continue
+                seen.add(id(cols))
+                rows.append(list(cols))
+                if len(rows) >= limit:
+                    break
+            return rows
+
+    def watch(self, callback):
+        """Register callback(old_cols, new_cols) and feed it the current rows"""
+        with self.store.locks.shared(self.name), self.store.lock:
+            self.store.refresh(self)
+            self._watchers.append(callback)
+            self._replay_to(callback)
+
+    # ---- writes ----
+    # Each write commits on its own under the table's write lock, or is
+    # staged on txn (which already holds the lock) when one is given.
+    def update(self, key, changes, txn=None):
+        """Apply {column_index: value} changes to the row with the given key.
+
+        Returns the updated row, or None if the key is unknown.
+        """
+        with self.store.write_lock(self.name, txn), self.store.lock:
+            self.store.refresh(self)
+            if key not in self._by_key:
+                return None
+            cols = list(self._by_key[key])
+            for col, value in changes.items():
+                while len(cols) <= col:
+                    cols.append("")
+                cols[col] = str(value)
+
+            changes = {str(col): str(value) for col, value in changes.items()}
+            self.store.stage(["set", self.name, key, changes], txn)
+            return cols
+
+    def put(self, cols, txn=None):
+        """Insert a row, replacing any existing row with the same key"""
+        cols = [str(c) for c in cols]
+        with self.store.write_lock(self.name, txn):
+            self.store.stage(["put", self.name, cols], txn)
+        return cols
+
+    def delete(self, key, txn=None):
+        """Remove the row with the given key. Returns the removed row or None"""
+        with self.store.write_lock(self.name, txn), self.store.lock:
+            self.store.refresh(self)
+            cols = self._by_key.get(key)
+            if cols is None:
+                return None
+            cols = list(cols)
+            self.store.stage(["delete", self.name, key], txn)
+            return cols
+
+    def delete_many(self, keys, txn=None):
+        """Remove the rows with the given keys in one logged change"""
+        keys = list(keys)
+        if keys:
+            with self.store.write_lock(self.name, txn):
+                self.store.stage(["delete_many", self.name, keys], txn)
+
+# -------------------------
+# APPEND-ONLY TSV LOGS
+# -------------------------
+class TsvLog:
+    """An append-only TSV file such as transactions.tsv or orders.tsv.
+
+    Rows are appended to the file directly. Inside a store transaction the
+    rows are also written into the log record (with the byte offset they
+    will land at), so a crash between the log write and the file append
+    is repaired when the store next opens. Logs with a key_col (deposit
+    and withdrawal requests) can also have single rows patched.
+
+    "Most recent N" selects on an indexed timestamp column read the file
+    backwards from the end. <file>.order records how far any row's
+    timestamp lags behind the newest one written before it, which tells
+    the reader when no older row can make the top N any more.
+
+    For each of lookup_cols, <file>.<col>.idx maps a value (a user's
+    email) to the byte offsets of its rows, so selects filtered on that
+    column only read the matching rows.
+
+    totals=(group_col, sum_col) keeps a row count and amount total per
+    group in <file>.totals, read with totals().
+
+    search_cols are indexed in <file>.search, an SQLite FTS5 trigram table
+    with one document per row, caught up from the end of the file on each
+    search, so search() and page(search=...) read only candidate rows. The
+    row offsets it points at are kept in memory.
+
+    fixed_cols={col: width} pads those columns with trailing spaces when a
+    row is written (readers strip them). A patch that only changes them,
+    such as a request's status, is then written over the old bytes of the
+    row, found through the key_col lookup index, instead of rewriting the
+    whole file.
+
+    queue=(col, values) keeps the keys of the rows whose col holds one of
+    values (pending requests) in <file>.queue, so selects and pages
+    filtered on one of those values read only the queued rows, through
+    the key_col lookup index, however long the log grows.
+    """
+
+    def __init__(self, store, name, path, header, key_col=None, indexes=(), lookup_cols=(),
+                 totals=None, search_cols=(), fixed_cols=None, queue=None):
+        self.store = store
+        self.name = name
+        self.path = path
+        self.header = header
+        self.key_col = key_col
+        self.indexes = tuple(indexes)
+        self.order_cols = {idx if isinstance(idx, int) else idx[-1] for idx in self.indexes}
+        self.lookup_cols = tuple(lookup_cols)
+        self.totals_cols = totals
+        self.search_cols = tuple(search_cols)
+        self.fixed_cols = dict(fixed_cols or {})
+        self.queue = (queue[0], tuple(queue[1])) if queue else None
+        self._summaries = {}
+        self._sidecar_sigs = {}
+        self._lookups = {}
+        self._search = None
+        self._search_conn = None
+        # Guards the sidecar state below against concurrent request threads
+        self._sidecar_lock = threading.RLock()
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            with open(self.path, "w") as f:
+                f.write(self.header)
+            return os.path.getsize(self.path)
+
+    def _write(self, data):
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _pad(self, cols):
+        if not self.fixed_cols:
+            return cols
+        cols = list(cols)
+        for col, width in self.fixed_cols.items():
+            if len(cols) > col:
+                cols[col] = cols[col].ljust(width)
+        return cols
+
+    def _encode(self, cols):
+        return _encode_row(self._pad(cols))
+
+    def _split(self, text):
+        cols = text.split("\t")
+        for col in self.fixed_cols:
+            if len(cols) > col:
+                cols[col] = cols[col].rstrip(" ")
+        return cols
+
+    def _repair(self, offset, data):
+        size = self._size()
+        if size >= offset + len(data):
+            return
+        with open(self.path, "r+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(data)
+
+    def _rows(self):
+        rows = []
+        try:
+            with open(self.path, "r") as f:
+                f.readline()
+                for line in f:
+                    line = line.rstrip("\r\n")
+                    if line.strip():
+                        rows.append(self._split(line))
+        except OSError:
+            pass
+        return rows
+
+    def _patch(self, patches):
+        """Apply [(key, {col: value}), ...] in order with one file rewrite"""
+        with self._sidecar_lock:
+            self._patch_locked(patches)
+
+    def _patch_locked(self, patches):
+        if not patches or not os.path.exists(self.path):
+            return
+        # Catch the summaries up first so they can be carried over the rewrite
+        summaries = {suffix: self._summary(suffix) for suffix in self._summary_specs()}
+        if self._patch_in_place(patches, summaries):
+            return
+        resized = {suffix: 0 for suffix in summaries}
+
+        with open(self.path, "r", newline="") as f:
+            lines = f.readlines()
+
+        changed = False
+        offset = len(lines[0].encode("utf-8")) if lines else 0
+        for i, line in enumerate(lines[1:], start=1):
+            line_offset = offset
+            offset += len(line.encode("utf-8"))
+            cols = self._split(line.rstrip("\r\n"))
+            if len(cols) <= self.key_col:
+                continue
+            new_cols = None
+            for key, changes in patches:
+                if cols[self.key_col] != key:
+                    continue
+                new_cols = new_cols or list(cols)
+                for col, value in changes.items():
+                    col = int(col)
+                    while len(new_cols) <= col:
+                        new_cols.append("")
+                    new_cols[col] = value
+            if new_cols is not None and new_cols != cols:
+                new_line = "\t".join(self._pad(new_cols)) + "\n"
+            elif self.fixed_cols:
+                # Pad rows written before fixed_cols while the file is rewritten anyway
+                new_cols, new_line = None, "\t".join(self._pad(cols)) + "\n"
+            else:
+                continue
+            if new_line != line:
+                lines[i] = new_line
+                changed = True
+                for suffix, state in summaries.items():
+                    if state is None or line_offset >= state["size"]:
+                        continue
+                    resized[suffix] += len(new_line.encode("utf-8")) - len(line.encode("utf-8"))
+                    if new_cols is not None:
+                        self._carry_summary(suffix, state, cols, new_cols)
+
+        if changed:
+            old_ino = os.stat(self.path).st_ino
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.path)
+
+            ino = os.stat(self.path).st_ino
+            self._search_moved(old_ino, ino)
+            for suffix, state in summaries.items():
+                if state is None or suffix not in self._summaries:
+                    continue
+                state["ino"] = ino
+                state["size"] += resized[suffix]
+                self._save_summary(suffix, state)
+
+    def _patch_in_place(self, patches, summaries):
+        """Write patches over the padded fixed_cols of their rows.
+
+        Returns False, having written nothing, if a patch touches another
+        column or a new value is longer than the field it replaces.
+        """
+        if not self.fixed_cols or self.key_col not in self.lookup_cols:
+            return False
+        if any(int(col) not in self.fixed_cols or int(col) in self.lookup_cols
+               for _, changes in patches for col in changes):
+            return False
+        state = self._lookup_state(self.key_col)
+        if state is None:
+            return False
+
+        rows = {}
+        with open(self.path, "r+b") as f:
+            for key, changes in patches:
+                for offset in state["offsets"].get(key, ()):
+                    if offset not in rows:
+                        f.seek(offset)
+                        line = f.readline()
+                        if not line.endswith(b"\n"):
+                            return False
+                        cols = self._split(line.decode("utf-8").rstrip("\r\n"))
+                        if _field(cols, self.key_col) != key:
+                            return False
+                        rows[offset] = (line, cols, list(cols))
+                    new_cols = rows[offset][2]
+                    for col, value in changes.items():
+                        if len(new_cols) <= int(col):
+                            return False
+                        new_cols[int(col)] = value
+
+            writes = []
+            for offset, (line, cols, new_cols) in rows.items():
+                fields = line.rstrip(b"\r\n").split(b"\t")
+                for col in self.fixed_cols:
+                    if col >= len(cols) or cols[col] == new_cols[col]:
+                        continue
+                    value = new_cols[col].encode("utf-8")
+                    if len(value) > len(fields[col]):
+                        return False
+                    position = offset + sum(len(field) + 1 for field in fields[:col])
+                    writes.append((position, value.ljust(len(fields[col]))))
+            for position, data in writes:
+                f.seek(position)
+                f.write(data)
+
+        # Other processes read the summaries from the sidecars, which must
+        # not be left describing the old values
+        for offset, (line, cols, new_cols) in rows.items():
+            for suffix, summary in summaries.items():
+                if summary is not None and offset < summary["size"]:
+                    self._carry_summary(suffix, summary, cols, new_cols)
+        for suffix in summaries:
+            state = self._summaries.get(suffix)
+            if state is None or not self._save_summary(suffix, state):
+                self._summaries.pop(suffix, None)
+                try:
+                    os.remove(f"{self.path}.{suffix}")
+                except OSError:
+                    pass
+        return True
+
+    def _carry_summary(self, suffix, state, old_cols, new_cols):
+        """Swap a rewritten row in a summary, or drop a summary that can't take rows out"""
+        empty, fold, used_cols, retractable = self._summary_specs()[suffix]
+        if all(_field(old_cols, col) == _field(new_cols, col) for col in used_cols):
+            return
+        if retractable:
+            fold(state["data"], old_cols, -1)
+            fold(state["data"], new_cols, 1)
+        else:
+            self._summaries.pop(suffix, None)
+
+    def _sync(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                os.fsync(f.fileno())
+
+    def _scan(self, offset):
+        """Yield (offset, cols, end) for each complete row from offset on"""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            if offset == 0:
+                offset = len(f.readline())
+            for line in f:
+                end = offset + len(line)
+                if line.endswith(b"\n"):
+                    text = line.decode("utf-8").rstrip("\r\n")
+                    if text.strip():
+                        yield offset, self._split(text), end
+                offset = end
+
+    def _row_offsets(self, offset):
+        """Yield (offset, end) for the same rows as _scan, without decoding them"""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            if offset == 0:
+                offset = len(f.readline())
+            for line in f:
+                end = offset + len(line)
+                if line.endswith(b"\n") and not line.isspace():
+                    if line.isascii() or line.decode("utf-8").strip():
+                        yield offset, end
+                offset = end
+
+    def _reverse_rows(self, end=None):
+        """Yield (offset, cols) from the last row (or the one before end) back to the first"""
+        with open(self.path, "rb") as f:
+            first = len(f.readline())
+            pos = f.seek(0, os.SEEK_END) if end is None else max(end, first)
+            carry = b""
+            while pos > first:
+                step = min(TAIL_BLOCK_SIZE, pos - first)
+                pos -= step
+                f.seek(pos)
+                lines = (f.read(step) + carry).split(b"\n")
+                # lines[0] may be cut off by the block boundary
+                carry = lines[0] if pos > first else b""
+                start = pos + len(lines[0]) + 1
+                offsets = []
+                for line in lines[1:]:
+                    offsets.append(start)
+                    start += len(line) + 1
+                if pos == first:
+                    offsets.insert(0, pos)
+                    lines = [b""] + lines
+                for offset, line in zip(reversed(offsets), reversed(lines[1:])):
+                    text = line.decode("utf-8").rstrip("\r")
+                    if text.strip():
+                        yield offset, self._split(text)
+
+    def _summary_specs(self):
+        """suffix -> (empty, fold, columns read, whether fold can take rows out)"""
+        specs = {}
+        if self.order_cols:
+            specs["order"] = (lambda: {"max": {}, "lag": {}}, self._fold_order,
+                              self.order_cols, False)
+        if self.totals_cols:
+            specs["totals"] = (dict, self._fold_totals, self.totals_cols, True)
+        if self.queue:
+            specs["queue"] = (dict, self._fold_queue, (self.queue[0],), True)
+        return specs
+
+    def _summary(self, suffix):
+        """Running summary of the rows, checkpointed in <file>.<suffix>.
+
+        The sidecar holds the summary plus the byte offset of the last row
+        it includes, so only rows appended since are folded in. It starts
+        over from empty if the file was replaced or truncated by anything
+        but _patch. Rows patched in place are carried into the sidecar under
+        COMMIT_LOCK, so it is read again whenever another process saved it.
+        """
+        with self.store.locks.shared(COMMIT_LOCK), self._sidecar_lock:
+            return self._summary_locked(suffix)
+
+    def _summary_locked(self, suffix):
+        empty, fold = self._summary_specs()[suffix][:2]
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        def usable(state):
+            return (state is not None and "data" in state and state.get("ino") == st.st_ino
+                    and state.get("size", 0) <= st.st_size)
+
+        path = f"{self.path}.{suffix}"
+        state = self._summaries.get(suffix)
+        if state is not None and file_signature(path) != self._sidecar_sigs.get(suffix):
+            state = None
+        if not usable(state):
+            # The sidecar may have been carried over another process's rewrite
+            self._sidecar_sigs[suffix] = file_signature(path)
+            try:
+                with open(path, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+        if not usable(state):
+            state = {"ino": st.st_ino, "size": 0, "data": empty()}
+
+        if state["size"] < st.st_size:
+            size = state["size"]
+            for _, cols, size in self._scan(state["size"]):
+                fold(state["data"], cols, 1)
+            if size != state["size"]:
+                state["size"] = size
+                self._save_summary(suffix, state)
+
+        self._summaries[suffix] = state
+        return state
+
+    def _save_summary(self, suffix, state):
+        tmp_path = f"{self.path}.{suffix}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, f"{self.path}.{suffix}")
+        except OSError:
+            return False
+        self._sidecar_sigs[suffix] = file_signature(f"{self.path}.{suffix}")
+        return True
+
+    def _fold_order(self, data, cols, sign):
+        """Track the newest value and the worst lag behind it per order column"""
+        newest, lag = data["max"], data["lag"]
+        for col in self.order_cols:
+            value = _sort_value(cols, col)
+            if value[0] != 1:
+                continue
+            col = str(col)
+            if col in newest and newest[col] - value[1] > lag.get(col, 0.0):
+                lag[col] = newest[col] - value[1]
+            if col not in newest or value[1] > newest[col]:
+                newest[col] = value[1]
+
+    def _fold_totals(self, data, cols, sign):
+        """Count and sum rows per group (sign -1 takes a row back out)"""
+        group_col, sum_col = self.totals_cols
+        if len(cols) <= group_col:
+            return
+        try:
+            amount = float(cols[sum_col]) if len(cols) > sum_col and cols[sum_col] else 0.0
+        except ValueError:
+            amount = 0.0
+        count, total = data.get(cols[group_col], (0, 0.0))
+        data[cols[group_col]] = [count + sign, total + sign * amount]
+
+    def _fold_queue(self, data, cols, sign):
+        """Add or take out the key of a row holding a queued value"""
+        col, values = self.queue
+        value = _field(cols, col)
+        if value not in values or len(cols) <= self.key_col:
+            return
+        keys = data.setdefault(value, [])
+        if sign > 0:
+            keys.append(cols[self.key_col])
+        elif cols[self.key_col] in keys:
+            keys.remove(cols[self.key_col])
+
+    def _queue_rows(self, where):
+        """(offset, cols) in file order of the rows matching where, read
+        through the queue, or None if where doesn't pick a queued value"""
+        if (not self.queue or not where or self.key_col not in self.lookup_cols
+                or where.get(self.queue[0]) not in self.queue[1]):
+            return None
+        with self.store.locks.shared(COMMIT_LOCK), self._sidecar_lock:
+            state = self._summary("queue")
+            if state is None:
+                return None
+            keys = list(state["data"].get(where[self.queue[0]], ()))
+        lookup = self._lookup_state(self.key_col)
+        if lookup is None:
+            return None
+        offsets = sorted(offset for key in keys for offset in lookup["offsets"].get(key, ()))
+        return [(offset, cols) for offset, cols in self._rows_at(offsets) if _matches(cols, where)]
+
+    def _order_state(self):
+        return self._summary("order")
+
+    def _lookup_state(self, col):
+        """value -> row offsets for col, loaded from <file>.<col>.idx and caught up"""
+        with self._sidecar_lock:
+            return self._lookup_state_locked(col)
+
+    def _lookup_state_locked(self, col):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        idx_path = f"{self.path}.{col}.idx"
+        state = self._lookups.get(col)
+        if state is None:
+            state = {"ino": None, "size": 0, "offsets": {}, "last": None}
+            try:
+                with open(idx_path, "r") as f:
+                    state["ino"] = int(f.readline().lstrip("#"))
+                    last = -1
+                    for line in f:
+                        parts = line.rstrip("\n").split("\t")
+                        if len(parts) != 3 or not line.endswith("\n"):
+                            continue
+                        offset = int(parts[1])
+                        # Processes catching up together can log a row twice
+                        if offset > last:
+                            state["offsets"].setdefault(parts[0], []).append(offset)
+                            state["size"] = int(parts[2])
+                            state["last"] = (parts[0], offset)
+                            last = offset
+            except (OSError, ValueError):
+                state["ino"] = None
+
+        # A file rewritten in place keeps its inode: the last indexed row
+        # must still end where the index does and hold the same value
+        if (state["ino"] != st.st_ino or state["size"] > st.st_size
+                or not self._row_intact(state["last"], state["size"], col)):
+            state = {"ino": st.st_ino, "size": 0, "offsets": {}, "last": None}
+            tmp_path = f"{idx_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    f.write(f"#{st.st_ino}\n")
+                os.replace(tmp_path, idx_path)
+            except OSError:
+                pass
+
+        if state["size"] < st.st_size:
+            entries = []
+            for offset, cols, end in self._scan(state["size"]):
+                value = cols[col] if len(cols) > col else ""
+                state["offsets"].setdefault(value, []).append(offset)
+                entries.append(f"{value}\t{offset}\t{end}\n")
+                state["size"] = end
+                state["last"] = (value, offset)
+            if entries:
+                try:
+                    with open(idx_path, "a") as f:
+                        f.write("".join(entries))
+                except OSError:
+                    pass
+
+        self._lookups[col] = state
+        return state
+
+    def _line_at(self, offset):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return f.readline()
+        except OSError:
+            return b""
+
+    def _row_at_end(self, offset, size):
+        """The row at offset if it still ends at size, else None"""
+        line = self._line_at(offset)
+        if not line.endswith(b"\n") or offset + len(line) != size:
+            return None
+        return self._split(line.decode("utf-8", "replace").rstrip("\r\n"))
+
+    def _row_intact(self, last, size, col):
+        """True if the row last=(value, offset) still ends at size holding value in col"""
+        if last is None:
+            return True
+        cols = self._row_at_end(last[1], size)
+        return cols is not None and (_field(cols, col) or "") == last[0]
+
+    def _select_lookup(self, col, where):
+        """Rows matching where, read through the offset index on col"""
+        state = self._lookup_state(col)
+        if state is None:
+            return []
+        rows = []
+        with open(self.path, "rb") as f:
+            for offset in state["offsets"].get(where[col], ()):
+                f.seek(offset)
+                cols = self._split(f.readline().decode("utf-8").rstrip("\r\n"))
+                if _matches(cols, where):
+                    rows.append(cols)
+        return rows
+
+    def _search_db(self):
+        """Connection to <file>.search, or None if this SQLite has no FTS5
+        trigram tokenizer (searches then read the whole file)"""
+        if self._search_conn is None:
+            try:
+                conn = sqlite3.connect(f"{self.path}.search", timeout=30, isolation_level=None,
+                                       check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs "
+                             "USING fts5(text, content='', tokenize='trigram')")
+            except sqlite3.Error as e:
+                print(f"Search index for {self.path} unavailable: {e}")
+                self._search_conn = False
+                return None
+            self._search_conn = conn
+        return self._search_conn or None
+
+    def _search_state(self):
+        """Each row's byte offset, plus the shared index caught up to the file"""
+        with self.store.locks.shared(COMMIT_LOCK), self._sidecar_lock:
+            return self._search_state_locked()
+
+    def _search_state_locked(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        conn = self._search_db()
+        if conn is None:
+            return None
+        ino = _meta_int(st.st_ino)
+
+        state = self._search
+        if state is not None and state["ino"] != st.st_ino:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'ino'").fetchone()
+            if row is not None and row[0] != ino:
+                # Replaced from outside the store
+                state = None
+        if state is not None and state["ino"] != st.st_ino:
+            # Rewritten by _patch: the same rows in the same order, at new offsets
+            offsets = array("Q")
+            size = 0
+            for offset, end in self._row_offsets(0):
+                if len(offsets) == len(state["offsets"]):
+                    break
+                offsets.append(offset)
+                size = end
+            if len(offsets) == len(state["offsets"]):
+                state.update(ino=st.st_ino, size=size, offsets=offsets)
+            else:
+                state = None
+        if state is not None and state["size"] > st.st_size:
+            state = None
+        if state is not None and state["offsets"] and self._row_at_end(
+                state["offsets"][-1], state["size"]) is None:
+            # Rewritten in place: the rows moved
+            state = None
+        if state is None:
+            state = {"ino": st.st_ino, "size": 0, "offsets": array("Q")}
+        self._search = state
+
+        def catch_up():
+            for offset, end in self._row_offsets(state["size"]):
+                state["offsets"].append(offset)
+                state["size"] = end
+
+        catch_up()
+        offsets = state["offsets"]
+
+        # Documents are numbered by row, so the index survives _patch rewrites
+        # and is shared by every process; each adds the rows it is first to read.
+        # meta records the file they were read from and a checksum of the last
+        # one's text, so a file replaced or rewritten by anything else is
+        # indexed again.
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+                indexed = meta.get("docs", 0)
+                if indexed > len(offsets):
+                    catch_up()
+                if (indexed > len(offsets) or meta.get("ino", ino) != ino
+                        or indexed and meta.get("check", 0) != self._doc_check(offsets[indexed - 1])):
+                    conn.execute("INSERT INTO docs(docs) VALUES ('delete-all')")
+                    indexed = 0
+                if indexed < len(offsets):
+                    rows = self._rows_at(offsets[doc] for doc in range(indexed, len(offsets)))
+                    conn.executemany("INSERT INTO docs(rowid, text) VALUES (?, ?)",
+                                     ((doc, _search_text(cols, self.search_cols))
+                                      for doc, (_, cols) in enumerate(rows, indexed)))
+                if indexed < len(offsets) or meta.get("ino") != ino:
+                    check = self._doc_check(offsets[-1]) if offsets else 0
+                    conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                     [("docs", len(offsets)), ("ino", ino), ("check", check)])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"Search index for {self.path} not updated: {e}")
+            return None
+        return state
+
+    def _doc_check(self, offset):
+        line = self._line_at(offset).decode("utf-8", "replace").rstrip("\r\n")
+        return zlib.crc32(_search_text(self._split(line), self.search_cols).encode("utf-8"))
+
+    def _search_moved(self, old_ino, ino):
+        """Point the search index at the file _patch rewrote from old_ino"""
+        if not self.search_cols or not os.path.exists(f"{self.path}.search"):
+            return
+        conn = self._search_db()
+        if conn is None:
+            return
+        try:
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'ino' AND value = ?",
+                         [_meta_int(ino), _meta_int(old_ino)])
+        except sqlite3.Error as e:
+            print(f"Search index for {self.path} not updated: {e}")
+
+    def _search_docs(self, text, start, stop, reverse):
+        """Documents in [start, stop) whose text contains text, read from the
+        index a batch at a time"""
+        match = '"' + text.replace('"', '""') + '"'
+        order = "DESC" if reverse else "ASC"
+        batch = SEARCH_BATCH_SIZE
+        while start < stop:
+            with self._sidecar_lock:
+                docs = [row[0] for row in self._search_conn.execute(
+                    f"SELECT rowid FROM docs WHERE docs MATCH ? AND rowid >= ? AND rowid < ? "
+                    f"ORDER BY rowid {order} LIMIT ?", (match, start, stop, batch))]
+            yield from docs
+            if len(docs) < batch:
+                return
+            if reverse:
+                stop = docs[-1]
+            else:
+                start = docs[-1] + 1
+            batch = min(batch * 4, SEARCH_BATCH_MAX)
+
+    def _rows_at(self, offsets):
+        with open(self.path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                line = f.readline()
+                if line.endswith(b"\n"):
+                    yield offset, self._split(line.decode("utf-8").rstrip("\r\n"))
+
+    def _search_rows(self, text, start=None, forward=False):
+        """(offset, cols) of rows that may contain text: those before start,
+        newest first, or with forward those from start on"""
+        state = self._search_state() if len(text) >= 3 else None
+        if state is None:
+            if forward:
+                return ((offset, cols) for offset, cols, _ in self._scan(start))
+            return self._reverse_rows(start)
+        offsets = state["offsets"]
+        split = len(offsets) if start is None else bisect.bisect_left(offsets, start)
+        if forward:
+            docs = self._search_docs(text, split, len(offsets), reverse=False)
+        else:
+            docs = self._search_docs(text, 0, split, reverse=True)
+        return self._rows_at(offsets[doc] for doc in docs)
+
+    def search(self, text, limit=50):
+        """Up to limit rows, last written first, where a search_cols column
+        contains text (case-insensitive)"""
+        text = text.lower()
+        rows = []
+        for _, cols in self._search_rows(text):
+            if _contains_text(cols, self.search_cols, text):
+                rows.append(cols)
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def _select_recent(self, where, order_by, limit):
+        """Newest limit rows by order_by, reading from the end of the file"""
+        if limit <= 0:
+            return []
+        state = self._order_state()
+        if state is None:
+            return []
+        lag = state["data"]["lag"].get(str(order_by), 0.0)
+
+        # Min-heap of the best rows so far: larger value first, and for equal
+        # values the earlier row, matching a stable descending sort.
+        heap = []
+        for offset, cols in self._reverse_rows():
+            value = _sort_value(cols, order_by)
+            if _matches(cols, where):
+                entry = (value, -offset, cols)
+                if len(heap) < limit:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+            if (len(heap) == limit and offset < state["size"] and value[0] == 1
+                    and heap[0][0][0] == 1 and value[1] + lag < heap[0][0][1]):
+                # Every older row is at most value + lag: none can beat heap[0]
+                break
+
+        heap.sort(key=lambda entry: entry[:2], reverse=True)
+        return [entry[2] for entry in heap]
+
+    def _row_at(self, offset):
+        try:
+            with open(self.path, "rb") as f:
+                if offset < len(f.readline()):
+                    return None
+                f.seek(offset)
+                line = f.readline()
+        except OSError:
+            return None
+        if not line.endswith(b"\n"):
+            return None
+        return self._split(line.decode("utf-8").rstrip("\r\n"))
+
+    def page(self, order_by, where=None, after=None, limit=50, since=None, until=None,
+             search=None, tie_col=None):
+        """One page of rows, newest first by (order_by, tie_col).
+
+        where is {column_index: value}, since/until bound order_by and
+        search=(columns, text) keeps rows where any of the columns contains
+        text. after is the cursor returned with the previous page. It
+        carries the byte offset of that page's last row, so the next page
+        reads backwards from there (plus the few rows after it that the
+        order lag allows) instead of from the end of the file.
+        Returns (rows, cursor), with cursor None after the last page.
+        """
+        tie_col = self.key_col if tie_col is None else tie_col
+        if limit <= 0:
+            return [], None
+        state = self._order_state()
+        if state is None:
+            return [], None
+        lag = state["data"]["lag"].get(str(order_by), 0.0)
+        bound = _decode_cursor(after)
+        bound_key = None
+        if bound is not None:
+            bound_key = (_sort_value([bound[0]], 0), bound[1])
+
+        def sort_key(cols):
+            return (_sort_value(cols, order_by), _field(cols, tie_col) or "")
+
+        keep = _row_filter(order_by, where, since, until, search)
+        heap = []
+        text = search[1].lower() if search and search[0] and search[1] else ""
+        indexed = text and self.search_cols and set(search[0]) <= set(self.search_cols)
+
+        def offer(offset, cols):
+            key = sort_key(cols)
+            if bound_key is not None and key >= bound_key:
+                return
+            if not keep(cols):
+                return
+            entry = (key, -offset, offset, cols)
+            if len(heap) <= limit:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+        queued = self._queue_rows(where)
+        start = None
+        if queued is None and bound is not None and len(bound) > 2:
+            cols = self._row_at(bound[2])
+            if cols is not None and sort_key(cols) == bound_key:
+                start = bound[2]
+        if start is not None:
+            # Rows after the cursor row sort below it only within the lag window
+            newest = bound_key[0]
+            if indexed:
+                newer = self._search_rows(text, start, forward=True)
+            else:
+                newer = ((offset, cols) for offset, cols, _ in self._scan(start))
+            for offset, cols in newer:
+                value = _sort_value(cols, order_by)
+                if value[0] == 1 and newest[0] == 1 and value[1] > newest[1] + lag:
+                    break
+                offer(offset, cols)
+
+        # With the queue or a search index only candidate rows are read; the
+        # lag bounds below hold for any subset of the rows in file order
+        if queued is not None:
+            older = reversed(queued)
+        elif indexed:
+            older = self._search_rows(text, start)
+        else:
+            older = self._reverse_rows(start)
+        for offset, cols in older:
+            offer(offset, cols)
+            value = _sort_value(cols, order_by)
+            if value[0] != 1 or offset >= state["size"]:
+                continue
+            if since is not None and value[1] + lag < since:
+                # Every older row is at most value + lag: all are before since
+                break
+            if (len(heap) > limit and heap[0][0][0][0] == 1
+                    and value[1] + lag < heap[0][0][0][1]):
+                break
+
+        heap.sort(key=lambda entry: entry[:2], reverse=True)
+        rows = [entry[3] for entry in heap[:limit]]
+        cursor = None
+        if len(heap) > limit:
+            last = heap[limit - 1]
+            cursor = _encode_cursor([_field(last[3], order_by) or "",
+                                     _field(last[3], tie_col) or "", last[2]])
+        return rows, cursor
+
+    # ---- reads ----
+    def select(self, where=None, order_by=None, desc=False, limit=None):
+        """Rows matching {column_index: value}, optionally sorted and limited"""
+        lookup = next((col for col in self.lookup_cols if where and col in where), None)
+        queued = self._queue_rows(where)
+        if queued is not None:
+            rows = [cols for _, cols in queued]
+        elif lookup is not None:
+            rows = self._select_lookup(lookup, where)
+        elif order_by in self.order_cols and desc and limit is not None:
+            return self._select_recent(where, order_by, limit)
+        else:
+            rows = [cols for cols in self._rows() if _matches(cols, where)]
+        if order_by is not None:
+            rows.sort(key=lambda cols: _sort_value(cols, order_by), reverse=desc)
+        return rows[:limit] if limit is not None else rows
+
+    def totals(self):
+        """{group: [row_count, amount_total]} over the whole log"""
+        with self.store.locks.shared(COMMIT_LOCK), self._sidecar_lock:
+            state = self._summary("totals")
+            if state is None:
+                return {}
+            return {group: list(values) for group, values in state["data"].items()}
+
+    def rebuild_totals(self):
+        """Recount totals() from every row of the file"""
+        self._summaries.pop("totals", None)
+        try:
+            os.remove(f"{self.path}.totals")
+        except OSError:
+            pass
+        return self.totals()
+
+    def get(self, key):
+        """First row whose key column equals key, or None"""
+        if self.key_col in self.lookup_cols:
+            rows = self._select_lookup(self.key_col, {self.key_col: key})
+            return rows[0] if rows else None
+        for cols in self._rows():
+            if len(cols) > self.key_col and cols[self.key_col] == key:
+                return cols
+        return None
+
+    # ---- writes ----
+    def append(self, cols, txn=None):
+        """Append one row. Returns the row as written"""
+        cols = [str(c) for c in cols]
+        if txn is not None:
+            txn.ops.append(["append", self.name, cols])
+        else:
+            with self.store.lock, self.store.locks.exclusive(COMMIT_LOCK):
+                self._size()
+                self._write(self._encode(cols))
+        return cols
+
+    def update(self, key, changes, txn=None):
+        """Set {column_index: value} on the row with the given key"""
+        changes = {str(col): str(value) for col, value in changes.items()}
+        with self.store.write_lock(self.name, txn):
+            self.store.stage(["patch", self.name, key, changes], txn)
+
+# -------------------------
+# WRITE-AHEAD LOG
+# -------------------------
+class WriteAheadLog:
+    """Append-only JSON-lines log of table changes.
+
+    The first line is a header naming the sequence number the log starts
+    after and the snapshot signatures the checkpoint wrote. Each following
+    line is one committed record: {"seq": n, "ts": t, "ops": [...]}.
+    Checkpoints start a fresh log by renaming a new file over the old one;
+    readers notice the inode change and move to the new file once they
+    have consumed the old one through their open handle.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+        self._file = None
+        self._ino = None
+        self._offset = 0
+        self.base_seq = 0
+        self.snapshots = {}
+        self.record_count = 0
+
+    def _write_new(self, base_seq, snapshots):
+        tmp_path = f"{self.path}.tmp"
+        header = {"wal": 1, "base_seq": base_seq, "snapshots": snapshots}
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _attach(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "a+b")
+        self._ino = os.fstat(self._file.fileno()).st_ino
+        self._file.seek(0)
+        header = json.loads(self._file.readline() or b"{}")
+        self._offset = self._file.tell()
+        self.base_seq = header.get("base_seq", 0)
+        self.snapshots = {name: tuple(sig) if sig else None
+                          for name, sig in header.get("snapshots", {}).items()}
+        self.record_count = 0
+
+    def open(self, snapshots):
+        """Attach to the log, creating it if missing; returns all records"""
+        if not os.path.exists(self.path):
+            self._write_new(0, snapshots)
+        self._attach()
+        self._truncate_torn_tail()
+        return self.read_new()
+
+    def _truncate_torn_tail(self):
+        size = os.fstat(self._file.fileno()).st_size
+        if size <= self._offset:
+            return
+        self._file.seek(size - 1)
+        if self._file.read(1) == b"\n":
+            return
+        self._file.seek(self._offset)
+        data = self._file.read()
+        self._file.truncate(self._offset + data.rfind(b"\n") + 1)
+
+    def _read_records(self):
+        self._file.seek(self._offset)
+        data = self._file.read()
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return []
+        self._offset += end
+
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        self.record_count += len(records)
+        return records
+
+    def read_new(self):
+        """Return records committed to the current file since the last call"""
+        return self._read_records()
+
+    def rotated(self):
+        """True once another process has replaced the log with a new one"""
+        try:
+            return os.stat(self.path).st_ino != self._ino
+        except OSError:
+            return False
+
+    def follow(self):
+        """Move on to the replacement log; call after draining the old one"""
+        self._attach()
+
+    def tail_changed(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return st.st_ino != self._ino or st.st_size != self._offset
+
+    def all_records(self):
+        """Re-read every record in the current log file"""
+        self._file.seek(0)
+        self._file.readline()
+        records = []
+        for line in self._file.read().splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self, base_seq, snapshots):
+        self._write_new(base_seq, snapshots)
+        self._attach()
+
+# -------------------------
+# TSV STORE
+# -------------------------
+class TsvStore:
+    """Owns the in-memory tables and the write-ahead log they share.
+
+    Every change is appended to the log first and then applied to memory
+    by replaying the log, so other processes pick up our changes (and we
+    pick up theirs) just by reading new log records. Tables are rewritten
+    as TSV snapshots every CHECKPOINT_EVERY records, or by the first commit
+    CHECKPOINT_SECONDS after the last checkpoint, so under steady traffic
+    the snapshots trail the log by seconds. The store must be the only
+    writer of its table files: an outside edit is reloaded, but the log is
+    replayed over it.
+
+    Across processes, transactions hold write locks on the tables and logs
+    they name for their whole read-modify-write, and every physical write
+    (log record, file appends, patches, checkpoints) happens under the
+    short COMMIT_LOCK. Lock order is: table/log locks, then self.lock,
+    then COMMIT_LOCK.
+    """
+
+    def __init__(self, data_dir, checkpoint_every=CHECKPOINT_EVERY, fsync=True,
+                 checkpoint_seconds=CHECKPOINT_SECONDS):
+        self.data_dir = data_dir
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self._checkpointed_at = time.monotonic()
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.logs = {}
+        self.wal = WriteAheadLog(os.path.join(data_dir, WAL_FILE_NAME), fsync)
+        self.locks = LockManager(data_dir)
+        self.last_seq = 0
+        self._opened = False
+
+    def table(self, name, path, header, key_col, index_cols=(), sum_cols=(), search_cols=()):
+        table = TsvTable(self, name, path, header, key_col, index_cols, sum_cols, search_cols)
+        self.tables[name] = table
+        return table
+
+    def log(self, name, path, header, key_col=None, indexes=(), lookup_cols=(), totals=None,
+            search_cols=(), fixed_cols=None, queue=None):
+        log = TsvLog(self, name, path, header, key_col, indexes, lookup_cols, totals, search_cols,
+                     fixed_cols, queue)
+        self.logs[name] = log
+        return log
+
+    def transaction(self, *names):
+        """Group writes into one atomic log record:
+
+            with store.transaction("users") as txn:
+                users.update(email, {6: new_inr}, txn=txn)
+                transactions.append(row, txn=txn)
+
+        names are the tables and logs whose rows the block reads and then
+        rewrites; they stay write-locked until the commit. With no names
+        every table and log is locked.
+        """
+        return Transaction(self, names or list(self.tables) + list(self.logs))
+
+    def write_lock(self, name, txn=None):
+        """Write lock for a single write made outside a transaction"""
+        if txn is not None:
+            return _no_lock()
+        return self.locks.exclusive(name)
+
+    def read_lock(self, name):
+        """Shared lock that keeps name's writers out (other readers are let in),
+        for copying what a read returned into a cache writers also update"""
+        return self.locks.shared(name)
+
+    # ---- replay ----
+    def _open(self):
+        with self.locks.exclusive(COMMIT_LOCK):
+            self._open_locked()
+
+    def _open_locked(self):
+        for table in self.tables.values():
+            table._load()
+        records = self.wal.open({name: table._signature
+                                 for name, table in self.tables.items()})
+        self.last_seq = self.wal.base_seq
+        patches = {}
+        for record in records:
+            self._apply(record)
+            for op in record.get("ops", []):
+                if op[1] not in self.logs:
+                    continue
+                if op[0] == "append":
+                    self.logs[op[1]]._repair(op[3], self.logs[op[1]]._encode(op[2]))
+                elif op[0] == "patch":
+                    patches.setdefault(op[1], []).append((op[2], op[3]))
+        for name, log_patches in patches.items():
+            self.logs[name]._patch(log_patches)
+        self._opened = True
+
+    def _apply(self, record, only=None):
+        for op in record.get("ops", []):
+            table = self.tables.get(op[1])
+            if table is None or (only is not None and table is not only):
+                continue
+            if op[0] == "set":
+                changes = {int(col): value for col, value in op[3].items()}
+                table._apply_set(_as_key(op[2]), changes)
+            elif op[0] == "put":
+                table._apply_put(op[2])
+            elif op[0] == "delete":
+                table._apply_delete(_as_key(op[2]))
+            elif op[0] == "delete_many":
+                table._apply_delete_many([_as_key(key) for key in op[2]])
+        if only is None:
+            self.last_seq = max(self.last_seq, record.get("seq", 0))
+
+    def refresh(self, table=None):
+        """Bring memory up to date with the log (and with table's file)"""
+        with self.lock:
+            if not self._opened:
+                self._open()
+                return
+
+            if self.wal.tail_changed():
+                for record in self.wal.read_new():
+                    self._apply(record)
+                if self.wal.rotated():
+                    # Another process checkpointed: the snapshots it wrote
+                    # match what we just replayed, so adopt their signatures.
+                    self.wal.follow()
+                    for name, signature in self.wal.snapshots.items():
+                        if name in self.tables:
+                            self.tables[name]._signature = signature
+                            self.tables[name]._dirty = False
+                    for record in self.wal.read_new():
+                        self._apply(record)
+
+            if table is not None and file_signature(table.path) != table._signature:
+                # Edited outside the store: reload it and replay our log on top
+                table._load()
+                for record in self.wal.all_records():
+                    self._apply(record, only=table)
+
+    # ---- writes ----
+    def stage(self, op, txn=None):
+        if txn is not None:
+            txn.ops.append(op)
+        else:
+            self.commit([op])
+
+    def commit(self, ops):
+        """Durably log a batch of ops, then apply them"""
+        with self.lock, self.locks.exclusive(COMMIT_LOCK):
+            self.refresh()
+
+            # Work out where each appended row will land so a crash after
+            # the log write can be repaired, then batch the rows per file.
+            pending = {}
+            sizes = {}
+            for op in ops:
+                if op[0] != "append":
+                    continue
+                log = self.logs[op[1]]
+                if log.name not in sizes:
+                    sizes[log.name] = log._size()
+                data = log._encode(op[2])
+                op[3:] = [sizes[log.name]]
+                sizes[log.name] += len(data)
+                pending.setdefault(log.name, []).append(data)
+
+            record = {"seq": self.last_seq + 1, "ts": int(time.time()), "ops": ops}
+            self.wal.append(record)
+            for name, rows in pending.items():
+                self.logs[name]._write(b"".join(rows))
+            patches = {}
+            for op in ops:
+                if op[0] == "patch":
+                    patches.setdefault(op[1], []).append((op[2], op[3]))
+            for name, log_patches in patches.items():
+                self.logs[name]._patch(log_patches)
+            self.refresh()
+
+            if (self.wal.record_count >= self.checkpoint_every
+                    or time.monotonic() - self._checkpointed_at >= self.checkpoint_seconds):
+                self.checkpoint()
+            return record["seq"]
+
+    def checkpoint(self):
+        """Fold the log into the TSV snapshots and start a fresh log"""
+        with self.lock, self.locks.exclusive(COMMIT_LOCK):
+            if not self._opened:
+                return
+            self.refresh()
+            for table in self.tables.values():
+                if table._dirty:
+                    table._write_snapshot()
+            for log in self.logs.values():
+                log._sync()
+            self.wal.rotate(self.last_seq, {name: table._signature
+                                            for name, table in self.tables.items()})
+            self._checkpointed_at = time.monotonic()
+
+
+class Transaction:
+    """Writes staged for a single atomic commit.
+
+    Write-locks the named tables and logs across processes, then holds the
+    store lock from entry to exit, so reads made inside the block see a
+    state nobody else can change before the commit. Nothing is written if
+    the block raises.
+    """
+
+    def __init__(self, store, names):
+        self.store = store
+        self.names = names
+        self.ops = []
+        self._on_commit = []
+        self._locks = None
+
+    def on_commit(self, callback):
+        """Run callback after a successful commit, before the locks are released"""
+        self._on_commit.append(callback)
+
+    def __enter__(self):
+        self._locks = self.store.locks.exclusive(*self.names)
+        self._locks.__enter__()
+        try:
+            self.store.lock.acquire()
+        except BaseException:
+            self._locks.__exit__(None, None, None)
+            raise
+        try:
+            self.store.refresh()
+        except BaseException:
+            self.store.lock.release()
+            self._locks.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                if self.ops:
+                    self.store.commit(self.ops)
+                for callback in self._on_commit:
+                    callback()
+        finally:
+            self.store.lock.release()
+            self._locks.__exit__(None, None, None)
+        return False
+
+
+def _encode_row(cols):
+    return ("\t".join(cols) + "\n").encode("utf-8")
+
+
+def _matches(cols, where):
+    if not where:
+        return True
+    for col, value in where.items():
+        if len(cols) <= col or cols[col] != value:
+            return False
+    return True
+
+
+def _row_filter(order_by, where, since, until, search):
+    """Predicate for page(): where, since/until on order_by and a search"""
+    columns, text = search if search else ((), "")
+    text = text.lower()
+
+    def keep(cols):
+        if not _matches(cols, where):
+            return False
+        if since is not None or until is not None:
+            value = _sort_value(cols, order_by)
+            if value[0] != 1:
+                return False
+            if since is not None and value[1] < since:
+                return False
+            if until is not None and value[1] > until:
+                return False
+        if text and columns and not any(text in (_field(cols, col) or "").lower() for col in columns):
+            return False
+        return True
+
+    return keep
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    """[order value, tie value(, byte offset)] from a page() cursor; ValueError if malformed"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("bad cursor")
+    if (not isinstance(values, list) or len(values) not in (2, 3)
+            or not all(isinstance(v, str) for v in values[:2])
+            or (len(values) == 3 and not isinstance(values[2], int))):
+        raise ValueError("bad cursor")
+    return values
+
+
+def _sort_value(cols, col):
+    value = cols[col] if len(cols) > col else ""
+    try:
+        return (1, float(value), "")
+    except ValueError:
+        return (0, 0.0, value)
+
+
+def _number(value):
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _field(cols, col):
+    return cols[col] if len(cols) > col else None
+
+
+def _meta_int(value):
+    # SQLite integers are signed 64-bit
+    return value & ((1 << 63) - 1)
+
+
+def _as_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+# -------------------------
+# SQLITE BACKEND
+# -------------------------
+class SqliteRelation:
+    """One TSV table or log stored as an SQLite table.
+
+    Each header column becomes a TEXT column; fields beyond the header are
+    kept tab-joined in an "extra" column so rows round-trip exactly.
+    totals=(group_col, sum_col) are kept in "<name>_totals" by triggers.
+    search_cols are indexed in an FTS5 trigram table, "<name>_search",
+    also kept by triggers; without FTS5, search() falls back to LIKE.
+    With track_changes, triggers also log the rowid of every changed row
+    to "<name>_changes" (the last WATCH_CHANGES_KEPT of them), and when
+    store.refresh() finds the database changed, watch() callbacks get
+    (old, new) for just those rows. Otherwise, or when the log no longer
+    reaches back far enough, they are re-fed the whole table (after
+    fn(None, None)).
+    """
+
+    def __init__(self, store, name, header, key_col, indexes=(), unique_key=False, totals=None,
+                 search_cols=(), track_changes=False):
+        self.store = store
+        self.name = name
+        self.header = header
+        self.key_col = key_col
+        self.indexes = tuple(indexes)
+        self.unique_key = unique_key
+        self.totals_cols = totals
+        self.search_cols = tuple(search_cols)
+        self.track_changes = track_changes
+        self._fts = False
+        self.columns = [re.sub(r"\W", "_", col) for col in header.rstrip("\n").split("\t")]
+
+        names = self.columns + ["extra"]
+        self._col_names = ", ".join(f'"{name}"' for name in names)
+        self._placeholders = ", ".join("?" for _ in names)
+        self._watchers = []
+        # rowid -> cols as last fed to the watchers, and the last change seen
+        self._watched_rows = None
+        self._changes_seen = 0
+
+    # ---- schema ----
+    def _key_cols(self):
+        if self.key_col is None:
+            return ()
+        if isinstance(self.key_col, tuple):
+            return self.key_col
+        return (self.key_col,)
+
+    def _schema(self):
+        cols = ", ".join(f'"{col}" TEXT' for col in self.columns)
+        statements = [f'CREATE TABLE IF NOT EXISTS "{self.name}" ({cols}, "extra" TEXT)']
+
+        key_cols = self._key_cols()
+        if key_cols:
+            unique = "UNIQUE " if self.unique_key else ""
+            statements.append(
+                f'CREATE {unique}INDEX IF NOT EXISTS "{self.name}_key" '
+                f'ON "{self.name}" ({self._col_list(key_cols)})'
+            )
+        for index in self.indexes:
+            index = index if isinstance(index, tuple) else (index,)
+            suffix = "_".join(self.columns[col] for col in index)
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS "{self.name}_{suffix}" '
+                f'ON "{self.name}" ({self._col_list(index)})'
+            )
+        if self.totals_cols:
+            statements += self._totals_schema()
+        if self.track_changes:
+            statements += self._changes_schema()
+        return statements
+
+    def _changes_schema(self):
+        changes = f'"{self.name}_changes"'
+        log_new = f"INSERT INTO {changes} (row) VALUES (NEW.rowid);"
+        log_old = f"INSERT INTO {changes} (row) VALUES (OLD.rowid);"
+        return [
+            f"CREATE TABLE IF NOT EXISTS {changes} (seq INTEGER PRIMARY KEY AUTOINCREMENT, row INTEGER)",
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_changes_insert" '
+            f'AFTER INSERT ON "{self.name}" BEGIN {log_new} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_changes_delete" '
+            f'AFTER DELETE ON "{self.name}" BEGIN {log_old} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_changes_update" '
+            f'AFTER UPDATE ON "{self.name}" BEGIN {log_old} {log_new} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_changes_trim" '
+            f'AFTER INSERT ON {changes} BEGIN '
+            f'DELETE FROM {changes} WHERE seq <= NEW.seq - {WATCH_CHANGES_KEPT}; END',
+        ]
+
+    def _totals_schema(self):
+        group, amount = (f'"{self.columns[col]}"' for col in self.totals_cols)
+        totals = f'"{self.name}_totals"'
+        add = (f"INSERT INTO {totals} SELECT NEW.{group}, 1, CAST(NEW.{amount} AS REAL) "
+               f"WHERE NEW.{group} IS NOT NULL "
+               f"ON CONFLICT (grp) DO UPDATE SET count = count + 1, amount = amount + excluded.amount;")
+        remove = (f"UPDATE {totals} SET count = count - 1, amount = amount - CAST(OLD.{amount} AS REAL) "
+                  f"WHERE grp = OLD.{group};")
+        return [
+            f"CREATE TABLE IF NOT EXISTS {totals} (grp TEXT PRIMARY KEY, count INTEGER, amount REAL)",
+            # Fills in a database created before the totals existed
+            f'INSERT OR IGNORE INTO {totals} SELECT {group}, COUNT(*), SUM(CAST({amount} AS REAL)) '
+            f'FROM "{self.name}" WHERE {group} IS NOT NULL GROUP BY {group}',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_totals_insert" '
+            f'AFTER INSERT ON "{self.name}" BEGIN {add} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_totals_delete" '
+            f'AFTER DELETE ON "{self.name}" BEGIN {remove} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.name}_totals_update" '
+            f'AFTER UPDATE OF {group}, {amount} ON "{self.name}" BEGIN {remove} {add} END',
+        ]
+
+    def _create_search(self, conn):
+        """Create (and on first creation fill) the FTS5 index over search_cols"""
+        if not self.search_cols:
+            return
+        fts = f'"{self.name}_search"'
+        cols = self._col_list(self.search_cols)
+        new = ", ".join(f'NEW."{self.columns[col]}"' for col in self.search_cols)
+        old = ", ".join(f'OLD."{self.columns[col]}"' for col in self.search_cols)
+        changed = " OR ".join(f'OLD."{self.columns[col]}" IS NOT NEW."{self.columns[col]}"'
+                              for col in self.search_cols)
+        insert = f"INSERT INTO {fts} (rowid, {cols}) VALUES (NEW.rowid, {new});"
+        remove = f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', OLD.rowid, {old});"
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                      [f"{self.name}_search"]).fetchone()
+                conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, "
+                             f"content='{self.name}', tokenize='trigram')")
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{self.name}_search_insert" '
+                             f'AFTER INSERT ON "{self.name}" BEGIN {insert} END')
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{self.name}_search_delete" '
+                             f'AFTER DELETE ON "{self.name}" BEGIN {remove} END')
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{self.name}_search_update" '
+                             f'AFTER UPDATE OF {cols} ON "{self.name}" WHEN {changed} '
+                             f'BEGIN {remove} {insert} END')
+                if not exists:
+                    conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            self._fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or its trigram tokenizer
+            self._fts = False
+
+    def _fts_match(self, text, cols):
+        """MATCH argument for a substring search of text in cols"""
+        names = " ".join(f'"{self.columns[col]}"' for col in cols)
+        return "{" + names + "} : \"" + text.replace('"', '""') + '"'
+
+    def _like_any(self, cols, text):
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", text) + "%"
+        clause = "(" + " OR ".join(f"\"{self.columns[col]}\" LIKE ? ESCAPE '\\'"
+                                   for col in cols) + ")"
+        return clause, [pattern] * len(cols)
+
+    def _col_list(self, cols):
+        return ", ".join(f'"{self.columns[col]}"' for col in cols)
+
+    # ---- row conversion ----
+    def _to_params(self, cols):
+        cols = [str(c) for c in cols]
+        n = len(self.columns)
+        values = cols[:n] + [None] * (n - len(cols))
+        values.append("\t".join(cols[n:]) if len(cols) > n else None)
+        return values
+
+    def _to_cols(self, row):
+        cols = list(row[:-1])
+        while cols and cols[-1] is None:
+            cols.pop()
+        if row[-1] is not None:
+            cols += row[-1].split("\t")
+        return ["" if value is None else value for value in cols]
+
+    def _key_where(self, key):
+        key_cols = self._key_cols()
+        if not key_cols:
+            return "1", []
+        values = list(key) if isinstance(self.key_col, tuple) else [key]
+        clause = " AND ".join(f'"{self.columns[col]}" = ?' for col in key_cols)
+        return clause, values
+
+    def _select_sql(self, where=None, order_by=None, desc=False, limit=None):
+        sql = f'SELECT * FROM "{self.name}"'
+        params = []
+        if where:
+            sql += " WHERE " + " AND ".join(f'"{self.columns[col]}" = ?' for col in where)
+            params += list(where.values())
+        if order_by is not None:
+            sql += f' ORDER BY "{self.columns[order_by]}"' + (" DESC" if desc else "")
+        else:
+            sql += " ORDER BY rowid"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, params
+
+    # ---- reads ----
+    def get(self, key):
+        clause, params = self._key_where(key)
+        row = self.store._query(
+            f'SELECT * FROM "{self.name}" WHERE {clause} ORDER BY rowid LIMIT 1', params
+        ).fetchone()
+        return self._to_cols(row) if row else None
+
+    def get_by(self, col, value):
+        row = self.store._query(
+            f'SELECT * FROM "{self.name}" WHERE "{self.columns[col]}" = ? ORDER BY rowid LIMIT 1',
+            [value]
+        ).fetchone()
+        return self._to_cols(row) if row else None
+
+    def rows(self):
+        return [self._to_cols(row) for row in
+                self.store._query(f'SELECT * FROM "{self.name}" ORDER BY rowid')]
+
+    def watch(self, callback):
+        self.store._watch(self, callback)
+
+    def _replay_to(self, watchers, conn):
+        """Reload the watched rows on conn and feed all of them to watchers"""
+        conn.execute("BEGIN")
+        try:
+            if self.track_changes:
+                self._changes_seen = conn.execute(
+                    f'SELECT COALESCE(MAX(seq), 0) FROM "{self.name}_changes"').fetchone()[0]
+            rows = conn.execute(f'SELECT rowid, * FROM "{self.name}" ORDER BY rowid').fetchall()
+        finally:
+            conn.execute("COMMIT")
+        self._watched_rows = {row[0]: self._to_cols(row[1:]) for row in rows}
+        self._feed_all(watchers)
+
+    def _feed_all(self, watchers):
+        for watcher in watchers:
+            watcher(None, None)
+            for cols in self._watched_rows.values():
+                watcher(None, list(cols))
+
+    def _feed_changes(self, watchers, conn):
+        """Feed watchers the rows changed since the last look, on conn"""
+        if not self.track_changes or self._watched_rows is None:
+            return self._replay_to(watchers, conn)
+
+        changes = f'"{self.name}_changes"'
+        conn.execute("BEGIN")
+        try:
+            oldest = conn.execute(f"SELECT MIN(seq) FROM {changes}").fetchone()[0]
+            logged = conn.execute(f"SELECT seq, row FROM {changes} WHERE seq > ? ORDER BY seq",
+                                  [self._changes_seen]).fetchall()
+            gap = logged and oldest > self._changes_seen + 1
+            current = {}
+            if logged and not gap:
+                rowids = list(dict.fromkeys(row for _, row in logged))
+                for i in range(0, len(rowids), 500):
+                    chunk = rowids[i:i + 500]
+                    for row in conn.execute(
+                            f'SELECT rowid, * FROM "{self.name}" WHERE rowid IN '
+                            f'({", ".join("?" for _ in chunk)})', chunk):
+                        current[row[0]] = self._to_cols(row[1:])
+        finally:
+            conn.execute("COMMIT")
+        if not logged:
+            return
+        if gap:
+            # Trimmed past our position: the log can't say what changed
+            return self._replay_to(watchers, conn)
+
+        self._changes_seen = logged[-1][0]
+        # Removals first, so a row that moved to a new rowid (a keyless
+        # table's delete + insert) is taken out before it is added back
+        changed = list(dict.fromkeys(row for _, row in logged))
+        for rowid in changed:
+            if rowid not in current and rowid in self._watched_rows:
+                old = self._watched_rows.pop(rowid)
+                for watcher in watchers:
+                    watcher(list(old), None)
+        for rowid in changed:
+            if rowid in current:
+                old = self._watched_rows.get(rowid)
+                new = current[rowid]
+                if old == new:
+                    continue
+                self._watched_rows[rowid] = new
+                for watcher in watchers:
+                    watcher(list(old) if old is not None else None, list(new))
+
+    def total(self, col):
+        row = self.store._query(
+            f'SELECT SUM(CAST("{self.columns[col]}" AS REAL)) FROM "{self.name}"'
+        ).fetchone()
+        return row[0] or 0.0
+
+    def totals(self):
+        return {grp: [count, amount] for grp, count, amount in
+                self.store._query(f'SELECT grp, count, amount FROM "{self.name}_totals"')}
+
+    def rebuild_totals(self):
+        with self.store.transaction():
+            self.store._query(f'DELETE FROM "{self.name}_totals"')
+            self.store._query(self._totals_schema()[1])
+        return self.totals()
+
+    def select(self, where=None, order_by=None, desc=False, limit=None):
+        sql, params = self._select_sql(where, order_by, desc, limit)
+        return [self._to_cols(row) for row in self.store._query(sql, params)]
+
+    def search(self, text, limit=50):
+        """Up to limit rows, last written first, where a search_cols column
+        contains text (case-insensitive)"""
+        self.store._conn()
+        if self._fts and len(text) >= 3:
+            fts = f'"{self.name}_search"'
+            rows = self.store._query(
+                f'SELECT "{self.name}".* FROM {fts} JOIN "{self.name}" '
+                f'ON "{self.name}".rowid = {fts}.rowid WHERE {fts} MATCH ? '
+                f'ORDER BY {fts}.rowid DESC LIMIT ?',
+                [self._fts_match(text, self.search_cols), limit]
+            )
+        else:
+            clause, params = self._like_any(self.search_cols, text)
+            rows = self.store._query(
+                f'SELECT * FROM "{self.name}" WHERE {clause} ORDER BY rowid DESC LIMIT ?',
+                params + [limit]
+            )
+        return [self._to_cols(row) for row in rows]
+
+    def page(self, order_by, where=None, after=None, limit=50, since=None, until=None,
+             search=None, tie_col=None):
+        """Same as TsvLog.page: one keyset page, filtered in the query"""
+        self.store._conn()
+        tie_col = self.key_col if tie_col is None else tie_col
+        if limit <= 0:
+            return [], None
+        order, tie = (f'"{self.columns[col]}"' for col in (order_by, tie_col))
+        clauses, params = [], []
+        for col, value in (where or {}).items():
+            clauses.append(f'"{self.columns[col]}" = ?')
+            params.append(value)
+        # Timestamps are stored as same-width digit strings, so text order works
+        if since is not None:
+            clauses.append(f"{order} >= ?")
+            params.append(str(int(since)))
+        if until is not None:
+            clauses.append(f"{order} <= ?")
+            params.append(str(int(until)))
+        if search and search[0] and search[1]:
+            clause, like = self._like_any(search[0], search[1])
+            clauses.append(clause)
+            params += like
+            if (self._fts and len(search[1]) >= 3
+                    and set(search[0]) <= set(self.search_cols)):
+                clauses.append(f'rowid IN (SELECT rowid FROM "{self.name}_search" '
+                               f'WHERE "{self.name}_search" MATCH ?)')
+                params.append(self._fts_match(search[1], search[0]))
+        bound = _decode_cursor(after)
+        if bound is not None:
+            clauses.append(f"({order} < ? OR ({order} = ? AND {tie} < ?))")
+            params += [bound[0], bound[0], bound[1]]
+
+        sql = f'SELECT * FROM "{self.name}"'
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order} DESC, {tie} DESC LIMIT ?"
+        rows = [self._to_cols(row) for row in self.store._query(sql, params + [limit + 1])]
+
+        cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            cursor = _encode_cursor([_field(rows[-1], order_by) or "",
+                                     _field(rows[-1], tie_col) or ""])
+        return rows, cursor
+
+    # ---- writes (txn is accepted for interface parity; statements run
+    # inside the thread's open transaction when there is one) ----
+    def update(self, key, changes, txn=None):
+        clause, params = self._key_where(key)
+        updates = []
+        for col, value in changes.items():
+            if col < len(self.columns):
+                updates.append((f'"{self.columns[col]}" = ?', str(value)))
+        if len(updates) != len(changes):
+            # Changes past the header live in "extra": rewrite the whole row
+            cols = self.get(key)
+            if cols is None:
+                return None
+            for col, value in changes.items():
+                while len(cols) <= col:
+                    cols.append("")
+                cols[col] = str(value)
+            values = self._to_params(cols)
+            updates = [(f'"{name}" = ?', value)
+                       for name, value in zip(self.columns + ["extra"], values)]
+
+        cursor = self.store._query(
+            f'UPDATE "{self.name}" SET {", ".join(u[0] for u in updates)} WHERE {clause}',
+            [u[1] for u in updates] + params
+        )
+        if cursor.rowcount == 0:
+            return None
+        return self.get(key)
+
+    def put(self, cols, txn=None):
+        cols = [str(c) for c in cols]
+        key_cols = self._key_cols()
+        insert = f'INSERT INTO "{self.name}" ({self._col_names}) VALUES ({self._placeholders})'
+        if not key_cols:
+            self.store._query(f'DELETE FROM "{self.name}"')
+            self.store._query(insert, self._to_params(cols))
+        else:
+            assignments = ", ".join(f'"{name}" = excluded."{name}"'
+                                    for name in self.columns + ["extra"])
+            self.store._query(
+                f'{insert} ON CONFLICT ({self._col_list(key_cols)}) DO UPDATE SET {assignments}',
+                self._to_params(cols)
+            )
+        return cols
+
+    def append(self, cols, txn=None):
+        cols = [str(c) for c in cols]
+        self.store._query(
+            f'INSERT INTO "{self.name}" ({self._col_names}) VALUES ({self._placeholders})',
+            self._to_params(cols)
+        )
+        return cols
+
+    def delete(self, key, txn=None):
+        cols = self.get(key)
+        if cols is None:
+            return None
+        clause, params = self._key_where(key)
+        self.store._query(f'DELETE FROM "{self.name}" WHERE {clause}', params)
+        return cols
+
+    def delete_many(self, keys, txn=None):
+        for key in keys:
+            clause, params = self._key_where(key)
+            self.store._query(f'DELETE FROM "{self.name}" WHERE {clause}', params)
+
+    def _replace_all(self, rows):
+        verb = "INSERT OR IGNORE" if self.unique_key else "INSERT"
+        self.store._query(f'DELETE FROM "{self.name}"')
+        self.store._conn().executemany(
+            f'{verb} INTO "{self.name}" ({self._col_names}) VALUES ({self._placeholders})',
+            [self._to_params(cols) for cols in rows]
+        )
+
+
+class SqliteStore:
+    """Same interface as TsvStore, backed by one SQLite database.
+
+    The database runs in WAL mode with one connection per thread.
+    store.transaction() maps to BEGIN IMMEDIATE ... COMMIT, which also
+    serializes writers across processes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.tables = {}
+        self.logs = {}
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._watch_lock = threading.Lock()
+        self._watch_conn = None
+        self._watch_version = None
+        self._watch_checked = 0.0
+
+    def table(self, name, path, header, key_col, index_cols=(), sum_cols=(), search_cols=()):
+        # Tables are the relations the app watches, so their changes are logged
+        table = SqliteRelation(self, name, header, key_col, index_cols, unique_key=True,
+                               search_cols=search_cols, track_changes=True)
+        self.tables[name] = table
+        return table
+
+    def log(self, name, path, header, key_col=None, indexes=(), lookup_cols=(), totals=None,
+            search_cols=(), fixed_cols=None, queue=None):
+        # lookup_cols and queue are served by the (col, ...) indexes here, and
+        # rows are updated in place whatever their width
+        log = SqliteRelation(self, name, header, key_col, indexes, totals=totals,
+                             search_cols=search_cols)
+        self.logs[name] = log
+        return log
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for relation in list(self.tables.values()) + list(self.logs.values()):
+                        for statement in relation._schema():
+                            conn.execute(statement)
+                        relation._create_search(conn)
+                    self._schema_ready = True
+        return conn
+
+    def _query(self, sql, params=()):
+        return self._conn().execute(sql, params)
+
+    def transaction(self, *names):
+        # BEGIN IMMEDIATE already serializes writers across processes
+        return SqliteTransaction(self)
+
+    def read_lock(self, name):
+        # WAL-mode readers never block writers, and writers publish their
+        # on_commit values before COMMIT, so only the write lock keeps one
+        # from publishing between a read and its copy
+        return self.transaction(name)
+
+    def refresh(self, table=None):
+        """Feed watchers the changes if another connection committed since the last look.
+
+        Checked at most every WATCH_REFRESH_SECONDS; a no-op without watchers.
+        """
+        watched = [relation for relation in list(self.tables.values()) + list(self.logs.values())
+                   if relation._watchers]
+        if not watched or time.monotonic() - self._watch_checked < WATCH_REFRESH_SECONDS:
+            return
+        with self._watch_lock:
+            self._watch_checked = time.monotonic()
+            version = self._data_version()
+            if version == self._watch_version:
+                return
+            self._watch_version = version
+            for relation in watched:
+                relation._feed_changes(list(relation._watchers), self._watch_conn)
+
+    def _data_version(self):
+        # PRAGMA data_version only moves for commits made on other
+        # connections, so it is read on one kept for this purpose.
+        if self._watch_conn is None:
+            self._conn()
+            self._watch_conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                               check_same_thread=False)
+        return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _watch(self, relation, callback):
+        with self._watch_lock:
+            if self._watch_version is None:
+                self._watch_version = self._data_version()
+            relation._watchers.append(callback)
+            if relation._watched_rows is None:
+                relation._replay_to([callback], self._watch_conn)
+            else:
+                relation._feed_all([callback])
+
+    def checkpoint(self):
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+class SqliteTransaction:
+    """BEGIN IMMEDIATE on enter, COMMIT on a clean exit, ROLLBACK otherwise.
+
+    A transaction opened inside another one on the same thread becomes a
+    savepoint of the outer transaction. on_commit callbacks run just
+    before the outermost COMMIT, the last point the write lock is held.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.ops = []
+        self._savepoint = None
+
+    def on_commit(self, callback):
+        self.store._local.on_commit[-1].append(callback)
+
+    def __enter__(self):
+        local = self.store._local
+        depth = getattr(local, "txn_depth", 0)
+        if depth:
+            self._savepoint = f"txn_{depth}"
+            self.store._conn().execute(f"SAVEPOINT {self._savepoint}")
+            local.on_commit.append([])
+        else:
+            self.store._conn().execute("BEGIN IMMEDIATE")
+            local.on_commit = [[]]
+        local.txn_depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self.store._local
+        local.txn_depth -= 1
+        callbacks = local.on_commit.pop()
+        conn = self.store._conn()
+        if self._savepoint:
+            if exc_type is not None:
+                conn.execute(f"ROLLBACK TO {self._savepoint}")
+            else:
+                local.on_commit[-1].extend(callbacks)
+            conn.execute(f"RELEASE {self._savepoint}")
+        elif exc_type is None:
+            try:
+                for callback in callbacks:
+                    callback()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        else:
+            conn.execute("ROLLBACK")
+        return False
+
+# -------------------------
+# SHARED-MEMORY RECORDS
+# -------------------------
+def shared_memory_name(prefix, path):
+    """Segment name unique to one data directory"""
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return f"{prefix}_{digest}"
+
+
+def _attach_shared_memory(name, size):
+    """Attach to the named segment, creating it zero-filled if needed"""
+    if shared_memory is None:
+        return None
+    try:
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name)
+    except (OSError, ValueError):
+        return None
+    try:
+        # The segment outlives any one worker; don't let the resource
+        # tracker unlink it when this process exits.
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class SharedRecord:
+    """A fixed-layout record in shared memory, guarded by a seqlock.
+
+    Readers in any process copy the fields without locks or syscalls and
+    retry if a write was in progress. Writers must already be serialized
+    (e.g. by holding the owning table's write lock) and should write the
+    value that was just made durable, so the record is only ever a cache.
+    """
+
+    def __init__(self, name, fmt):
+        self.name = name
+        self._seq = struct.Struct("<Q")
+        self._layout = struct.Struct("<Q" + fmt)
+        self._shm = None
+
+    def open(self):
+        """Attach to (or create) the segment. Returns False if unavailable"""
+        if self._shm is None:
+            self._shm = _attach_shared_memory(self.name, self._layout.size)
+        return self._shm is not None
+
+    def read(self):
+        """Current fields as a tuple, or None if never written or unavailable"""
+        if self._shm is None:
+            return None
+        buf = self._shm.buf
+        for _ in range(SEQLOCK_READ_RETRIES):
+            seq = self._seq.unpack_from(buf, 0)[0]
+            if seq & 1:
+                continue
+            values = self._layout.unpack_from(buf, 0)
+            if values[0] == seq and self._seq.unpack_from(buf, 0)[0] == seq:
+                return values[1:] if seq else None
+        return None
+
+    def write(self, *values):
+        if self._shm is None:
+            return
+        buf = self._shm.buf
+        seq = self._seq.unpack_from(buf, 0)[0]
+        if seq & 1:
+            seq += 1  # a writer died mid-update; start over from an even count
+        self._seq.pack_into(buf, 0, seq + 1)
+        self._layout.pack_into(buf, 0, seq + 1, *values)
+        self._seq.pack_into(buf, 0, seq + 2)
+
+
+class SharedVersions:
+    """Version tokens for many keys, hashed into a fixed array of slots.
+
+    touch(key) stores a fresh random token in the key's slot; get(key)
+    returns the current one (0 if never touched). Call touch() after the
+    change is committed and read get() before reading the data it covers:
+    then data tagged with a token is never older than that token, even
+    with unsynchronized writers. Keys sharing a slot only cause extra
+    changes, never missed ones.
+    """
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self._slot = struct.Struct("<Q")
+        self._shm = None
+
+    def open(self):
+        if self._shm is None:
+            self._shm = _attach_shared_memory(self.name, self._slot.size * self.slots)
+        return self._shm is not None
+
+    def _offset(self, key):
+        return (zlib.crc32(str(key).encode("utf-8")) % self.slots) * self._slot.size
+
+    def get(self, key):
+        """Current token for key, or None if shared memory is unavailable"""
+        if self._shm is None:
+            return None
+        return self._slot.unpack_from(self._shm.buf, self._offset(key))[0]
+
+    def touch(self, key):
+        if self._shm is None:
+            return
+        token = int.from_bytes(os.urandom(8), "little") or 1
+        self._slot.pack_into(self._shm.buf, self._offset(key), token)
+
+# -------------------------
+# BACKEND SELECTION & MIGRATION
+# -------------------------
+def open_store(backend, data_dir):
+    """Create an empty store for the "tsv" or "sqlite" backend"""
+    if backend == "sqlite":
+        return SqliteStore(os.path.join(data_dir, SQLITE_FILE_NAME))
+    if backend == "tsv":
+        return TsvStore(data_dir)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def migrate_store(source, target):
+    """Copy every table and log from source into target, replacing its data.
+
+    Returns {name: row_count}.
+    """
+    counts = {}
+    with target.transaction():
+        for name, table in source.tables.items():
+            rows = table.rows()
+            target.tables[name]._replace_all(rows)
+            counts[name] = len(rows)
+        for name, log in source.logs.items():
+            rows = log.select()
+            target.logs[name]._replace_all(rows)
+            counts[name] = len(rows)
+    return counts
@@ -0,0 +1,24 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py opens its store relative to the working directory at import time,
+# so the tests run against a scratch copy of data/
+_cwd = os.getcwd()
+_work = tempfile.mkdtemp()
+shutil.copytree(os.path.join(ROOT, "data"), os.path.join(_work, "data"),
+                ignore=shutil.ignore_patterns("*.lock", "*.wal", "unitedworld.db*"))
+os.chdir(_work)
+import app  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # The exit-time checkpoint would resolve data/ against the restored cwd
+    atexit.unregister(app.store.checkpoint)
+    os.chdir(_cwd)
+    shutil.rmtree(_work, ignore_errors=True)
@@ -0,0 +1,142 @@
+import threading
+import unittest
+from unittest import mock
+
+# conftest.py imports app against a scratch copy of data/
+import app
+from storage import LockManager
+
+
+class MarketTickTest(unittest.TestCase):
+    BUYER = "buyer@test.local"
+    SELLER = "seller@test.local"
+
+    def setUp(self):
+        app.write_market(200000.0, 100000.0)
+        for i, email in enumerate((self.BUYER, self.SELLER)):
+            if not app.get_user(email):
+                app.users_table.put([f"TST{i:05d}", f"Test {i}", email, "0", "x", "",
+                                     "1000", "0", 0])
+            app.update_user_balances(email, 1000.0, 0)
+            app.update_internal_mrx_balance(email, 5.0)
+        # The rejected user already traded today, so the tick loads a
+        # non-empty daily row for them before the order is rejected
+        today = app.date.today().isoformat()
+        app.daily_trades_table.put([today, self.SELLER, 20.0, 1, 0])
+        app.daily_trades_table.put([today, self.BUYER, 0.0, 0, 0])
+
+    def test_rejected_order_does_not_fail_its_batch(self):
+        results = app.market_engine._tick([
+            (self.SELLER, 10.0, "bearish", None),
+            (self.BUYER, 50.0, "bullish", None),
+        ])
+
+        self.assertEqual(results[0][0], 400)
+        self.assertEqual(results[1][0], 200)
+        self.assertTrue(results[1][1]["success"])
+
+        # The rejected account is left untouched
+        self.assertEqual(app.get_internal_mrx_balance(self.SELLER), 5.0)
+        self.assertEqual(float(app.get_user(self.SELLER)[6]), 1000.0)
+        self.assertEqual(app.get_user_daily_trades(self.SELLER), 20.0)
+
+        # The valid order is written back
+        self.assertGreater(app.get_internal_mrx_balance(self.BUYER), 5.0)
+        self.assertEqual(app.get_user_daily_trades(self.BUYER), 50.0)
+
+
+    def test_withdrawal_approvals_and_buys_keep_the_pool(self):
+        app.update_user_balances(self.BUYER, 100000.0, 0)
+        app.update_internal_mrx_balance(self.SELLER, 1000.0)
+        requests = [app.save_withdraw_request(self.SELLER, "Test 1", 10.0, "B", "12345678", "SBIN0")
+                    for _ in range(20)]
+        inr_before, mrx_before = app.read_market()
+        internal_before = app.get_total_internal_mrx()
+
+        buys = []
+        def buy():
+            for _ in range(20):
+                buys.append(app.market_engine.submit(self.BUYER, 50.0, "bullish"))
+        def approve():
+            for request_id in requests:
+                self.assertTrue(app.update_withdrawal_request_status(request_id, "approved"))
+        threads = [threading.Thread(target=buy), threading.Thread(target=approve)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(status == 200 for status, _ in buys))
+        inr_after, mrx_after = app.read_market()
+        expected_inr = inr_before + 20 * 50.0 * (1 - app.TAX_RATE) - 20 * 10.0
+        self.assertAlmostEqual(inr_after, expected_inr, places=1)
+        # Every MRX that left the pool landed in an internal balance and back
+        self.assertAlmostEqual(mrx_before - mrx_after,
+                               app.get_total_internal_mrx() - internal_before, places=3)
+
+    def test_concurrent_buys_conserve_pool_balances_and_daily_totals(self):
+        emails = [f"stress{i}@test.local" for i in range(4)]
+        today = app.date.today().isoformat()
+        for i, email in enumerate(emails):
+            if not app.get_user(email):
+                app.users_table.put([f"TST{i + 2:05d}", f"Stress {i}", email, "0", "x", "",
+                                     "1000", "0", 0])
+            app.update_user_balances(email, 1000.0, 0)
+            app.update_internal_mrx_balance(email, 0.0)
+            app.daily_trades_table.put([today, email, 0.0, 0, 0])
+        inr_before, mrx_before = app.read_market()
+        internal_before = app.get_total_internal_mrx()
+        taxes_before = len(app.tax_collection_log.select())
+
+        # Two threads per account, so an account's buys race each other too
+        results = {email: [] for email in emails}
+        def buy(email):
+            for _ in range(25):
+                results[email].append(app.market_engine.submit(email, 10.0, "bullish"))
+        threads = [threading.Thread(target=buy, args=(email,)) for email in emails * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        responses = [data for email in emails for status, data in results[email]]
+        self.assertEqual(len(responses), 200)
+        self.assertTrue(all(data["success"] for data in responses))
+
+        inr_after, mrx_after = app.read_market()
+        self.assertAlmostEqual(inr_after, inr_before + 200 * 10.0 * (1 - app.TAX_RATE), places=1)
+        allocated = sum(data["mrx_allocated_internally"] for data in responses)
+        self.assertAlmostEqual(mrx_before - mrx_after, allocated, places=3)
+        self.assertAlmostEqual(app.get_total_internal_mrx() - internal_before, allocated, places=3)
+        self.assertEqual(len(app.tax_collection_log.select()) - taxes_before, 200)
+
+        for email in emails:
+            mine = [data for status, data in results[email]]
+            self.assertAlmostEqual(app.get_internal_mrx_balance(email),
+                                   sum(data["mrx_allocated_internally"] for data in mine),
+                                   places=4)
+            self.assertAlmostEqual(float(app.get_user(email)[6]),
+                                   1000.0 + sum(data["profit"] for data in mine), delta=0.5)
+            self.assertEqual(app.get_user_daily_trades(email), 500.0)
+            self.assertEqual(app.daily_trades_table.get((today, email))[3], "50")
+
+    def test_market_state_is_seeded_once_without_the_write_lock(self):
+        opened = []
+        class CountingRecord(app.SharedRecord):
+            def open(self):
+                opened.append(self)
+                return super().open()
+
+        app._market_state_pid = None
+        # Another process reading the market holds its shared lock throughout
+        with LockManager(app.DATA_DIR).shared("market"), \
+                mock.patch.object(app, "SharedRecord", CountingRecord):
+            threads = [threading.Thread(target=app.read_market_state) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            self.assertFalse(any(thread.is_alive() for thread in threads))
+
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(app.read_market(), (200000.0, 100000.0))
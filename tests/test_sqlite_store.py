@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+# conftest.py imports app against a scratch copy of data/
+import app
+from storage import migrate_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGED = [
+    # (log, order_by, tie_col, where, search, limit) as the admin listings page them
+    ("deposit_requests", 7, 0, {}, None, 2),
+    ("withdraw_requests", 8, 0, {}, None, 3),
+    ("withdraw_requests", 8, 0, {4: "processed"}, None, 2),
+    ("tax_collection", 8, 0, {}, None, 50),
+    ("tax_collection", 8, 0, {3: "buy"}, None, 40),
+    ("tax_collection", 8, 0, {}, (app.TAX_SEARCH_COLS, "sami"), 5),
+]
+
+
+class SqliteStoreTest(unittest.TestCase):
+    def setUp(self):
+        # build_store opens data/ relative to the working directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(ROOT, "data"), os.path.join(self.dir, "data"),
+                        ignore=shutil.ignore_patterns("*.lock", "*.wal", "unitedworld.db*"))
+        os.chdir(self.dir)
+        self.tsv = app.build_store("tsv")
+        self.sqlite = app.build_store("sqlite")
+        self.counts = migrate_store(self.tsv, self.sqlite)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_migration_keeps_row_counts_and_totals(self):
+        for name, table in self.tsv.tables.items():
+            rows = table.rows()
+            self.assertEqual(self.counts[name], len(rows), name)
+            self.assertEqual(self.sqlite.tables[name].rows(), rows, name)
+        for name, log in self.tsv.logs.items():
+            rows = log.select()
+            self.assertEqual(self.counts[name], len(rows), name)
+            self.assertEqual(self.sqlite.logs[name].select(), rows, name)
+        self.assertGreater(self.counts["tax_collection"], 100)
+
+        for name in ("withdraw_requests", "deposit_requests", "tax_collection"):
+            expected = self.tsv.logs[name].totals()
+            totals = self.sqlite.logs[name].totals()
+            self.assertEqual(sorted(totals), sorted(expected), name)
+            for group, (count, amount) in expected.items():
+                self.assertEqual(totals[group][0], count, (name, group))
+                self.assertAlmostEqual(totals[group][1], amount, places=2, msg=(name, group))
+        self.assertAlmostEqual(self.sqlite.tables["internal_mrx"].total(1),
+                               self.tsv.tables["internal_mrx"].total(1), places=6)
+
+    def test_migrate_to_sqlite_command_replaces_the_data(self):
+        # Runs against the database setUp already filled: a re-run must not duplicate rows
+        result = app.app.test_cli_runner().invoke(args=["migrate-to-sqlite"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        for name, count in self.counts.items():
+            self.assertIn(f"{name}: {count} rows", result.output)
+
+        migrated = app.build_store("sqlite")
+        self.assertEqual(len(migrated.logs["tax_collection"].select()),
+                         self.counts["tax_collection"])
+        self.assertEqual(migrated.tables["users"].rows(), self.tsv.tables["users"].rows())
+        self.assertEqual(migrated.logs["tax_collection"].totals(),
+                         self.sqlite.logs["tax_collection"].totals())
+
+    def test_first_and_second_pages_match_the_tsv_backend(self):
+        for name, order_by, tie_col, where, search, limit in PAGED:
+            args = dict(order_by=order_by, where=where, limit=limit, search=search,
+                        tie_col=tie_col)
+            tsv_rows, tsv_cursor = self.tsv.logs[name].page(**args)
+            rows, cursor = self.sqlite.logs[name].page(**args)
+            self.assertEqual(rows, tsv_rows, (name, where, search))
+            self.assertEqual(len(rows), limit, (name, where, search))
+            self.assertIsNotNone(cursor)
+
+            # Each backend continues from its own cursor
+            tsv_rows, tsv_cursor = self.tsv.logs[name].page(after=tsv_cursor, **args)
+            rows, cursor = self.sqlite.logs[name].page(after=cursor, **args)
+            self.assertEqual(rows, tsv_rows, (name, where, search))
+            self.assertTrue(rows)
+            self.assertEqual(cursor is None, tsv_cursor is None, (name, where, search))
+
+        # A date range is applied in the query as well
+        since = int(self.tsv.logs["tax_collection"].select(order_by=8)[20][8])
+        args = dict(order_by=8, since=since, limit=30, tie_col=0)
+        self.assertEqual(self.sqlite.logs["tax_collection"].page(**args)[0],
+                         self.tsv.logs["tax_collection"].page(**args)[0])
+
+    def test_triggers_keep_totals_and_search_in_step(self):
+        withdrawals = self.sqlite.logs["withdraw_requests"]
+        taxes = self.sqlite.logs["tax_collection"]
+        request = withdrawals.select(where={4: "processed"})[0]
+        before = withdrawals.totals()
+        tax_before = taxes.totals()["buy"]
+
+        with self.sqlite.transaction() as txn:
+            withdrawals.update(request[0], {4: "rejected"}, txn=txn)
+            taxes.append(["TAXTEST1", "x@test", "Zebulon Quartz", "buy", "100", "5", "100",
+                          "2026-01-01 00:00:00", "1767225600", ""], txn=txn)
+
+        totals = withdrawals.totals()
+        amount = float(request[3])
+        self.assertEqual(totals["processed"][0], before["processed"][0] - 1)
+        self.assertAlmostEqual(totals["processed"][1], before["processed"][1] - amount)
+        self.assertEqual(totals["rejected"][0], before.get("rejected", [0, 0])[0] + 1)
+        self.assertEqual(taxes.totals()["buy"][0], tax_before[0] + 1)
+        self.assertAlmostEqual(taxes.totals()["buy"][1], tax_before[1] + 5)
+        self.assertEqual(taxes.rebuild_totals(), taxes.totals())
+
+        withdrawals.append(["WDRTEST1", "x@test", "Zebulon Quartz", "10", "pending", "B",
+                            "12345678", "SBIN0", "1767225600", "", ""])
+        self.assertEqual([cols[0] for cols in withdrawals.search("zebulon")], ["WDRTEST1"])
+        withdrawals.update("WDRTEST1", {2: "Someone Else"})
+        self.assertEqual(withdrawals.search("zebulon"), [])
+        self.assertEqual([cols[0] for cols in withdrawals.search("someone else")], ["WDRTEST1"])
+        self.assertEqual(withdrawals.totals()["pending"][0], before.get("pending", [0, 0])[0] + 1)
+
+    def test_watchers_get_only_rows_changed_by_another_connection(self):
+        users = self.sqlite.tables["users"]
+        seen = []
+        users.watch(lambda old, new: seen.append((old, new)))
+        self.assertEqual(seen[0], (None, None))
+        self.assertEqual(len(seen), len(users.rows()) + 1)
+        email = users.rows()[0][2]
+
+        # Another process writes through its own connection
+        other = app.build_store("sqlite")
+        other.tables["users"].update(email, {6: "4321.0"})
+        del seen[:]
+        self.sqlite._watch_checked = 0.0
+        self.sqlite.refresh()
+        self.assertEqual(len(seen), 1)
+        old, new = seen[0]
+        self.assertEqual((old[2], new[2], new[6]), (email, email, "4321.0"))
+
+    def test_nested_transactions_roll_back_to_their_savepoint(self):
+        users = self.sqlite.tables["users"]
+        email, other_email = users.rows()[0][2], users.rows()[1][2]
+        committed = []
+
+        with self.sqlite.transaction() as outer:
+            users.update(email, {6: "1.0"}, txn=outer)
+            with self.assertRaises(RuntimeError):
+                with self.sqlite.transaction() as inner:
+                    users.update(other_email, {6: "2.0"}, txn=inner)
+                    inner.on_commit(lambda: committed.append("rolled back"))
+                    raise RuntimeError("inner")
+            with self.sqlite.transaction() as inner:
+                users.update(other_email, {6: "3.0"}, txn=inner)
+                inner.on_commit(lambda: committed.append("inner"))
+            self.assertEqual(committed, [])
+
+        self.assertEqual(committed, ["inner"])
+        self.assertEqual(users.get(email)[6], "1.0")
+        self.assertEqual(users.get(other_email)[6], "3.0")
+
+        with self.assertRaises(RuntimeError):
+            with self.sqlite.transaction() as outer:
+                users.update(email, {6: "9.0"}, txn=outer)
+                with self.sqlite.transaction() as inner:
+                    users.update(other_email, {6: "9.0"}, txn=inner)
+                raise RuntimeError("outer")
+        self.assertEqual(users.get(email)[6], "1.0")
+        self.assertEqual(users.get(other_email)[6], "3.0")
@@ -0,0 +1,338 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import TsvStore, WAL_FILE_NAME  # noqa: E402
+
+USERS_HEADER = "email\tbalance\n"
+PAYMENTS_HEADER = "email\tamount\n"
+REQUESTS_HEADER = "request_id\temail\tamount\tstatus\tremarks\n"
+STATUS_WIDTH = 10
+SIDECAR_HEADER = "request_id\temail\tname\tstatus\n"
+
+
+class TsvStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.users_path = os.path.join(self.dir, "users.tsv")
+        self.payments_path = os.path.join(self.dir, "payments.tsv")
+        self.wal_path = os.path.join(self.dir, WAL_FILE_NAME)
+        with open(self.users_path, "w") as f:
+            f.write(USERS_HEADER + "a@test\t10\nb@test\t20\n")
+        with open(self.payments_path, "w") as f:
+            f.write(PAYMENTS_HEADER)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open_store(self):
+        # A fresh store on the same directory is what a restarted process sees
+        s = TsvStore(self.dir, fsync=False, checkpoint_seconds=3600)
+        s.table("users", self.users_path, USERS_HEADER, key_col=0, sum_cols=(1,))
+        s.log("payments", self.payments_path, PAYMENTS_HEADER)
+        return s
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def pay(self, s, email, amount):
+        users, payments = s.tables["users"], s.logs["payments"]
+        with s.transaction("users", "payments") as txn:
+            balance = float(users.get(email)[1])
+            users.update(email, {1: balance + amount}, txn=txn)
+            payments.append([email, amount], txn=txn)
+
+    def test_commit_is_replayed_after_a_crash_before_the_checkpoint(self):
+        s = self.open_store()
+        self.pay(s, "a@test", 5)
+        s.tables["users"].put(["c@test", "1"])
+        # Only the log holds the changes: the snapshot is untouched
+        self.assertEqual(self.read(self.users_path),
+                         (USERS_HEADER + "a@test\t10\nb@test\t20\n").encode())
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.tables["users"].get("a@test"), ["a@test", "15.0"])
+        self.assertEqual(reopened.tables["users"].get("c@test"), ["c@test", "1"])
+        self.assertEqual(reopened.tables["users"].total(1), 36.0)
+        self.assertEqual(reopened.logs["payments"].select(), [["a@test", "5"]])
+
+        reopened.checkpoint()
+        self.assertIn(b"a@test\t15.0\n", self.read(self.users_path))
+        self.assertEqual(self.open_store().tables["users"].get("a@test"), ["a@test", "15.0"])
+
+    def test_log_append_lost_in_a_crash_is_repaired(self):
+        s = self.open_store()
+        self.pay(s, "a@test", 5)
+        # Crash after the log record was written but before the row reached payments.tsv
+        with open(self.payments_path, "r+b") as f:
+            f.truncate(len(PAYMENTS_HEADER))
+
+        reopened = self.open_store()
+        reopened.refresh()
+        self.assertEqual(reopened.logs["payments"].select(), [["a@test", "5"]])
+        self.assertEqual(self.read(self.payments_path),
+                         (PAYMENTS_HEADER + "a@test\t5\n").encode())
+
+    def test_torn_record_at_the_end_of_the_log_is_dropped(self):
+        s = self.open_store()
+        self.pay(s, "a@test", 5)
+        with open(self.wal_path, "ab") as f:
+            f.write(b'{"seq": 2, "ops": [["set", "users", "b@test", {"1": "9')
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.tables["users"].get("a@test"), ["a@test", "15.0"])
+        self.assertEqual(reopened.tables["users"].get("b@test"), ["b@test", "20"])
+        self.assertTrue(self.read(self.wal_path).endswith(b"\n"))
+
+        # The next commit lands on a clean line and survives another restart
+        self.pay(reopened, "b@test", 1)
+        self.assertEqual(self.open_store().tables["users"].get("b@test"), ["b@test", "21.0"])
+
+    def test_raising_block_writes_nothing(self):
+        s = self.open_store()
+        s.tables["users"].get("a@test")
+        wal, users, payments = (self.read(p) for p in
+                                (self.wal_path, self.users_path, self.payments_path))
+
+        with self.assertRaises(RuntimeError):
+            with s.transaction("users", "payments") as txn:
+                s.tables["users"].update("a@test", {1: "0"}, txn=txn)
+                s.tables["users"].put(["c@test", "1"], txn=txn)
+                s.logs["payments"].append(["a@test", "10"], txn=txn)
+                raise RuntimeError("insufficient balance")
+
+        self.assertEqual(self.read(self.wal_path), wal)
+        self.assertEqual(self.read(self.users_path), users)
+        self.assertEqual(self.read(self.payments_path), payments)
+        self.assertEqual(s.tables["users"].get("a@test"), ["a@test", "10"])
+        self.assertIsNone(s.tables["users"].get("c@test"))
+        self.assertEqual(self.open_store().tables["users"].rows(),
+                         [["a@test", "10"], ["b@test", "20"]])
+
+        # The locks were released: the next transaction goes through
+        self.pay(s, "a@test", 5)
+        self.assertEqual(s.tables["users"].get("a@test"), ["a@test", "15.0"])
+
+    def test_external_edit_is_reloaded_with_the_log_replayed_over_it(self):
+        s = self.open_store()
+        s.tables["users"].get("a@test")
+        self.pay(s, "a@test", 5)
+
+        # A PHP-style rewrite of the snapshot: tmp file renamed over it,
+        # editing a row the log touched, one it didn't, and adding a row
+        tmp_path = f"{self.users_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(USERS_HEADER + "a@test\t999\nb@test\t25\nd@test\t7\n")
+        os.replace(tmp_path, self.users_path)
+
+        users = s.tables["users"]
+        self.assertEqual(users.get("a@test"), ["a@test", "15.0"])
+        self.assertEqual(users.get("b@test"), ["b@test", "25"])
+        self.assertEqual(users.get("d@test"), ["d@test", "7"])
+        self.assertEqual(users.total(1), 47.0)
+
+        # A restarted process reconciles the edit the same way
+        reopened = self.open_store()
+        self.assertEqual(reopened.tables["users"].rows(),
+                         [["a@test", "15.0"], ["b@test", "25"], ["d@test", "7"]])
+
+        # An in-place edit (same inode) after the checkpoint is picked up too
+        s.checkpoint()
+        with open(self.users_path, "a") as f:
+            f.write("e@test\t3\n")
+        self.assertEqual(users.get("e@test"), ["e@test", "3"])
+        self.assertEqual(users.get("a@test"), ["a@test", "15.0"])
+
+
+class TsvLogPatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "requests.tsv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open_log(self):
+        s = TsvStore(self.dir, fsync=False, checkpoint_seconds=3600)
+        return s.log("requests", self.path, REQUESTS_HEADER, key_col=0, lookup_cols=(0,),
+                     totals=(3, 2), fixed_cols={3: STATUS_WIDTH})
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def totals(self, log):
+        # Groups emptied by a patch stay in the running totals as [0, 0]
+        return {group: values for group, values in log.totals().items() if values[0]}
+
+    def fill(self, log):
+        for i, status in enumerate(("pending", "pending", "approved")):
+            log.append([f"R{i}", f"u{i}@test", "100", status, ""])
+
+    def test_status_patch_is_written_in_place(self):
+        log = self.open_log()
+        self.fill(log)
+        self.assertEqual(log.totals(), {"pending": [2, 200.0], "approved": [1, 100.0]})
+        before, ino = self.read(), os.stat(self.path).st_ino
+
+        log.update("R1", {3: "rejected"})
+
+        after = self.read()
+        self.assertEqual(os.stat(self.path).st_ino, ino)
+        self.assertEqual(len(after), len(before))
+        changed = [i for i, (a, b) in enumerate(zip(before, after)) if a != b]
+        field = before.index(b"R1\tu1@test\t100\t") + len(b"R1\tu1@test\t100\t")
+        self.assertTrue(changed)
+        self.assertTrue(all(field <= i < field + STATUS_WIDTH for i in changed))
+        self.assertEqual(log.get("R1"), ["R1", "u1@test", "100", "rejected", ""])
+        self.assertEqual(self.totals(log), {"pending": [1, 100.0], "approved": [1, 100.0],
+                                            "rejected": [1, 100.0]})
+        self.assertEqual(self.totals(log), log.rebuild_totals())
+
+    def test_wider_value_or_other_column_falls_back_to_a_rewrite(self):
+        log = self.open_log()
+        self.fill(log)
+        ino = os.stat(self.path).st_ino
+
+        log.update("R0", {3: "on-hold-by-admin"})
+        self.assertNotEqual(os.stat(self.path).st_ino, ino)
+        self.assertEqual(log.get("R0")[3], "on-hold-by-admin")
+
+        ino = os.stat(self.path).st_ino
+        log.update("R1", {3: "approved", 4: "checked by admin"})
+        self.assertNotEqual(os.stat(self.path).st_ino, ino)
+        self.assertEqual(log.get("R1"), ["R1", "u1@test", "100", "approved", "checked by admin"])
+        self.assertEqual(log.get("R2"), ["R2", "u2@test", "100", "approved", ""])
+        self.assertEqual(self.totals(log), {"on-hold-by-admin": [1, 100.0], "approved": [2, 200.0]})
+        self.assertEqual(self.totals(log), log.rebuild_totals())
+
+        # Later status patches go back to being written in place
+        ino, size = os.stat(self.path).st_ino, os.path.getsize(self.path)
+        log.update("R2", {3: "paid"})
+        self.assertEqual((os.stat(self.path).st_ino, os.path.getsize(self.path)), (ino, size))
+        self.assertEqual(log.get("R2")[3], "paid")
+
+    def test_unpadded_rows_from_before_fixed_cols_are_patched(self):
+        with open(self.path, "w") as f:
+            f.write(REQUESTS_HEADER + "R0\tu0@test\t100\tpending\t\n"
+                    "R1\tu1@test\t50\tpending\t\nR2\tu2@test\t10\tnew\tnote\n")
+        log = self.open_log()
+
+        # Shorter than the unpadded field: fits in place
+        log.update("R0", {3: "paid"})
+        self.assertIn(b"R0\tu0@test\t100\tpaid   \t\n", self.read())
+        self.assertEqual(log.get("R0")[3], "paid")
+
+        # Longer than the unpadded field: the rewrite pads every row
+        log.update("R1", {3: "approved"})
+        rows = self.read().decode().splitlines()[1:]
+        self.assertEqual([len(row.split("\t")[3]) for row in rows], [STATUS_WIDTH] * 3)
+        self.assertEqual(log.select(), [["R0", "u0@test", "100", "paid", ""],
+                                        ["R1", "u1@test", "50", "approved", ""],
+                                        ["R2", "u2@test", "10", "new", "note"]])
+        self.assertEqual(self.totals(log), {"paid": [1, 100.0], "approved": [1, 50.0],
+                                            "new": [1, 10.0]})
+
+
+class TsvLogSidecarTest(unittest.TestCase):
+    ROWS = [
+        ["R0", "amy@test", "Amy Adams", "pending"],
+        ["R1", "bob@test", "Bob Brown", "pending"],
+        ["R2", "amy@test", "Amy Adams", "approved"],
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "requests.tsv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open_log(self):
+        s = TsvStore(self.dir, fsync=False, checkpoint_seconds=3600)
+        return s.log("requests", self.path, SIDECAR_HEADER, key_col=0, indexes=(0,),
+                     lookup_cols=(0, 1), search_cols=(0, 1, 2), fixed_cols={3: STATUS_WIDTH})
+
+    def warm(self, log):
+        # Build the .idx and .search sidecars against the current file
+        for cols in self.ROWS:
+            self.assertEqual(log.get(cols[0]), cols)
+        self.assertEqual(len(log.select(where={1: "amy@test"})), 2)
+        self.assertEqual([cols[0] for cols in log.search("brown")], ["R1"])
+
+    def write_rows(self, rows, replace):
+        data = SIDECAR_HEADER + "".join("\t".join(cols) + "\n" for cols in rows)
+        if replace:
+            # index.php: a tmp file renamed over the log
+            with open(f"{self.path}.tmp", "w") as f:
+                f.write(data)
+            os.replace(f"{self.path}.tmp", self.path)
+        else:
+            with open(self.path, "w") as f:
+                f.write(data)
+
+    def check(self, log, rows):
+        for cols in rows:
+            self.assertEqual(log.get(cols[0]), cols)
+        self.assertEqual(log.select(where={1: "amy@test"}),
+                         [cols for cols in rows if cols[1] == "amy@test"])
+        for text in ("amy", "brown", "carol", "zed"):
+            expected = [cols for cols in reversed(rows) if text in " ".join(cols[:3]).lower()]
+            self.assertEqual(log.search(text), expected, text)
+            page, _ = log.page(order_by=0, search=((0, 1, 2), text), limit=10)
+            self.assertEqual(sorted(page), sorted(expected), text)
+
+    def rewritten(self):
+        # A status changed, a searched name edited, one row dropped, two added
+        return [
+            ["R0", "amy@test", "Amy Adams", "approved"],
+            ["R1", "bob@test", "Zed Brown", "pending"],
+            ["R3", "carol@test", "Carol Chu", "pending"],
+            ["R4", "amy@test", "Amy Adams", "pending"],
+        ]
+
+    def test_php_style_replacement_is_picked_up(self):
+        log = self.open_log()
+        self.write_rows(self.ROWS, replace=True)
+        self.warm(log)
+        rows = self.rewritten()
+        self.write_rows(rows, replace=True)
+        self.check(log, rows)
+
+    def test_replacement_with_the_same_row_count_is_picked_up(self):
+        log = self.open_log()
+        self.write_rows(self.ROWS, replace=True)
+        self.warm(log)
+        rows = [list(cols) for cols in self.ROWS]
+        rows[1][2] = "Zed Brown"
+        rows[2][3] = "rejected"
+        self.write_rows(rows, replace=True)
+        self.check(log, rows)
+
+    def test_rewrite_in_place_is_picked_up(self):
+        log = self.open_log()
+        self.write_rows(self.ROWS, replace=False)
+        self.warm(log)
+        for rows in (self.rewritten(), self.ROWS[:2]):
+            self.write_rows(rows, replace=False)
+            self.check(log, rows)
+
+    def test_sidecars_are_shared_with_a_process_that_saw_the_old_file(self):
+        log = self.open_log()
+        self.write_rows(self.ROWS, replace=True)
+        self.warm(log)
+        self.warm(self.open_log())
+        rows = self.rewritten()
+        self.write_rows(rows, replace=True)
+        self.check(self.open_log(), rows)
+        self.check(log, rows)
+
+
+if __name__ == "__main__":
+    unittest.main()